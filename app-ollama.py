@@ -1,72 +1,230 @@
 #!/usr/bin/python3
 import os
-from flask import Flask, render_template, request, jsonify
+import asyncio
+from flask import Flask, Response, make_response, render_template, request, jsonify
 import json
 from threading import Thread
-from datetime import datetime
 from time import time
-from ollama import Client
 import sys
-import requests
+import uuid
+
+from rag.streaming import stream_response, stream_mode, iter_sentences
+from rag.answer_cache import AnswerCache, normalize_query
+from rag.embeddings import LazyEmbeddings
+from rag.singleflight import SingleFlight
+from rag.model_registry import ModelRegistry
+from rag.llm_client import llm_client, DEFAULT_MODEL
+from rag.scheduler import SchedulerRejected, ROBOT, API, WEB
+from rag.ros_bridge import RosBridge
+from rag.conversation_log import ConversationLog
+from rag.tracing import tracer
+from rag.context_manager import ContextManager
 
 # Imposta il path principale
 PATH = os.path.expandvars("$HOME/src/marrtinorobot2/marrtinorobot2_chatbot/")
 LOG_PATH = os.path.join(PATH, "log")
 os.makedirs(LOG_PATH, exist_ok=True)
 
-# Inizializza Ollama
-ollama_client = Client(host='http://localhost:11434')
+# Ollama: client condiviso con keep_alive per modello (vedi rag/llm_client.py)
+
+# Cache delle risposte (match esatto + semantico); l'embedding si carica al primo uso,
+# con cache LRU e micro-batch delle query (vedi rag/embeddings.py)
+embedding = LazyEmbeddings('sentence-transformers/all-MiniLM-L6-v2')
+
+answer_cache = AnswerCache(embed_fn=embedding.embed_query, threshold=0.92, max_size=256, ttl=3600)
+
+def cache_key(messages: list, model_name):
+    """(namespace, domanda): il namespace include tutto ciò che precede la domanda (system + storia),
+    così cache e deduplicazione valgono anche a metà conversazione, ma solo con la stessa storia"""
+    if len(messages) < 2 or messages[-1]['role'] != 'user':
+        return None, None
+    context = json.dumps(messages[:-1], ensure_ascii=False, sort_keys=True)
+    namespace = model_name + "|" + str(hash(context))
+    return namespace, messages[-1]['content']
 
 # Funzioni di utilità
-def log_to_file(question, bot_answer):
-    now = datetime.now()
-    data_ora = now.strftime("%d/%m/%Y %H:%M:%S")
-    with open(os.path.join(LOG_PATH, "log.txt"), "a") as log_file:
-        report = data_ora + "\n" + \
-            "[QUESTION]:   " + question + ";" + \
-            "[OLLAMA]: " + bot_answer
-        log_file.write(report + "\n")
-
-    if bot_answer != "":
-        with open(os.path.join(LOG_PATH, "user.txt"), "a") as bot_file:
-            bot_file.write("user: " + question + "\n")
-            bot_file.write("bot: " + bot_answer + "\n")
+# Log delle conversazioni in JSONL: log_conversation ritorna subito, un thread scrive a blocchi e ruota i file
+conversation_log = ConversationLog(LOG_PATH)
+
+def log_conversation(question, bot_answer, **fields):
+    conversation_log.log(question, bot_answer, **fields)
 
 def split_string(msg):
-    print(f"[DEBUG] Risposta grezza del modello: {msg}", file=sys.stderr)
+    tracer.verbose("Risposta grezza del modello", msg)
     if not isinstance(msg, str):
         return "(errore nella risposta del modello)"
     return msg
 
-def send_to_ros2(text, url="http://localhost:5001/send"):
-    try:
-        params = {"text": text}
-        requests.get(url, params=params)
-        print(f"[DEBUG] ✅ Inviato al nodo ROS: {text}", file=sys.stderr)
-    except Exception as e:
-        print(f"[DEBUG] ❌ Errore nell'invio al nodo ROS: {e}", file=sys.stderr)
+# Coda verso il nodo ROS con un thread di consegna: /bot risponde appena il testo è in coda
+ros_bridge = RosBridge("http://localhost:5001/send")
+
+def send_to_ros2(text):
+    ros_bridge.send(text)
+
+# Memoria delle conversazioni: storia per sessione entro un budget di token (vedi rag/context_manager.py).
+# Il primo messaggio è sempre PROMPT_SYSTEM identico byte per byte: Ollama riusa il prefisso già valutato
+context_manager = ContextManager()
+SESSION_COOKIE = 'chat_session'
+
+def chat_session(args, cookies, default=None):
+    """Id della conversazione: parametro session, cookie della UI web o default (None = nessuna memoria)"""
+    return args.get('session') or cookies.get(SESSION_COOKIE) or default
+
+def chat_messages(session_id, query):
+    return context_manager.build_messages(session_id, PROMPT_SYSTEM, query)
+
+def remember(session_id, question, answer):
+    # Gli errori ("(errore: ...)", coda piena) non entrano nella storia
+    if answer and not answer.startswith("("):
+        context_manager.record(session_id, question, answer)
+
+def remember_stream(session_id, question, tokens):
+    parts = []
+    for token in tokens:
+        parts.append(token)
+        yield token
+    remember(session_id, question, "".join(parts))
 
+async def aremember_stream(session_id, question, tokens):
+    parts = []
+    async for token in tokens:
+        parts.append(token)
+        yield token
+    remember(session_id, question, "".join(parts))
 
-def get_response(messages: list, model_name="gemma3:4b"):
-    print(f"[DEBUG] Messaggi inviati al modello ({model_name}): {messages}", file=sys.stderr)
+
+# Richieste identiche in contemporanea (es. una classe intera che chiede la stessa cosa): una sola chiamata
+inflight = SingleFlight()
+
+def get_response(messages: list, model_name="gemma3:4b", priority=WEB, info=None):
+    """info (opzionale): dizionario per il log (cached, coalesced)"""
+    namespace, question = cache_key(messages, model_name)
+    if question is None:
+        return _get_response(messages, model_name, priority, info)
+    key = (namespace, normalize_query(question), 'full')
+    return inflight.do(key, lambda: _get_response(messages, model_name, priority, info), info)
+
+def get_response_stream(messages: list, model_name="gemma3:4b", priority=WEB, info=None):
+    """Come get_response, ma produce i token man mano che Ollama li genera"""
+    namespace, question = cache_key(messages, model_name)
+    if question is None:
+        return _get_response_stream(messages, model_name, priority, info)
+    key = (namespace, normalize_query(question), 'stream')
+    return inflight.stream(key, lambda: _get_response_stream(messages, model_name, priority, info), info)
+
+def _get_response(messages, model_name, priority, info=None):
+    tracer.verbose(f"Messaggi inviati al modello ({model_name})", messages)
+    namespace, question = cache_key(messages, model_name)
+    if question is not None:
+        cached = answer_cache.get(question, namespace=namespace)
+        if cached is not None:
+            _mark_cached(info)
+            return {"role": "assistant", "content": cached}
     try:
         start_time = time()
-        response = ollama_client.chat(
-            model=model_name,
-            messages=messages
-        )
+        response = llm_client.chat(model_name, messages, priority=priority)
         elapsed_time = time() - start_time
-        print(f"[DEBUG] Risposta completa ricevuta: {response}", file=sys.stderr)
-        print(f"[DEBUG] Tempo di risposta del modello: {elapsed_time:.2f} secondi", file=sys.stderr)
+        tracer.verbose(f"Risposta completa ricevuta in {elapsed_time:.2f} secondi", response)
+        if question is not None:
+            answer_cache.put(question, response['message']['content'], namespace=namespace)
+        return response['message']
+    except SchedulerRejected:
+        raise
+    except Exception as e:
+        print(f"[DEBUG] Errore nella chiamata a Ollama: {e}", file=sys.stderr)
+        return {"content": f"(errore: {str(e)})"}
+
+def _get_response_stream(messages, model_name, priority, info=None):
+    tracer.verbose(f"Messaggi inviati al modello ({model_name}) in streaming", messages)
+    namespace, question = cache_key(messages, model_name)
+    if question is not None:
+        cached = answer_cache.get(question, namespace=namespace)
+        if cached is not None:
+            _mark_cached(info)
+            yield cached
+            return
+    try:
+        # Tempo al primo token e tempo di caricamento del modello li misura llm_client
+        parts = []
+        for token in llm_client.chat_stream(model_name, messages, priority=priority):
+            parts.append(token)
+            yield token
+        if question is not None:
+            answer_cache.put(question, "".join(parts), namespace=namespace)
+    except SchedulerRejected as e:
+        yield f"({e})"
+    except Exception as e:
+        print(f"[DEBUG] Errore nella chiamata a Ollama: {e}", file=sys.stderr)
+        yield f"(errore: {str(e)})"
+
+# Versioni asyncio usate da asgi.py: stessa cache e stessa deduplicazione, nessun thread occupato in attesa
+async def get_response_async(messages: list, model_name="gemma3:4b", priority=WEB, info=None):
+    namespace, question = cache_key(messages, model_name)
+    if question is None:
+        return await _get_response_async(messages, model_name, priority, info)
+    key = (namespace, normalize_query(question), 'full')
+    return await inflight.do_async(key, lambda: _get_response_async(messages, model_name, priority, info), info)
+
+def get_response_stream_async(messages: list, model_name="gemma3:4b", priority=WEB, info=None):
+    namespace, question = cache_key(messages, model_name)
+    if question is None:
+        return _get_response_stream_async(messages, model_name, priority, info)
+    key = (namespace, normalize_query(question), 'stream')
+    return inflight.stream_async(key, lambda: _get_response_stream_async(messages, model_name, priority, info),
+                                 info)
+
+def _mark_cached(info):
+    if info is not None:
+        info['cached'] = True
+
+async def _get_response_async(messages, model_name, priority, info=None):
+    namespace, question = cache_key(messages, model_name)
+    if question is not None:
+        cached = await asyncio.to_thread(answer_cache.get, question, namespace=namespace)
+        if cached is not None:
+            _mark_cached(info)
+            return {"role": "assistant", "content": cached}
+    try:
+        response = await llm_client.achat(model_name, messages, priority=priority)
+        if question is not None:
+            await asyncio.to_thread(answer_cache.put, question, response['message']['content'], namespace=namespace)
         return response['message']
+    except SchedulerRejected:
+        raise
     except Exception as e:
         print(f"[DEBUG] Errore nella chiamata a Ollama: {e}", file=sys.stderr)
         return {"content": f"(errore: {str(e)})"}
 
+async def _get_response_stream_async(messages, model_name, priority, info=None):
+    namespace, question = cache_key(messages, model_name)
+    if question is not None:
+        cached = await asyncio.to_thread(answer_cache.get, question, namespace=namespace)
+        if cached is not None:
+            _mark_cached(info)
+            yield cached
+            return
+    try:
+        parts = []
+        async for token in llm_client.achat_stream(model_name, messages, priority=priority):
+            parts.append(token)
+            yield token
+        if question is not None:
+            await asyncio.to_thread(answer_cache.put, question, "".join(parts), namespace=namespace)
+    except SchedulerRejected as e:
+        yield f"({e})"
+    except Exception as e:
+        print(f"[DEBUG] Errore nella chiamata a Ollama: {e}", file=sys.stderr)
+        yield f"(errore: {str(e)})"
+
 # Crea l'app Flask
 app = Flask(__name__)
 app.static_folder = 'static'
 
+@app.errorhandler(SchedulerRejected)
+def scheduler_rejected(e):
+    # Coda piena o attesa scaduta: rifiuto immediato invece di accumulare richieste
+    return jsonify({'error': str(e)}), e.status_code, {'Retry-After': '5'}
+
 PROMPT_SYSTEM = (
     "Sei MARRtino, un robot sociale italiano, simpatico e birichino. "
     "Quando qualcuno ti fa una domanda personale o sulla tua origine, "
@@ -78,71 +236,151 @@ PROMPT_SYSTEM = (
 
 
 
+# Modelli Ollama in cache (aggiornati in background), fallback se Ollama non risponde
+model_registry = ModelRegistry(host='http://localhost:11434', ttl=30, fallback=["codellama:7b"])
+
 @app.route("/")
 def home():
-    try:
-        response = requests.get("http://localhost:11434/api/tags")
-        model_list = response.json().get("models", [])
-        model_names = [model["name"] for model in model_list]
-        print(f"[DEBUG] Modelli disponibili: {model_names}", file=sys.stderr)
-    except Exception as e:
-        print(f"[DEBUG] Errore durante il recupero modelli: {e}", file=sys.stderr)
-        model_names = ["codellama:7b"]  # fallback
-    return render_template("indexollama.html", models=model_names)
+    model_names = model_registry.models()
+    selected_model = model_registry.preferred(default="llama3:latest")
+    return render_template("indexollama.html", models=model_names, selected_model=selected_model,
+                           loaded_models=model_registry.loaded())
+
+@app.route('/scheduler_stats')
+def scheduler_stats():
+    stats = llm_client.scheduler.stats()
+    stats['coalescing'] = inflight.stats()
+    return jsonify(stats)
+
+@app.route('/models')
+def models_status():
+    status = model_registry.status()
+    status['llm'] = llm_client.stats()
+    return jsonify(status)
 
 
 
 @app.route("/get")
+@tracer.traced('/get')
 def get_bot_response():
     myquery = request.args.get('msg')
     model_name = request.args.get('model', "gemma3:4b")
-    print(f"[DEBUG] Messaggio ricevuto dal client: {myquery}", file=sys.stderr)
-    print(f"[DEBUG] Modello selezionato: {model_name}", file=sys.stderr)
-    messages = [
-        {"role": "system", "content": PROMPT_SYSTEM},
-        {"role": "user", "content": myquery}
-    ]
-    new_message = get_response(messages, model_name)
-    msgout = split_string(new_message['content'])
-    log_to_file(myquery, msgout)
-    return msgout
+    tracer.verbose(f"Messaggio ricevuto dal client ({model_name})", myquery)
+    # La UI web non passa session: la conversazione si riconosce dal cookie
+    session_id = chat_session(request.args, request.cookies) or uuid.uuid4().hex
+    messages = chat_messages(session_id, myquery)
+    mode = stream_mode(request.args.get('stream'))
+    info = {}
+    if mode:
+        llm_client.scheduler.check_capacity()
+        tokens = remember_stream(session_id, myquery,
+                                 get_response_stream(messages, model_name, priority=WEB, info=info))
+        response = stream_response(conversation_log.wrap_stream(myquery, tokens, info, route='/get', model=model_name,
+                                                                stream=mode, session=session_id), mode)
+    else:
+        start_time = time()
+        new_message = get_response(messages, model_name, priority=WEB, info=info)
+        msgout = split_string(new_message['content'])
+        remember(session_id, myquery, msgout)
+        log_conversation(myquery, msgout, route='/get', model=model_name, session=session_id,
+                         latency=round(time() - start_time, 3), **info)
+        response = make_response(msgout)
+    response.set_cookie(SESSION_COOKIE, session_id, httponly=True, samesite='Lax')
+    return response
 
 @app.route('/bot')
+@tracer.traced('/bot')
 def bot():
     myquery = request.args.get('query')
     model_name = request.args.get('model', "gemma3:4b")
-    print(f"[DEBUG] Richiesta /bot ricevuta: {myquery}", file=sys.stderr)
-    print(f"[DEBUG] Modello selezionato: {model_name}", file=sys.stderr)
-    messages = [
-        {"role": "system", "content": PROMPT_SYSTEM},
-        {"role": "user", "content": myquery}
-    ]
-    new_message = get_response(messages, model_name)
+    tracer.verbose(f"Richiesta /bot ricevuta ({model_name})", myquery)
+    # Senza session il robot resta senza memoria (come /json)
+    session_id = request.args.get('session')
+    messages = chat_messages(session_id, myquery)
+    start_time = time()
+    info = {}
+    # Il robot ha la priorità sulla UI web nello scheduler
+    if stream_mode(request.args.get('stream')):
+        llm_client.scheduler.check_capacity()
+        # Ogni frase completa va subito in coda verso il nodo ROS: il TTS parla mentre il modello genera
+        sentences = []
+        for sentence in iter_sentences(get_response_stream(messages, model_name, priority=ROBOT, info=info)):
+            send_to_ros2(sentence)
+            sentences.append(sentence)
+        msgout = split_string(" ".join(sentences))
+        remember(session_id, myquery, msgout)
+        log_conversation(myquery, msgout, route='/bot', model=model_name, stream='text', session=session_id,
+                         latency=round(time() - start_time, 3), **info)
+        return msgout
+
+    new_message = get_response(messages, model_name, priority=ROBOT, info=info)
     msgout = split_string(new_message['content'])
-    log_to_file(myquery, msgout)
+    remember(session_id, myquery, msgout)
+    # Solo accodamento: la consegna (con retry) la fa il thread del bridge
     send_to_ros2(msgout)
+    log_conversation(myquery, msgout, route='/bot', model=model_name, session=session_id,
+                     latency=round(time() - start_time, 3), **info)
 
     return msgout
 
 @app.route('/json')
+@tracer.traced('/json')
 def json_response():
     myquery = request.args.get('query')
     model_name = request.args.get('model', "gemma3:4b")
-    print(f"[DEBUG] Richiesta /json ricevuta: {myquery}", file=sys.stderr)
-    print(f"[DEBUG] Modello selezionato: {model_name}", file=sys.stderr)
-    messages = [
-        {"role": "system", "content": PROMPT_SYSTEM},
-        {"role": "user", "content": myquery}
-    ]
-    new_message = get_response(messages, model_name)
+    tracer.verbose(f"Richiesta /json ricevuta ({model_name})", myquery)
+    # API senza stato, a meno che il client non passi session
+    session_id = request.args.get('session')
+    messages = chat_messages(session_id, myquery)
+    if stream_mode(request.args.get('stream')):
+        llm_client.scheduler.check_capacity()
+        tokens = remember_stream(session_id, myquery, get_response_stream(messages, model_name, priority=API))
+        return stream_response(tokens, 'sse')
+    new_message = get_response(messages, model_name, priority=API)
     msg = new_message['content']
+    remember(session_id, myquery, msg)
     msgjson = {
         "response": msg,
         "action": "ok"
     }
     return jsonify(msgjson)
 
+@app.route('/metrics')
+def metrics():
+    # Prometheus di default, ?format=json per una lettura rapida
+    if request.args.get('format') == 'json':
+        return jsonify(tracer.to_dict())
+    return Response(tracer.prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/reset_session')
+def reset_session():
+    session_id = chat_session(request.args, request.cookies)
+    if session_id:
+        context_manager.reset(session_id)
+    return jsonify({'session': session_id, 'action': 'reset'})
+
+@app.route('/context_stats')
+def context_stats():
+    return jsonify(context_manager.stats())
+
+@app.route('/log_stats')
+def log_stats():
+    return jsonify(conversation_log.stats())
+
+@app.route('/ros_stats')
+def ros_stats():
+    return jsonify(ros_bridge.stats())
+
+@app.route('/cache_stats')
+def cache_stats():
+    stats = answer_cache.stats()
+    stats['embedding'] = embedding.stats()
+    return jsonify(stats)
+
 if __name__ == '__main__':
     print("ChatBot with Ollama v.1.01")
     myip = '0.0.0.0'
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        model_registry.start()
+        llm_client.preload_async(DEFAULT_MODEL)
     app.run(host=myip, debug=True, port=8060)
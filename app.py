@@ -1,12 +1,20 @@
 # App.py
 ##################################################
-from flask import Flask, render_template, request, redirect, url_for, jsonify, session, send_from_directory
-from rag.rag_chain import ask_question, ingest_pdfs, get_indexed_chunks, clear_vectorstore
+import time
+STARTUP_AT = time.time()
+
+from flask import Flask, Response, render_template, request, redirect, url_for, jsonify, session, send_from_directory, send_file
+from rag.rag_chain import ask_question, ask_question_stream, ingest_pdfs, list_indexed_chunks, retrieve, search_indexed_chunks, clear_vectorstore, get_vectorstore_stats, get_answer_cache_stats, get_ingest_progress, start_warmup, get_warmup_status, get_inflight_stats, get_embedding_stats, get_poem_catalog_stats, export_indexed_chunks, get_chunks_pdf
 from rag.pdf_manager import save_pdf, list_pdfs, delete_pdf
+from rag.streaming import stream_response, stream_mode
+from rag.jobs import JobQueue
+from rag.model_registry import ModelRegistry
+from rag.llm_client import llm_client, DEFAULT_MODEL
+from rag.scheduler import SchedulerRejected, API, WEB
+from rag.ros_bridge import RosBridge
+from rag.conversation_log import ConversationLog
+from rag.tracing import tracer
 import os
-import subprocess
-import time
-from fpdf import FPDF
 import sys
 
 app = Flask(__name__)
@@ -14,19 +22,26 @@ app.secret_key = 'supersegretissimo'
 UPLOAD_FOLDER = 'data/pdfs'
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
+# Log delle conversazioni in JSONL (con i dati del recupero), scritto a blocchi da un thread
+conversation_log = ConversationLog('data/logs')
+
+# Le indicizzazioni girano in background, una alla volta (scrivono tutte lo stesso indice)
+job_queue = JobQueue(workers=1)
+
+@app.errorhandler(SchedulerRejected)
+def scheduler_rejected(e):
+    # Meglio un rifiuto immediato che accodare richieste che rallentano tutte le altre
+    return jsonify({'error': str(e)}), e.status_code, {'Retry-After': '5'}
+
 ##################################
 # Funzioni ROS2
 ##################################
 
-def send_to_ros2(text, url="http://10.3.1.1:5001/send"):
-    try:
-        params = {"text": text}
-        requests.get(url, params=params)
-        print(f"[DEBUG] ✅ Inviato al nodo ROS: {text}", file=sys.stderr)
-    except Exception as e:
-        print(f"[DEBUG] ❌ Errore nell'invio al nodo ROS: {e}", file=sys.stderr)
-
+# Le frasi vanno in coda e un thread le consegna al nodo ROS: le route non aspettano mai il robot
+ros_bridge = RosBridge("http://10.3.1.1:5001/send")
 
+def send_to_ros2(text):
+    ros_bridge.send(text)
 
 
 #############################
@@ -34,49 +49,47 @@ def send_to_ros2(text, url="http://10.3.1.1:5001/send"):
 #############################
 
 def split_string(msg):
-    print(f"[DEBUG] Risposta grezza del modello: {msg}", file=sys.stderr)
+    tracer.verbose("Risposta grezza del modello", msg)
     if not isinstance(msg, str):
         return "(errore nella risposta del modello)"
     return msg
 
+# Elenco modelli da Ollama (HTTP), in cache e aggiornato in background: la home non aspetta mai.
+# Se Ollama non ha ancora risposto si propone almeno il modello di default usato dalle route
+model_registry = ModelRegistry(ttl=30, fallback=[DEFAULT_MODEL])
+
 def get_installed_models():
+    return model_registry.models()
+
+
+
+def get_response(messages: list, model_name="gemma3:4b", priority=WEB):
+    tracer.verbose(f"Messaggi inviati al modello ({model_name})", messages)
     try:
-        result = subprocess.run(['ollama', 'list'], capture_output=True, text=True, check=True)
-        lines = result.stdout.strip().split('\n')
-        models = []
-        for line in lines[1:]:  # Salta l'intestazione
-            parts = line.split()
-            if parts:
-                models.append(parts[0])
-        return models
-    except subprocess.CalledProcessError as e:
-        print(f"Errore nell'esecuzione di 'ollama list': {e}")
-        return []
-
-
-
-def get_response(messages: list, model_name="gemma3:4b"):
-    print(f"[DEBUG] Messaggi inviati al modello ({model_name}): {messages}", file=sys.stderr)
-    try:
-        start_time = time()
-        response = ollama_client.chat(
-            model=model_name,
-            messages=messages
-        )
-        elapsed_time = time() - start_time
-        print(f"[DEBUG] Risposta completa ricevuta: {response}", file=sys.stderr)
-        print(f"[DEBUG] Tempo di risposta del modello: {elapsed_time:.2f} secondi", file=sys.stderr)
+        start_time = time.time()
+        response = llm_client.chat(model_name, messages, priority=priority)
+        elapsed_time = time.time() - start_time
+        tracer.verbose(f"Risposta completa ricevuta in {elapsed_time:.2f} secondi", response)
         return response['message']
+    except SchedulerRejected:
+        raise
     except Exception as e:
         print(f"[DEBUG] Errore nella chiamata a Ollama: {e}", file=sys.stderr)
         return {"content": f"(errore: {str(e)})"}
 
 @app.route("/get")
+@tracer.traced('/get')
 def get_bot_response():
     question = request.args.get('msg')
     model_name = request.args.get('model', "gemma3:4b")
-    print(f"[DEBUG] Messaggio ricevuto dal client: {question}", file=sys.stderr)
-    print(f"[DEBUG] Modello selezionato: {model_name}", file=sys.stderr)
+    tracer.verbose(f"Messaggio ricevuto dal client ({model_name})", question)
+    mode = stream_mode(request.args.get('stream'))
+    info = {}
+    if mode:
+        llm_client.scheduler.check_capacity()
+        tokens = ask_question_stream(question, model_name, priority=WEB, info=info)
+        return stream_response(conversation_log.wrap_stream(question, tokens, info, route='/get',
+                                                            model=model_name, stream=mode), mode)
     # messages = [
     #     {"role": "system", "content": PROMPT_SYSTEM},
     #     {"role": "user", "content": myquery}
@@ -85,20 +98,24 @@ def get_bot_response():
        
     start_time = time.time()
     # Ignora il system_message dell'utente, usa quello interno ottimizzato
-    answer = ask_question(question, model_name)
+    answer = ask_question(question, model_name, priority=WEB, info=info)
     duration = round(time.time() - start_time, 2)
     msgout = split_string(answer)
-    #log_to_file(myquery, msgout)
+    conversation_log.log(question, msgout, route='/get', model=model_name, latency=duration, **info)
     return msgout
 
 @app.route('/json')
+@tracer.traced('/json')
 def json_response():
     question = request.args.get('query')
     model_name = request.args.get('model', "gemma3:4b")
-    print(f"[DEBUG] Richiesta /json ricevuta: {question}", file=sys.stderr)
-    print(f"[DEBUG] Modello selezionato: {model_name}", file=sys.stderr)
+    tracer.verbose(f"Richiesta /json ricevuta ({model_name})", question)
+    # In streaming /json usa sempre Server-Sent Events (un oggetto JSON per evento)
+    if stream_mode(request.args.get('stream')):
+        llm_client.scheduler.check_capacity()
+        return stream_response(ask_question_stream(question, model_name, priority=API), 'sse')
 
-    answer = ask_question(question, model_name)
+    answer = ask_question(question, model_name, priority=API)
 
     # Torna SEMPRE un oggetto JSON con la chiave 'response'
     return jsonify({"response": answer, "action": "ok"})
@@ -109,26 +126,38 @@ def json_response():
 @app.route('/')
 def index():
     pdf_files = list_pdfs()
-    chunks = get_indexed_chunks()
     models = get_installed_models()
-    return render_template('index.html', pdf_files=pdf_files, chunks=chunks, models=models)
+    selected_model = model_registry.preferred(default="gemma3:4b")
+    return render_template('index.html', pdf_files=pdf_files, models=models,
+                           selected_model=selected_model, loaded_models=model_registry.loaded())
 
 
 
 
 @app.route('/ask', methods=['POST'])
+@tracer.traced('/ask')
 def ask():
     question = request.form['question']
-    print(f"[DEBUG] Richiesta  ricevuta: {question}", file=sys.stderr)
+    tracer.verbose("Richiesta /ask ricevuta", question)
     model_name = request.form.get('model', 'mistral')
     system_message = request.form.get('system_message', '').strip()
+    mode = stream_mode(request.form.get('stream'))
+    info = {}
+    if mode:
+        llm_client.scheduler.check_capacity()
+        tokens = ask_question_stream(question, model_name, priority=WEB, info=info)
+        return stream_response(conversation_log.wrap_stream(question, tokens, info, route='/ask',
+                                                            model=model_name, stream=mode), mode)
 
     try:
         start_time = time.time()
         # Ignora il system_message dell'utente, usa quello interno ottimizzato
-        answer = ask_question(question, model_name)
+        answer = ask_question(question, model_name, priority=WEB, info=info)
         duration = round(time.time() - start_time, 2)
+        conversation_log.log(question, answer, route='/ask', model=model_name, latency=duration, **info)
         return jsonify({'answer': answer, 'time': duration})
+    except SchedulerRejected:
+        raise
     except Exception as e:
         return jsonify({'error': str(e)}), 500
     
@@ -137,10 +166,100 @@ def clear_chunks():
     clear_vectorstore()
     return redirect(url_for('index'))
 
+@app.route('/health')
+def health():
+    status = get_warmup_status()
+    status['startup_seconds'] = app.config.get('STARTUP_SECONDS')
+    return jsonify(status)
+
+@app.route('/ready')
+def ready():
+    # 200 solo quando modello di embedding e indici sono caricati
+    status = get_warmup_status()
+    return jsonify(status), 200 if status['state'] == 'ready' else 503
+
+@app.route('/scheduler_stats')
+def scheduler_stats():
+    stats = llm_client.scheduler.stats()
+    stats['coalescing'] = get_inflight_stats()
+    return jsonify(stats)
+
+@app.route('/metrics')
+def metrics():
+    # Prometheus di default, ?format=json per una lettura rapida
+    if request.args.get('format') == 'json':
+        return jsonify(tracer.to_dict())
+    return Response(tracer.prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/log_stats')
+def log_stats():
+    return jsonify(conversation_log.stats())
+
+@app.route('/ros_stats')
+def ros_stats():
+    return jsonify(ros_bridge.stats())
+
+@app.route('/models')
+def models_status():
+    status = model_registry.status()
+    status['llm'] = llm_client.stats()
+    return jsonify(status)
+
+@app.route('/vectorstore_stats')
+def vectorstore_stats():
+    return jsonify(get_vectorstore_stats())
+
+@app.route('/retrieve')
+def retrieve_debug():
+    # Punteggi e tempi del recupero ibrido, per confrontare qualità e latenza
+    query = request.args.get('q', '')
+    query_type = request.args.get('type', 'generic')
+    k = request.args.get('k', type=int)
+    cutoff = request.args.get('cutoff', type=float)
+    return jsonify(retrieve(query, query_type, k=k, score_cutoff=cutoff).to_dict())
+
+@app.route('/cache_stats')
+def cache_stats():
+    return jsonify(get_answer_cache_stats())
+
+@app.route('/embedding_stats')
+def embedding_stats():
+    return jsonify(get_embedding_stats())
+
+@app.route('/poem_catalog_stats')
+def poem_catalog_stats():
+    return jsonify(get_poem_catalog_stats())
+
+CHUNKS_PER_PAGE = 100
+
+def chunk_filters(args):
+    return {key: args.get(key) for key in ('source', 'title', 'type') if args.get(key)}
+
 @app.route("/chunks")
 def chunks():
-    chunks = get_indexed_chunks()
-    return render_template("chunks.html", chunks=chunks)
+    page = max(1, request.args.get('page', 1, type=int))
+    filters = chunk_filters(request.args)
+    result = list_indexed_chunks(limit=CHUNKS_PER_PAGE, offset=(page - 1) * CHUNKS_PER_PAGE, filters=filters)
+    chunks = [c['content'] for c in result['chunks']]
+    return render_template("chunks.html", chunks=chunks, page=page, filters=filters,
+                           has_next=result['next_cursor'] is not None, total=result['total'])
+
+@app.route('/api/chunks')
+def api_chunks():
+    # Paginazione con cursor (consigliata) oppure offset; filtri: source, title, type
+    limit = min(1000, max(1, request.args.get('limit', CHUNKS_PER_PAGE, type=int)))
+    offset = max(0, request.args.get('offset', 0, type=int))
+    cursor = request.args.get('cursor')
+    if cursor not in (None, ''):
+        # Il cursor è una posizione nell'indice: intero non negativo
+        try:
+            cursor = int(cursor)
+        except ValueError:
+            return jsonify({'error': f"cursor non valido: {cursor}"}), 400
+        if cursor < 0:
+            return jsonify({'error': f"cursor non valido: {cursor}"}), 400
+    return jsonify(list_indexed_chunks(limit=limit, offset=offset, cursor=cursor,
+                                       filters=chunk_filters(request.args)))
 
 #########################
 # GESTIONE PDF -> /manage
@@ -163,14 +282,57 @@ def upload():
             paths.append(saved_path)
 
     if paths:
-        num_chunks, chunks = ingest_pdfs(paths)
-        logs.append(f"[INGEST] Totale chunk indicizzati: {num_chunks}")
-        for i, chunk in enumerate(chunks[:5]):
-            logs.append(f"[CHUNK {i}] {chunk.page_content[:80]}...")
+        job = enqueue_ingestion(paths)
+        logs.append(f"[JOB {job.id}] Indicizzazione in coda: {len(paths)} PDF")
 
     pdf_files = list_pdfs()
     return render_template("manage.html", pdf_files=pdf_files, log_messages=logs)
 
+def ingest_job(job, paths):
+    num_chunks, chunks = ingest_pdfs(paths, job=job)
+    return {
+        'chunks': num_chunks,
+        'preview': [chunk.page_content[:80] for chunk in chunks[:5]],
+    }
+
+def enqueue_ingestion(paths):
+    names = ", ".join(os.path.basename(p) for p in paths)
+    return job_queue.submit('ingest', ingest_job, paths, description=names)
+
+@app.route('/ingest_progress')
+def ingest_progress():
+    return jsonify(get_ingest_progress())
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    return jsonify(job_queue.list())
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    # Reindicizza i PDF indicati (campo 'pdfs') oppure tutti quelli caricati
+    names = request.form.getlist('pdfs') or (request.get_json(silent=True) or {}).get('pdfs') or list_pdfs()
+    paths = [os.path.abspath(os.path.join(app.config['UPLOAD_FOLDER'], name))
+             for name in names if name.endswith('.pdf')]
+    paths = [p for p in paths if os.path.exists(p)]
+    if not paths:
+        return jsonify({'error': 'Nessun PDF da indicizzare'}), 400
+    job = enqueue_ingestion(paths)
+    return jsonify(job.to_dict()), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job non trovato'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    job = job_queue.cancel(job_id)
+    if job is None:
+        return jsonify({'error': 'Job non trovato'}), 404
+    return jsonify(job.to_dict())
+
 @app.route('/delete_pdf/<filename>', methods=['POST'])
 def delete_pdf_route(filename):
     delete_pdf(filename)
@@ -182,35 +344,44 @@ def delete_pdf_route(filename):
 def serve_pdf(filename):
     return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
 
+EXPORT_FORMATS = {
+    'text': ('text/plain; charset=utf-8', 'chunks_export.txt'),
+    'jsonl': ('application/x-ndjson; charset=utf-8', 'chunks_export.jsonl'),
+}
+
 @app.route('/export_chunks')
 def export_chunks():
-    chunks = get_indexed_chunks()
-    response = "\n\n".join(chunks)
-    return response, 200, {
-        'Content-Type': 'text/plain; charset=utf-8',
-        'Content-Disposition': 'attachment; filename=chunks_export.txt'
-    }
+    # ?format=jsonl per avere anche i metadati; stessi filtri di /api/chunks
+    kind = request.args.get('format', 'text')
+    if kind not in EXPORT_FORMATS:
+        return jsonify({'error': f"Formato non supportato: {kind}"}), 400
+    etag, lines = export_indexed_chunks(kind, chunk_filters(request.args))
+    # L'indice non è cambiato: il client ha già questa esportazione
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers={'ETag': f'"{etag}"'})
+    mimetype, filename = EXPORT_FORMATS[kind]
+    response = Response(lines, mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename={filename}',
+        'Cache-Control': 'no-cache',
+    })
+    response.set_etag(etag)
+    return response
 
 @app.route('/search_chunks', methods=['GET'])
 def search_chunks():
     query = request.args.get('q', '').lower()
-    chunks = get_indexed_chunks()
-    results = [c for c in chunks if query in c.lower()]
+    results = search_indexed_chunks(query)
     return render_template("chunks.html", chunks=results, query=query)
 
 
 @app.route('/export_chunks_pdf')
 def export_chunks_pdf():
-    chunks = get_indexed_chunks()
-    pdf = FPDF()
-    pdf.add_page()
-    pdf.set_auto_page_break(auto=True, margin=15)
-    pdf.set_font("Arial", size=10)
-    for chunk in chunks:
-        pdf.multi_cell(0, 10, chunk + "\n")
-    pdf_output = os.path.join("data", "export_chunks.pdf")
-    pdf.output(pdf_output)
-    return send_from_directory("data", "export_chunks.pdf", as_attachment=True)
+    # Generato alla prima richiesta dopo ogni indicizzazione; If-None-Match -> 304
+    etag, path = get_chunks_pdf()
+    response = send_file(os.path.abspath(path), mimetype='application/pdf', as_attachment=True,
+                         download_name='export_chunks.pdf', etag=etag, conditional=True)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 
 #########################
@@ -220,4 +391,13 @@ if __name__ == '__main__':
     print("ChatBot with PyOllama v.1.01")
     print(" ")
     myip = '0.0.0.0'
+    # Tempo di avvio a freddo: dall'inizio dell'import fino a un attimo prima di aprire la porta
+    app.config['STARTUP_SECONDS'] = round(time.time() - STARTUP_AT, 3)
+    print(f"[INFO] Avvio completato in {app.config['STARTUP_SECONDS']} secondi")
+    # Con il reloader di debug il processo padre fa solo da osservatore: riscalda solo il figlio.
+    # Il breve ritardo lascia che il server sia in ascolto prima di caricare torch e FAISS.
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_warmup(delay=0.5)
+        model_registry.start()
+        llm_client.preload_async(DEFAULT_MODEL)
     app.run(host=myip, debug=True, port=8060)
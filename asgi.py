@@ -0,0 +1,276 @@
+#!/usr/bin/python3
+# File: asgi.py
+# Descrizione: Modalità di servizio asyncio (ASGI) per app.py e app-ollama.py, con avvio di produzione uvicorn
+#
+# Le route che aspettano Ollama (/get, /json, /ask, /bot) sono riscritte con il client asincrono:
+# un solo worker tiene aperte centinaia di connessioni in attesa (anche in streaming) senza un thread
+# per ciascuna. Tutte le altre route (/upload, /manage, /chunks, ...) restano quelle Flask, montate
+# tramite WSGI: sono brevi (l'indicizzazione gira già in background nella coda dei job).
+#
+# Avvio:
+#   python asgi.py --app rag  --port 8060     (app.py)
+#   python asgi.py --app chat --port 8060     (app-ollama.py)
+
+import argparse
+import importlib.util
+import os
+import time
+import uuid
+from contextlib import asynccontextmanager
+
+STARTUP_AT = time.time()
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+from rag.llm_client import llm_client, DEFAULT_MODEL
+from rag.scheduler import SchedulerRejected, ROBOT, API, WEB
+from rag.streaming import aiter_sentences, sse_event, stream_mode
+from rag.tracing import tracer
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Thread per le route Flask montate via WSGI
+WSGI_THREADS = 16
+
+
+def scheduler_rejected(request, exc):
+    # Coda piena o attesa scaduta: stesso comportamento delle app Flask
+    return JSONResponse({'error': str(exc)}, status_code=exc.status_code, headers={'Retry-After': '5'})
+
+
+def stream_body(tokens, mode):
+    """Risposta in streaming da un generatore asincrono di token: 'sse' o testo chunked"""
+    if mode == 'sse':
+        async def generate():
+            async for token in tokens:
+                yield sse_event({"token": token})
+            yield sse_event({"done": True}, event="end")
+        media_type = 'text/event-stream'
+    else:
+        async def generate():
+            async for token in tokens:
+                yield token
+        media_type = 'text/plain; charset=utf-8'
+    return StreamingResponse(generate(), media_type=media_type,
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def load_chat_module():
+    """app-ollama.py non si può importare con import (trattino nel nome)"""
+    spec = importlib.util.spec_from_file_location('app_ollama', os.path.join(BASE_DIR, 'app-ollama.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+##################################
+# app.py (RAG)
+##################################
+
+def create_rag_app():
+    import app as app_module
+    from rag.rag_chain import ask_question_async, ask_question_stream_async, start_warmup
+
+    @tracer.traced('/get')
+    async def get_bot_response(request):
+        question = request.query_params.get('msg')
+        model_name = request.query_params.get('model', "gemma3:4b")
+        tracer.verbose(f"Messaggio ricevuto dal client ({model_name})", question)
+        mode = stream_mode(request.query_params.get('stream'))
+        info = {}
+        if mode:
+            llm_client.scheduler.check_capacity()
+            tokens = ask_question_stream_async(question, model_name, priority=WEB, info=info)
+            return stream_body(app_module.conversation_log.awrap_stream(question, tokens, info, route='/get',
+                                                                        model=model_name, stream=mode), mode)
+        start_time = time.time()
+        answer = await ask_question_async(question, model_name, priority=WEB, info=info)
+        msgout = app_module.split_string(answer)
+        app_module.conversation_log.log(question, msgout, route='/get', model=model_name,
+                                        latency=round(time.time() - start_time, 3), **info)
+        return PlainTextResponse(msgout)
+
+    @tracer.traced('/json')
+    async def json_response(request):
+        question = request.query_params.get('query')
+        model_name = request.query_params.get('model', "gemma3:4b")
+        tracer.verbose(f"Richiesta /json ricevuta ({model_name})", question)
+        if stream_mode(request.query_params.get('stream')):
+            llm_client.scheduler.check_capacity()
+            return stream_body(ask_question_stream_async(question, model_name, priority=API), 'sse')
+        answer = await ask_question_async(question, model_name, priority=API)
+        return JSONResponse({"response": answer, "action": "ok"})
+
+    @tracer.traced('/ask')
+    async def ask(request):
+        form = await request.form()
+        question = form['question']
+        tracer.verbose("Richiesta /ask ricevuta", question)
+        model_name = form.get('model', 'mistral')
+        mode = stream_mode(form.get('stream'))
+        info = {}
+        if mode:
+            llm_client.scheduler.check_capacity()
+            tokens = ask_question_stream_async(question, model_name, priority=WEB, info=info)
+            return stream_body(app_module.conversation_log.awrap_stream(question, tokens, info, route='/ask',
+                                                                        model=model_name, stream=mode), mode)
+        try:
+            start_time = time.time()
+            answer = await ask_question_async(question, model_name, priority=WEB, info=info)
+            duration = round(time.time() - start_time, 2)
+            app_module.conversation_log.log(question, answer, route='/ask', model=model_name, latency=duration, **info)
+            return JSONResponse({'answer': answer, 'time': duration})
+        except SchedulerRejected:
+            raise
+        except Exception as e:
+            return JSONResponse({'error': str(e)}, status_code=500)
+
+    @asynccontextmanager
+    async def lifespan(app):
+        app_module.app.config['STARTUP_SECONDS'] = round(time.time() - STARTUP_AT, 3)
+        print(f"[INFO] Avvio completato in {app_module.app.config['STARTUP_SECONDS']} secondi")
+        start_warmup(delay=0.5)
+        app_module.model_registry.start()
+        llm_client.preload_async(DEFAULT_MODEL)
+        yield
+        app_module.model_registry.stop()
+        app_module.ros_bridge.stop()
+
+    routes = [
+        Route('/get', get_bot_response),
+        Route('/json', json_response),
+        Route('/ask', ask, methods=['POST']),
+        Mount('/', WSGIMiddleware(app_module.app, workers=WSGI_THREADS)),
+    ]
+    return Starlette(routes=routes, lifespan=lifespan,
+                     exception_handlers={SchedulerRejected: scheduler_rejected})
+
+
+##################################
+# app-ollama.py (chat + robot)
+##################################
+
+def create_chat_app():
+    chat = load_chat_module()
+
+    @tracer.traced('/get')
+    async def get_bot_response(request):
+        myquery = request.query_params.get('msg')
+        model_name = request.query_params.get('model', "gemma3:4b")
+        tracer.verbose(f"Messaggio ricevuto dal client ({model_name})", myquery)
+        session_id = chat.chat_session(request.query_params, request.cookies) or uuid.uuid4().hex
+        messages = chat.chat_messages(session_id, myquery)
+        mode = stream_mode(request.query_params.get('stream'))
+        info = {}
+        if mode:
+            llm_client.scheduler.check_capacity()
+            tokens = chat.aremember_stream(session_id, myquery,
+                                           chat.get_response_stream_async(messages, model_name, priority=WEB,
+                                                                          info=info))
+            response = stream_body(chat.conversation_log.awrap_stream(myquery, tokens, info, route='/get',
+                                                                      model=model_name, stream=mode,
+                                                                      session=session_id), mode)
+        else:
+            start_time = time.time()
+            new_message = await chat.get_response_async(messages, model_name, priority=WEB, info=info)
+            msgout = chat.split_string(new_message['content'])
+            chat.remember(session_id, myquery, msgout)
+            chat.log_conversation(myquery, msgout, route='/get', model=model_name, session=session_id,
+                                  latency=round(time.time() - start_time, 3), **info)
+            response = PlainTextResponse(msgout)
+        response.set_cookie(chat.SESSION_COOKIE, session_id, httponly=True, samesite='lax')
+        return response
+
+    @tracer.traced('/bot')
+    async def bot(request):
+        myquery = request.query_params.get('query')
+        model_name = request.query_params.get('model', "gemma3:4b")
+        tracer.verbose(f"Richiesta /bot ricevuta ({model_name})", myquery)
+        session_id = request.query_params.get('session')
+        messages = chat.chat_messages(session_id, myquery)
+        start_time = time.time()
+        info = {}
+        if stream_mode(request.query_params.get('stream')):
+            llm_client.scheduler.check_capacity()
+            sentences = []
+            tokens = chat.get_response_stream_async(messages, model_name, priority=ROBOT, info=info)
+            async for sentence in aiter_sentences(tokens):
+                chat.send_to_ros2(sentence)
+                sentences.append(sentence)
+            msgout = chat.split_string(" ".join(sentences))
+            chat.remember(session_id, myquery, msgout)
+            chat.log_conversation(myquery, msgout, route='/bot', model=model_name, stream='text', session=session_id,
+                                  latency=round(time.time() - start_time, 3), **info)
+            return PlainTextResponse(msgout)
+
+        new_message = await chat.get_response_async(messages, model_name, priority=ROBOT, info=info)
+        msgout = chat.split_string(new_message['content'])
+        chat.remember(session_id, myquery, msgout)
+        chat.send_to_ros2(msgout)
+        chat.log_conversation(myquery, msgout, route='/bot', model=model_name, session=session_id,
+                              latency=round(time.time() - start_time, 3), **info)
+        return PlainTextResponse(msgout)
+
+    @tracer.traced('/json')
+    async def json_response(request):
+        myquery = request.query_params.get('query')
+        model_name = request.query_params.get('model', "gemma3:4b")
+        tracer.verbose(f"Richiesta /json ricevuta ({model_name})", myquery)
+        session_id = request.query_params.get('session')
+        messages = chat.chat_messages(session_id, myquery)
+        if stream_mode(request.query_params.get('stream')):
+            llm_client.scheduler.check_capacity()
+            tokens = chat.aremember_stream(session_id, myquery,
+                                           chat.get_response_stream_async(messages, model_name, priority=API))
+            return stream_body(tokens, 'sse')
+        new_message = await chat.get_response_async(messages, model_name, priority=API)
+        chat.remember(session_id, myquery, new_message['content'])
+        return JSONResponse({"response": new_message['content'], "action": "ok"})
+
+    @asynccontextmanager
+    async def lifespan(app):
+        chat.model_registry.start()
+        llm_client.preload_async(DEFAULT_MODEL)
+        yield
+        chat.model_registry.stop()
+        chat.ros_bridge.stop()
+
+    routes = [
+        Route('/get', get_bot_response),
+        Route('/bot', bot),
+        Route('/json', json_response),
+        Mount('/', WSGIMiddleware(chat.app, workers=WSGI_THREADS)),
+    ]
+    return Starlette(routes=routes, lifespan=lifespan,
+                     exception_handlers={SchedulerRejected: scheduler_rejected})
+
+
+##################################
+# Avvio di produzione
+##################################
+
+def main():
+    parser = argparse.ArgumentParser(description="Avvio del chatbot con uvicorn (server ASGI)")
+    parser.add_argument('--app', choices=['rag', 'chat'], default='rag',
+                        help="rag = app.py (PDF e RAG), chat = app-ollama.py (chat e robot)")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8060)
+    # Ogni worker ha la sua coda del LLM, le sue cache e la sua coda di indicizzazione:
+    # con un solo Ollama dietro conviene restare a 1
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--limit-concurrency', type=int, default=1000,
+                        help="Connessioni contemporanee oltre le quali uvicorn risponde 503")
+    args = parser.parse_args()
+
+    import uvicorn
+    print(f"ChatBot ASGI ({args.app}) su {args.host}:{args.port}")
+    uvicorn.run(f"asgi:create_{args.app}_app", factory=True, host=args.host, port=args.port,
+                workers=args.workers, limit_concurrency=args.limit_concurrency,
+                timeout_keep_alive=30, log_level='info')
+
+
+if __name__ == '__main__':
+    main()
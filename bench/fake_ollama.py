@@ -0,0 +1,187 @@
+# File: fake_ollama.py
+# Descrizione: Server Ollama finto per i benchmark offline (latenza e velocità in token/s configurabili)
+#
+#   python -m bench.fake_ollama --port 11500 --token-rate 20 --latency 0.3
+
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = ("la gatta sul tetto canta una filastrocca al sole mentre il vento "
+         "porta via le foglie e il robot risponde con calma alla domanda").split()
+
+
+class FakeOllamaConfig:
+    def __init__(self, token_rate=20.0, latency=0.3, tokens=64, load_time=0.0, parallel=1,
+                 models=('gemma3:4b', 'mistral')):
+        self.token_rate = token_rate    # token al secondo dopo il primo
+        self.latency = latency          # secondi prima del primo token (valutazione del prompt)
+        self.tokens = tokens            # token per risposta
+        self.load_time = load_time      # caricamento del modello alla prima richiesta
+        self.models = list(models)
+        # Ollama su CPU genera una risposta alla volta: le altre aspettano
+        self.slots = threading.Semaphore(parallel)
+        self.loaded = set()
+        self.requests = itertools.count(1)
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    config = None
+
+    def log_message(self, format, *args):
+        pass
+
+    # ---------------------------
+    # Risposte
+    # ---------------------------
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _start_stream(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+    def _chunk(self, payload):
+        data = (json.dumps(payload) + "\n").encode()
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _end_stream(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path == '/api/tags':
+            self._send_json({'models': [{'name': m, 'model': m} for m in self.config.models]})
+        elif self.path == '/api/ps':
+            self._send_json({'models': [{'name': m, 'model': m, 'expires_at': None} for m in self.config.loaded]})
+        else:
+            self._send_json({'error': 'not found'}, 404)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+        if self.path == '/api/generate':
+            self._generate(request, chat=False)
+        elif self.path == '/api/chat':
+            self._generate(request, chat=True)
+        else:
+            self._send_json({'error': 'not found'}, 404)
+
+    # ---------------------------
+    # Generazione simulata
+    # ---------------------------
+    def _generate(self, request, chat):
+        config = self.config
+        model = request.get('model', config.models[0])
+        stream = request.get('stream', True)
+        if chat:
+            prompt = " ".join(m.get('content', '') for m in request.get('messages', []))
+        else:
+            prompt = request.get('prompt', '')
+        started = time.perf_counter()
+
+        with config.slots:
+            load = 0.0
+            if model not in config.loaded:
+                time.sleep(config.load_time)
+                load = config.load_time
+                config.loaded.add(model)
+            # Preload: prompt vuoto, nessun token
+            n_tokens = config.tokens if prompt else 0
+            seed = next(config.requests)
+            rng = random.Random(seed)
+            tokens = [rng.choice(WORDS) + " " for _ in range(n_tokens)]
+
+            if prompt:
+                time.sleep(config.latency)
+            prompt_eval = config.latency if prompt else 0.0
+
+            def piece(token, done=False):
+                payload = {'model': model, 'created_at': _now(), 'done': done}
+                if chat:
+                    payload['message'] = {'role': 'assistant', 'content': token}
+                else:
+                    payload['response'] = token
+                return payload
+
+            def final():
+                total = time.perf_counter() - started
+                payload = piece('', done=True)
+                payload.update({
+                    'done_reason': 'stop',
+                    'total_duration': int(total * 1e9),
+                    'load_duration': int(load * 1e9),
+                    'prompt_eval_count': max(1, len(prompt) // 4),
+                    'prompt_eval_duration': int(prompt_eval * 1e9),
+                    'eval_count': n_tokens,
+                    'eval_duration': int(max(0.0, total - prompt_eval - load) * 1e9),
+                })
+                return payload
+
+            delay = 1.0 / config.token_rate if config.token_rate > 0 else 0.0
+            if stream:
+                self._start_stream()
+                for i, token in enumerate(tokens):
+                    if i:
+                        time.sleep(delay)
+                    self._chunk(piece(token))
+                self._chunk(final())
+                self._end_stream()
+            else:
+                time.sleep(delay * max(0, n_tokens - 1))
+                payload = final()
+                if chat:
+                    payload['message']['content'] = "".join(tokens)
+                else:
+                    payload['response'] = "".join(tokens)
+                self._send_json(payload)
+
+
+def start_fake_ollama(port=0, host='127.0.0.1', **options):
+    """Avvia il server in un thread; ritorna (server, url)"""
+    handler = type('Handler', (FakeOllamaHandler,), {'config': FakeOllamaConfig(**options)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='fake-ollama', daemon=True).start()
+    return server, f"http://{host}:{server.server_port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Server Ollama finto per i benchmark")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11500)
+    parser.add_argument('--token-rate', type=float, default=20.0)
+    parser.add_argument('--latency', type=float, default=0.3)
+    parser.add_argument('--tokens', type=int, default=64)
+    parser.add_argument('--load-time', type=float, default=0.0)
+    parser.add_argument('--parallel', type=int, default=1)
+    args = parser.parse_args()
+    server, url = start_fake_ollama(args.port, args.host, token_rate=args.token_rate, latency=args.latency,
+                                    tokens=args.tokens, load_time=args.load_time, parallel=args.parallel)
+    print(f"[INFO] Ollama finto in ascolto su {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
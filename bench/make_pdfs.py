@@ -0,0 +1,78 @@
+# File: make_pdfs.py
+# Descrizione: Genera PDF di filastrocche di dimensione crescente per i benchmark (stesso formato dei PDF reali)
+#
+#   python -m bench.make_pdfs --out /tmp/bench_pdfs --sizes 20 100 500
+
+import argparse
+import os
+import random
+
+from fpdf import FPDF
+
+SUBJECTS = ["gatto", "topo", "robot", "sole", "vento", "mare", "bosco", "treno", "pane", "lupo",
+            "drago", "fiume", "nonno", "grillo", "pesce", "orso", "cane", "gufo", "mago", "fiore"]
+ADJECTIVES = ["allegro", "curioso", "stanco", "rosso", "gentile", "birichino", "piccolo", "saggio",
+              "goloso", "distratto", "coraggioso", "timido"]
+VERSES = [
+    "salta e canta sul sentiero", "conta le stelle una per una", "corre veloce fino al mare",
+    "dorme tranquillo sotto il letto", "chiede al vento dove va", "trova un tesoro nel giardino",
+    "balla in piazza con la luna", "mangia il pane col formaggio", "sogna un viaggio sulle nuvole",
+    "gioca a nascondino nel bosco", "ride forte sotto la pioggia", "scrive lettere alla nonna",
+]
+
+
+def poem_title(i):
+    """Titoli unici e deterministici: 'Filastrocca del gatto allegro 17'"""
+    subject = SUBJECTS[i % len(SUBJECTS)]
+    adjective = ADJECTIVES[(i // len(SUBJECTS)) % len(ADJECTIVES)]
+    return f"Filastrocca del {subject} {adjective} {i}"
+
+
+def poem_text(i, rng):
+    subject = SUBJECTS[i % len(SUBJECTS)]
+    lines = [f"C'era una volta un {subject}"]
+    lines += [f"che {rng.choice(VERSES)}" for _ in range(rng.randint(5, 9))]
+    lines.append(f"e questa è la storia del {subject}.")
+    return lines
+
+
+def make_pdf(path, n_poems, seed=0):
+    """Un PDF con n_poems filastrocche; ritorna l'elenco dei titoli"""
+    rng = random.Random(seed)
+    pdf = FPDF()
+    pdf.set_auto_page_break(auto=True, margin=15)
+    pdf.add_page()
+    pdf.set_font("Helvetica", size=11)
+    titles = []
+    for i in range(n_poems):
+        title = poem_title(i)
+        titles.append(title)
+        pdf.multi_cell(0, 6, title)
+        for line in poem_text(i, rng):
+            pdf.multi_cell(0, 6, line)
+        pdf.ln(4)
+    pdf.output(path)
+    return titles
+
+
+def make_corpus(out_dir, sizes, seed=0):
+    """Un PDF per ogni dimensione: ritorna {n_poesie: (path, titoli)}"""
+    os.makedirs(out_dir, exist_ok=True)
+    corpus = {}
+    for n in sizes:
+        path = os.path.join(out_dir, f"filastrocche_{n}.pdf")
+        corpus[n] = (path, make_pdf(path, n, seed=seed + n))
+    return corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera PDF di filastrocche per i benchmark")
+    parser.add_argument('--out', default='bench/pdfs')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[20, 100, 500])
+    args = parser.parse_args()
+    for n, (path, _) in make_corpus(args.out, args.sizes).items():
+        print(f"[INFO] {path}: {n} filastrocche")
+
+
+if __name__ == '__main__':
+    main()
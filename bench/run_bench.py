@@ -0,0 +1,317 @@
+# File: run_bench.py
+# Descrizione: Benchmark end-to-end offline: indicizzazione, recupero e carico sulle route con un Ollama finto
+#
+#   python -m bench.run_bench                                   (valori di default)
+#   python -m bench.run_bench --sizes 20 100 500 --concurrency 1 8 32 --requests 64
+#   python -m bench.run_bench --compare bench/results/20261018-101500.json
+#
+# Lavora in una cartella temporanea (data/pdfs, data/vectors, ...): l'indice reale non viene toccato.
+# I risultati vanno in bench/results/<data>-<ora>.json per confrontare le esecuzioni.
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_DIR, 'bench', 'results')
+
+# Domande generiche (recupero + LLM) e richieste di filastrocche (solo recupero)
+GENERIC_QUESTIONS = ["Che cosa fa il {} nella storia?", "Dove va il {} quando piove?",
+                     "Chi incontra il {} nel bosco?", "Perché il {} ride?"]
+SUBJECTS = ["gatto", "robot", "lupo", "drago", "gufo", "pesce", "orso", "grillo"]
+
+
+def percentiles(values):
+    if not values:
+        return {'count': 0}
+    ordered = sorted(values)
+
+    def pct(p):
+        return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))], 4)
+
+    return {'count': len(ordered), 'avg': round(sum(ordered) / len(ordered), 4),
+            'p50': pct(0.50), 'p95': pct(0.95), 'p99': pct(0.99), 'max': round(ordered[-1], 4)}
+
+
+def memory_mb():
+    """RSS attuale e massimo del processo in MB (da /proc se c'è, altrimenti solo il massimo)"""
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak = peak / 1024 if sys.platform != 'darwin' else peak / (1024 * 1024)
+    current = None
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    current = int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return {'rss_mb': round(current, 1) if current else None, 'peak_mb': round(peak, 1)}
+
+
+def count_pages(path):
+    from pypdf import PdfReader
+    return len(PdfReader(path).pages)
+
+
+def question(i):
+    """Domande tutte diverse: niente cache né deduplicazione fra le richieste del benchmark"""
+    template = GENERIC_QUESTIONS[i % len(GENERIC_QUESTIONS)]
+    return template.format(SUBJECTS[i % len(SUBJECTS)]) + f" ({i})"
+
+
+##################################
+# Indicizzazione e recupero
+##################################
+
+def bench_ingestion(rag_chain, corpus, queries_per_size):
+    """Per ogni dimensione: indice nuovo, tempi di indicizzazione e latenza del recupero"""
+    ingestion, retrieval = [], []
+    for n, (path, titles) in sorted(corpus.items()):
+        rag_chain.clear_vectorstore()
+        pages = count_pages(path)
+        start = time.perf_counter()
+        rag_chain.ingest_pdfs([path])
+        elapsed = time.perf_counter() - start
+        stats = rag_chain.get_vectorstore_stats()
+        chunks = stats.get('vectors', 0)
+        ingestion.append({
+            'poems': n, 'pages': pages, 'chunks': chunks, 'seconds': round(elapsed, 3),
+            'pages_per_second': round(pages / elapsed, 2), 'chunks_per_second': round(chunks / elapsed, 2),
+            'disk_bytes': stats.get('disk_bytes'), 'memory': memory_mb(),
+        })
+        print(f"[INFO] Indicizzazione {n} filastrocche: {pages} pagine, {chunks} chunk in {elapsed:.2f} s")
+
+        rng = random.Random(n)
+        by_type = {'poem': [], 'generic': []}
+        phases = {}
+        for i in range(queries_per_size):
+            poem_query = "Dimmi la " + rng.choice(titles)
+            for query_type, query in (('poem', poem_query), ('generic', question(i))):
+                start = time.perf_counter()
+                result = rag_chain.retrieve(query, query_type)
+                by_type[query_type].append(time.perf_counter() - start)
+                for phase, seconds in result.timings.items():
+                    phases.setdefault(phase, []).append(seconds)
+        retrieval.append({
+            'poems': n, 'chunks': chunks,
+            'poem': percentiles(by_type['poem']), 'generic': percentiles(by_type['generic']),
+            'phases': {phase: percentiles(values) for phase, values in phases.items()},
+        })
+        print(f"[INFO] Recupero su {chunks} chunk: p50 {retrieval[-1]['generic'].get('p50')} s")
+    return ingestion, retrieval
+
+
+##################################
+# Carico sulle route
+##################################
+
+def call_route(base_url, route, i, model, stream):
+    """Una richiesta; ritorna (latenza, tempo al primo byte, esito)"""
+    q = question(i)
+    if route == '/ask':
+        form = {'question': q, 'model': model}
+        if stream:
+            form['stream'] = 'text'
+        req = urllib.request.Request(base_url + route, data=urllib.parse.urlencode(form).encode(), method='POST')
+    else:
+        params = {'msg' if route == '/get' else 'query': q, 'model': model}
+        if stream:
+            params['stream'] = 'sse' if route == '/json' else 'text'
+        req = urllib.request.Request(base_url + route + '?' + urllib.parse.urlencode(params))
+    start = time.perf_counter()
+    first = None
+    try:
+        with urllib.request.urlopen(req, timeout=300) as response:
+            while True:
+                chunk = response.read1(4096) if hasattr(response, 'read1') else response.read(4096)
+                if first is None:
+                    first = time.perf_counter() - start
+                if not chunk:
+                    break
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except Exception:
+        status = 'error'
+    return time.perf_counter() - start, first, status
+
+
+def bench_routes(base_url, routes, concurrency_levels, n_requests, model, stream):
+    results = []
+    offset = 0
+    for route in routes:
+        for concurrency in concurrency_levels:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                calls = [pool.submit(call_route, base_url, route, offset + i, model, stream)
+                         for i in range(n_requests)]
+                outcomes = [c.result() for c in calls]
+            elapsed = time.perf_counter() - start
+            offset += n_requests
+            ok = [o for o in outcomes if o[2] == 200]
+            statuses = {}
+            for _, _, status in outcomes:
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+            results.append({
+                'route': route, 'concurrency': concurrency, 'requests': n_requests, 'stream': stream,
+                'seconds': round(elapsed, 3), 'throughput': round(len(ok) / elapsed, 2),
+                'latency': percentiles([o[0] for o in ok]),
+                'first_byte': percentiles([o[1] for o in ok if o[1] is not None]),
+                'statuses': statuses, 'memory': memory_mb(),
+            })
+            print(f"[INFO] {route} x{concurrency}: p50 {results[-1]['latency'].get('p50')} s, "
+                  f"p95 {results[-1]['latency'].get('p95')} s, {results[-1]['throughput']} req/s, {statuses}")
+    return results
+
+
+def serve(app):
+    """Server WSGI con thread (come app.run) su una porta libera"""
+    from werkzeug.serving import make_server
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='bench-server', daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+##################################
+# Confronto fra esecuzioni
+##################################
+
+def compare(current, previous):
+    """Stampa le differenze di latenza (p50/p95) e throughput rispetto a un'esecuzione precedente"""
+    def index(rows, keys):
+        return {tuple(row[k] for k in keys): row for row in rows}
+
+    print(f"\n[INFO] Confronto con {previous.get('started_at')}")
+    old_routes = index(previous.get('routes', []), ('route', 'concurrency', 'stream'))
+    for row in current.get('routes', []):
+        old = old_routes.get((row['route'], row['concurrency'], row['stream']))
+        if not old:
+            continue
+        for metric in ('p50', 'p95'):
+            a, b = old['latency'].get(metric), row['latency'].get(metric)
+            if a and b:
+                print(f"  {row['route']} x{row['concurrency']} {metric}: {a} -> {b} s ({(b - a) / a * 100:+.1f}%)")
+        print(f"  {row['route']} x{row['concurrency']} throughput: {old['throughput']} -> {row['throughput']} req/s")
+    old_retrieval = index(previous.get('retrieval', []), ('poems',))
+    for row in current.get('retrieval', []):
+        old = old_retrieval.get((row['poems'],))
+        if old and old['generic'].get('p50') and row['generic'].get('p50'):
+            print(f"  recupero {row['poems']} filastrocche p50: {old['generic']['p50']} -> {row['generic']['p50']} s")
+    old_ingestion = index(previous.get('ingestion', []), ('poems',))
+    for row in current.get('ingestion', []):
+        old = old_ingestion.get((row['poems'],))
+        if old:
+            print(f"  indicizzazione {row['poems']} filastrocche: {old['chunks_per_second']} -> "
+                  f"{row['chunks_per_second']} chunk/s")
+
+
+##################################
+# Main
+##################################
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark offline di indicizzazione, recupero e route")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[20, 100, 500],
+                        help="Numero di filastrocche per PDF (un indice per dimensione)")
+    parser.add_argument('--queries', type=int, default=50, help="Ricerche per dimensione dell'indice")
+    parser.add_argument('--routes', nargs='+', default=['/ask', '/get', '/json'])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--requests', type=int, default=32, help="Richieste per route e livello di concorrenza")
+    parser.add_argument('--stream', action='store_true', help="Misura anche le risposte in streaming")
+    parser.add_argument('--model', default='gemma3:4b')
+    parser.add_argument('--token-rate', type=float, default=50.0)
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--tokens', type=int, default=64)
+    parser.add_argument('--parallel', type=int, default=1, help="Generazioni contemporanee dell'Ollama finto")
+    parser.add_argument('--cache', action='store_true', help="Lascia attiva la cache delle risposte")
+    parser.add_argument('--fake-embeddings', action='store_true',
+                        help="Embedding deterministici al posto di all-MiniLM (nessun modello da scaricare)")
+    parser.add_argument('--skip-routes', action='store_true')
+    parser.add_argument('--out', default=None, help="File dei risultati (default bench/results/<data>.json)")
+    parser.add_argument('--compare', default=None, help="Risultati precedenti da confrontare")
+    parser.add_argument('--keep', action='store_true', help="Non cancellare la cartella di lavoro")
+    args = parser.parse_args()
+
+    from bench.fake_ollama import start_fake_ollama
+    from bench.make_pdfs import make_corpus
+
+    ollama, ollama_url = start_fake_ollama(token_rate=args.token_rate, latency=args.latency, tokens=args.tokens,
+                                           parallel=args.parallel)
+    # Va impostato prima di importare llm_client e model_registry
+    os.environ['PYOLLAMA_OLLAMA_HOST'] = ollama_url
+
+    workdir = tempfile.mkdtemp(prefix='pyollama-bench-')
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+    print(f"[INFO] Cartella di lavoro: {workdir}, Ollama finto: {ollama_url}")
+
+    results = {
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'config': vars(args),
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'cpus': os.cpu_count()},
+        'memory': {'start': memory_mb()},
+    }
+    try:
+        corpus = make_corpus(os.path.join(workdir, 'pdfs'), args.sizes)
+
+        import_start = time.perf_counter()
+        import app as app_module
+        from rag import rag_chain
+        results['import_seconds'] = round(time.perf_counter() - import_start, 3)
+        if args.fake_embeddings:
+            from langchain_core.embeddings import DeterministicFakeEmbedding
+            # Sostituisce il modello che LazyEmbeddings caricherebbe al primo uso
+            rag_chain.embedding._model = DeterministicFakeEmbedding(size=384)
+        if not args.cache:
+            rag_chain.answer_cache.max_size = 0
+        results['memory']['after_import'] = memory_mb()
+
+        results['ingestion'], results['retrieval'] = bench_ingestion(rag_chain, corpus, args.queries)
+        # Pagine al secondo per backend di estrazione del testo (pypdfium2, PyMuPDF, pypdf)
+        results['extraction'] = rag_chain.ingest_pipeline.pdf_extract.extraction_stats()
+        results['memory']['after_ingestion'] = memory_mb()
+
+        if not args.skip_routes:
+            server, base_url = serve(app_module.app)
+            results['routes'] = bench_routes(base_url, args.routes, args.concurrency, args.requests,
+                                             args.model, stream=False)
+            if args.stream:
+                results['routes'] += bench_routes(base_url, args.routes, args.concurrency, args.requests,
+                                                  args.model, stream=True)
+            server.shutdown()
+            results['memory']['after_routes'] = memory_mb()
+            results['llm'] = rag_chain.llm_client.stats()
+            results['spans'] = rag_chain.tracer.to_dict()
+    finally:
+        ollama.shutdown()
+        os.chdir(REPO_DIR)
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    out = args.out or os.path.join(RESULTS_DIR, datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    with open(out, 'w') as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print(f"[INFO] Risultati salvati in {out}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
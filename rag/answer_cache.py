@@ -0,0 +1,128 @@
+# File: answer_cache.py
+# Descrizione: Cache delle risposte (match esatto sulla domanda normalizzata + match semantico per embedding)
+
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from rag.tracing import tracer
+
+
+def normalize_query(text):
+    """Minuscole, senza accenti, punteggiatura e spazi multipli"""
+    text = unicodedata.normalize('NFKD', str(text or '').lower())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r'[^\w\s]', ' ', text)
+    return ' '.join(text.split())
+
+
+class AnswerCache:
+    """Cache LRU con TTL; le domande simili (coseno >= threshold) condividono la risposta"""
+
+    def __init__(self, embed_fn=None, threshold=0.92, max_size=256, ttl=3600, version_fn=None):
+        self.embed_fn = embed_fn
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl = ttl
+        # version_fn ritorna la versione del corpus: se cambia la cache si svuota
+        self.version_fn = version_fn
+        self._version = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits_exact': 0, 'hits_semantic': 0, 'misses': 0,
+                       'evictions': 0, 'invalidations': 0}
+
+    # ---------------------------
+    # Interni
+    # ---------------------------
+    def _check_version(self):
+        if self.version_fn is None:
+            return
+        version = self.version_fn()
+        if version != self._version:
+            if self._entries:
+                self._stats['invalidations'] += 1
+            self._entries.clear()
+            self._version = version
+
+    def _expired(self, entry, now):
+        return self.ttl is not None and now - entry['created'] > self.ttl
+
+    def _embed(self, query):
+        # Si embedda la domanda originale, la stessa stringa che usa il retriever: in caso di miss
+        # la cache LRU degli embedding (rag/embeddings.py) evita un secondo passaggio del modello
+        if self.embed_fn is None:
+            return None
+        # numpy serve solo per la parte semantica: importato al primo uso, non all'avvio
+        import numpy as np
+        vector = np.asarray(self.embed_fn(query), dtype='float32')
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    # ---------------------------
+    # API
+    # ---------------------------
+    def get(self, query, namespace=''):
+        """Ritorna la risposta in cache oppure None"""
+        normalized = normalize_query(query)
+        if not normalized:
+            return None
+        now = time.time()
+        with self._lock:
+            self._check_version()
+            key = (namespace, normalized)
+            entry = self._entries.get(key)
+            if entry is not None and not self._expired(entry, now):
+                self._entries.move_to_end(key)
+                self._stats['hits_exact'] += 1
+                return entry['answer']
+            candidates = [(k, e) for k, e in self._entries.items()
+                          if k[0] == namespace and e['vector'] is not None and not self._expired(e, now)]
+
+        if self.embed_fn is not None and candidates:
+            import numpy as np
+            vector = self._embed(query)
+            matrix = np.stack([e['vector'] for _, e in candidates])
+            scores = matrix @ vector
+            best = int(np.argmax(scores))
+            if scores[best] >= self.threshold:
+                best_key, best_entry = candidates[best]
+                with self._lock:
+                    if best_key in self._entries:
+                        self._entries.move_to_end(best_key)
+                    self._stats['hits_semantic'] += 1
+                tracer.verbose("Cache semantica", {'query': query, 'match': best_key[1],
+                                                   'score': round(float(scores[best]), 3)})
+                return best_entry['answer']
+
+        with self._lock:
+            self._stats['misses'] += 1
+        return None
+
+    def put(self, query, answer, namespace=''):
+        normalized = normalize_query(query)
+        if not normalized or not answer:
+            return
+        vector = self._embed(query)
+        with self._lock:
+            self._check_version()
+            key = (namespace, normalized)
+            self._entries[key] = {'answer': answer, 'vector': vector, 'created': time.time()}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+        hits = stats['hits_exact'] + stats['hits_semantic']
+        total = hits + stats['misses']
+        stats['hit_rate'] = round(hits / total, 4) if total else 0.0
+        stats['threshold'] = self.threshold
+        stats['max_size'] = self.max_size
+        stats['ttl'] = self.ttl
+        return stats
@@ -0,0 +1,95 @@
+# File: chunk_export.py
+# Descrizione: Esportazione dei chunk indicizzati: testo e JSONL generati chunk per chunk dal docstore,
+#              PDF generato una volta per generazione dell'indice e tenuto su disco
+
+import hashlib
+import json
+import os
+import threading
+
+from rag import docstore
+
+EXPORT_DIR = 'data/exports'
+# PDF delle generazioni precedenti tenuti su disco (una richiesta potrebbe ancora servirli)
+KEEP_GENERATIONS = 2
+
+
+def export_etag(generation, kind, filters=None):
+    """ETag di un'esportazione: cambia solo con la generazione dell'indice (e con i filtri)"""
+    tag = f"chunks-{generation}-{kind}"
+    if filters:
+        digest = hashlib.sha1(json.dumps(filters, sort_keys=True).encode()).hexdigest()[:12]
+        tag += f"-{digest}"
+    return tag
+
+
+def iter_text(store, filters=None):
+    """Testo dei chunk separati da una riga vuota"""
+    separator = ""
+    for _, doc in docstore.iter_chunks(store, filters):
+        yield separator + doc.page_content
+        separator = "\n\n"
+
+
+def iter_jsonl(store, filters=None):
+    """Un oggetto JSON per riga: posizione, id, testo e metadati"""
+    for position, doc in docstore.iter_chunks(store, filters):
+        record = {
+            'position': position,
+            'id': store.index_to_docstore_id[position],
+            'content': doc.page_content,
+            'metadata': doc.metadata,
+        }
+        yield json.dumps(record, ensure_ascii=False) + "\n"
+
+
+class PdfExport:
+    """PDF dei chunk in cache per generazione: si rigenera solo quando cambia l'indice"""
+
+    def __init__(self, export_dir=EXPORT_DIR, keep=KEEP_GENERATIONS):
+        self.export_dir = export_dir
+        self.keep = keep
+        self._lock = threading.Lock()
+
+    def path(self, generation):
+        return os.path.join(self.export_dir, f"chunks_{generation}.pdf")
+
+    def get(self, store, generation):
+        """Percorso del PDF della generazione indicata (generato se manca)"""
+        path = self.path(generation)
+        if os.path.exists(path):
+            return path
+        with self._lock:
+            if not os.path.exists(path):
+                self._build(store, path)
+                self._prune(generation)
+        return path
+
+    def _build(self, store, path):
+        from fpdf import FPDF
+
+        os.makedirs(self.export_dir, exist_ok=True)
+        pdf = FPDF()
+        pdf.add_page()
+        pdf.set_auto_page_break(auto=True, margin=15)
+        pdf.set_font("Arial", size=10)
+        count = 0
+        for _, doc in docstore.iter_chunks(store):
+            pdf.multi_cell(0, 10, doc.page_content + "\n")
+            count += 1
+        # File temporaneo con nome unico e rename atomico: chi legge vede solo PDF completi
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        pdf.output(tmp)
+        os.replace(tmp, path)
+        print(f"[INFO] PDF dei chunk generato: {path} ({count} chunk)")
+
+    def _prune(self, generation):
+        for name in os.listdir(self.export_dir):
+            if not (name.startswith('chunks_') and name.endswith('.pdf')):
+                continue
+            try:
+                old = int(name[len('chunks_'):-len('.pdf')])
+            except ValueError:
+                continue
+            if old <= generation - self.keep:
+                os.remove(os.path.join(self.export_dir, name))
@@ -0,0 +1,198 @@
+# File: context_manager.py
+# Descrizione: Memoria delle conversazioni per sessione e budget di token del prompt (storia + chunk recuperati)
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from rag.tracing import tracer
+
+# Stima: caratteri per token (italiano, tokenizer tipo gemma/llama); si sbaglia per eccesso di token
+CHARS_PER_TOKEN = 3.5
+# Token per messaggio dovuti al template di chat (ruolo, separatori)
+MESSAGE_OVERHEAD = 4
+# Budget del prompt (sotto il num_ctx di Ollama, lasciando spazio alla risposta)
+CONTEXT_BUDGET = int(os.environ.get('PYOLLAMA_CONTEXT_BUDGET', 1536))
+# Quando la storia non ci sta si taglia fino a questa frazione del budget: il prefisso del prompt
+# resta identico per diversi turni e Ollama riusa la KV cache invece di rivalutarlo
+TRIM_TARGET = 0.6
+# Spazio massimo del riassunto dei turni eliminati
+SUMMARY_TOKENS = 200
+# Token per i chunk nel prompt RAG
+RAG_CONTEXT_TOKENS = int(os.environ.get('PYOLLAMA_RAG_CONTEXT_TOKENS', 1200))
+MAX_SESSIONS = 500
+SESSION_TTL = 3600
+
+
+def estimate_tokens(text):
+    return int(len(text or "") / CHARS_PER_TOKEN) + 1
+
+
+def message_tokens(message):
+    return estimate_tokens(message['content']) + MESSAGE_OVERHEAD
+
+
+def truncate_to_tokens(text, tokens):
+    """Taglia il testo a circa tokens token, possibilmente a fine frase"""
+    limit = int(tokens * CHARS_PER_TOKEN)
+    if len(text) <= limit:
+        return text
+    cut = text[:limit]
+    end = max(cut.rfind('. '), cut.rfind('\n'))
+    if end > limit // 2:
+        cut = cut[:end + 1]
+    return cut.rstrip() + " …"
+
+
+class Session:
+    def __init__(self):
+        self.turns = []         # messaggi user/assistant, dal più vecchio
+        self.summary = None     # riassunto fisso dei turni già eliminati
+        self.updated_at = time.time()
+        self.lock = threading.Lock()
+
+
+class ContextManager:
+    """Storia per sessione e costruzione dei messaggi entro un budget di token"""
+
+    def __init__(self, budget=CONTEXT_BUDGET, trim_target=TRIM_TARGET, summary_tokens=SUMMARY_TOKENS,
+                 max_sessions=MAX_SESSIONS, ttl=SESSION_TTL):
+        self.budget = budget
+        self.trim_target = trim_target
+        self.summary_tokens = summary_tokens
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'turns': 0, 'trims': 0, 'turns_trimmed': 0, 'duplicates_dropped': 0,
+                       'prompts': 0, 'prompt_tokens': 0}
+
+    # ---------------------------
+    # Sessioni
+    # ---------------------------
+    def _session(self, session_id):
+        now = time.time()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None or now - session.updated_at > self.ttl:
+                session = self._sessions[session_id] = Session()
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            return session
+
+    def reset(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def record(self, session_id, question, answer):
+        """Aggiunge il turno completato alla storia della sessione"""
+        if not session_id or not question:
+            return
+        session = self._session(session_id)
+        with session.lock:
+            turns = session.turns
+            # Domanda ripetuta subito dopo: si tiene solo l'ultima risposta
+            if len(turns) >= 2 and turns[-2]['content'] == question:
+                del turns[-2:]
+                self._count('duplicates_dropped')
+            turns.append({'role': 'user', 'content': question})
+            turns.append({'role': 'assistant', 'content': answer or ""})
+            session.updated_at = time.time()
+        self._count('turns')
+
+    # ---------------------------
+    # Costruzione del prompt
+    # ---------------------------
+    def build_messages(self, session_id, system_prompt, question):
+        """[system (sempre identico), riassunto, storia..., domanda] entro il budget"""
+        system = {"role": "system", "content": system_prompt}
+        user = {"role": "user", "content": question}
+        if not session_id:
+            return [system, user]
+        session = self._session(session_id)
+        fixed = message_tokens(system) + message_tokens(user)
+        with session.lock:
+            available = self.budget - fixed
+            if self._history_tokens(session) > available:
+                self._trim(session, int(available * self.trim_target))
+            messages = [system]
+            if session.summary:
+                messages.append({"role": "system", "content": session.summary})
+            messages += session.turns
+        messages.append(user)
+        self._observe(messages)
+        return messages
+
+    def _history_tokens(self, session):
+        tokens = sum(message_tokens(m) for m in session.turns)
+        if session.summary:
+            tokens += estimate_tokens(session.summary) + MESSAGE_OVERHEAD
+        return tokens
+
+    def _trim(self, session, target):
+        """Toglie i turni più vecchi (a coppie domanda/risposta) e li aggiunge al riassunto"""
+        # Il riassunto non deve mangiarsi lo spazio lasciato ai turni recenti
+        limit = min(self.summary_tokens, target // 3)
+        removed = []
+        while session.turns and sum(message_tokens(m) for m in session.turns) > target - limit - MESSAGE_OVERHEAD:
+            removed += session.turns[:2]
+            del session.turns[:2]
+        if removed:
+            session.summary = self._summarize(session.summary, removed, limit)
+        self._count('trims')
+        self._count('turns_trimmed', len(removed) // 2)
+
+    def _summarize(self, summary, removed, limit):
+        """Riassunto estrattivo (nessuna chiamata al LLM): le domande già fatte, le più recenti in fondo"""
+        questions = [m['content'].strip() for m in removed if m['role'] == 'user']
+        previous = summary.split("\n", 1)[1] if summary else ""
+        lines = [line for line in previous.split("\n") if line] + [f"- {q}" for q in questions]
+        text = "\n".join(lines)
+        while len(lines) > 1 and estimate_tokens(text) > limit:
+            lines = lines[1:]
+            text = "\n".join(lines)
+        text = truncate_to_tokens(text, limit)
+        return "Domande precedenti dell'utente in questa conversazione:\n" + text
+
+    def _observe(self, messages):
+        tokens = sum(message_tokens(m) for m in messages)
+        with self._lock:
+            self._stats['prompts'] += 1
+            self._stats['prompt_tokens'] += tokens
+        tracer.count('context_prompt_tokens', tokens)
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._stats[name] += n
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['sessions'] = len(self._sessions)
+        stats['avg_prompt_tokens'] = round(stats['prompt_tokens'] / stats['prompts'], 1) if stats['prompts'] else None
+        stats['budget'] = self.budget
+        return stats
+
+
+def fit_chunks(docs, budget=RAG_CONTEXT_TOKENS):
+    """Testi dei chunk in ordine di rilevanza, senza duplicati, entro budget token (l'ultimo si taglia)"""
+    texts = []
+    seen = set()
+    used = 0
+    for doc in docs:
+        text = doc.page_content.strip()
+        key = " ".join(text.split())
+        if not text or key in seen:
+            continue
+        seen.add(key)
+        tokens = estimate_tokens(text)
+        if used + tokens > budget:
+            remaining = budget - used
+            if remaining > 50:
+                texts.append(truncate_to_tokens(text, remaining))
+            break
+        texts.append(text)
+        used += tokens
+    return texts
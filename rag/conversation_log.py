@@ -0,0 +1,185 @@
+# File: conversation_log.py
+# Descrizione: Log delle conversazioni in JSONL, bufferizzato e scritto a blocchi da un thread (rotazione + gzip)
+
+import atexit
+import gzip
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_BACKUPS = 10
+# Il thread scrive ogni FLUSH_INTERVAL secondi, o prima se in memoria ci sono già FLUSH_BATCH record
+FLUSH_INTERVAL = 2.0
+FLUSH_BATCH = 50
+# Se il disco non tiene il passo si scartano i record più vecchi invece di rallentare le richieste
+MAX_BUFFER = 2000
+
+
+class ConversationLog:
+    """log() non tocca mai il disco: mette il record in memoria e ritorna subito"""
+
+    def __init__(self, log_dir, name='conversations', max_bytes=LOG_MAX_BYTES, backups=LOG_BACKUPS,
+                 flush_interval=FLUSH_INTERVAL, batch_size=FLUSH_BATCH, max_buffer=MAX_BUFFER):
+        self.log_dir = log_dir
+        self.name = name
+        self.path = os.path.join(log_dir, name + '.jsonl')
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._buffer = deque(maxlen=max_buffer)
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._counters = {'logged': 0, 'written': 0, 'dropped': 0, 'flushes': 0, 'rotations': 0, 'errors': 0}
+        self._last_flush_seconds = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            os.makedirs(self.log_dir, exist_ok=True)
+            self._thread = threading.Thread(target=self._run, name='conversation-log', daemon=True)
+            self._thread.start()
+        # I record ancora in memoria si scrivono all'uscita del processo
+        atexit.register(self.close)
+
+    def log(self, question, answer, **fields):
+        """Accoda un record (model, route, latency, retrieval, ...)"""
+        self.start()
+        record = {'ts': datetime.now().isoformat(timespec='milliseconds'), 'question': question, 'answer': answer}
+        record.update({key: value for key, value in fields.items() if value is not None})
+        with self._lock:
+            if len(self._buffer) == self._buffer.maxlen:
+                self._counters['dropped'] += 1
+            self._buffer.append(record)
+            self._counters['logged'] += 1
+            pending = len(self._buffer)
+        if pending >= self.batch_size:
+            self._wake.set()
+
+    def wrap_stream(self, question, tokens, info=None, **fields):
+        """Inoltra i token e a fine generazione registra la risposta, con latenza e primo token.
+
+        Se lo stream si interrompe prima della fine il record ha partial=True con il testo inviato fino a lì.
+
+        info è un dizionario riempito durante la generazione (es. dati del recupero), letto alla fine.
+        """
+        start = time.time()
+        ttft = None
+        parts = []
+        complete = False
+        try:
+            for token in tokens:
+                if ttft is None:
+                    ttft = round(time.time() - start, 3)
+                parts.append(token)
+                yield token
+            complete = True
+        finally:
+            # Anche se il client si disconnette (GeneratorExit) o la generazione fallisce: record partial
+            self._log_stream(question, parts, start, ttft, complete, fields, info)
+
+    async def awrap_stream(self, question, tokens, info=None, **fields):
+        """Come wrap_stream, per generatori asincroni"""
+        start = time.time()
+        ttft = None
+        parts = []
+        complete = False
+        try:
+            async for token in tokens:
+                if ttft is None:
+                    ttft = round(time.time() - start, 3)
+                parts.append(token)
+                yield token
+            complete = True
+        finally:
+            self._log_stream(question, parts, start, ttft, complete, fields, info)
+
+    def _log_stream(self, question, parts, start, ttft, complete, fields, info):
+        self.log(question, "".join(parts), latency=round(time.time() - start, 3), ttft=ttft,
+                 partial=None if complete else True, **dict(fields, **(info or {})))
+
+    # ---------------------------
+    # Scrittura (thread in background)
+    # ---------------------------
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            records = list(self._buffer)
+            self._buffer.clear()
+        if not records:
+            return
+        lines = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+        start = time.time()
+        with self._write_lock:
+            try:
+                self._rotate_if_needed()
+                # Un solo open/write per blocco: meno scritture sulla scheda SD
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(lines)
+            except Exception as e:
+                with self._lock:
+                    self._counters['errors'] += 1
+                print(f"[DEBUG] Errore nella scrittura del log conversazioni: {e}", file=sys.stderr)
+                return
+        with self._lock:
+            self._counters['written'] += len(records)
+            self._counters['flushes'] += 1
+            self._last_flush_seconds = round(time.time() - start, 4)
+
+    def close(self):
+        self._stop.set()
+        self._wake.set()
+        self.flush()
+
+    # ---------------------------
+    # Rotazione
+    # ---------------------------
+    def _rotate_if_needed(self):
+        if not os.path.exists(self.path):
+            return
+        stat = os.stat(self.path)
+        same_day = datetime.fromtimestamp(stat.st_mtime).date() == datetime.now().date()
+        if stat.st_size < self.max_bytes and same_day:
+            return
+        stamp = datetime.fromtimestamp(stat.st_mtime).strftime('%Y%m%d-%H%M%S')
+        rotated = os.path.join(self.log_dir, f"{self.name}-{stamp}.jsonl.gz")
+        n = 1
+        while os.path.exists(rotated):
+            rotated = os.path.join(self.log_dir, f"{self.name}-{stamp}-{n}.jsonl.gz")
+            n += 1
+        with open(self.path, 'rb') as src, gzip.open(rotated, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(self.path)
+        with self._lock:
+            self._counters['rotations'] += 1
+        self._prune()
+
+    def _prune(self):
+        prefix = self.name + '-'
+        archives = sorted(f for f in os.listdir(self.log_dir) if f.startswith(prefix) and f.endswith('.jsonl.gz'))
+        for old in archives[:-self.backups] if self.backups else archives:
+            os.remove(os.path.join(self.log_dir, old))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'path': self.path,
+                'buffered': len(self._buffer),
+                'counters': dict(self._counters),
+                'last_flush_seconds': self._last_flush_seconds,
+            }
@@ -0,0 +1,76 @@
+# File: docstore.py
+# Descrizione: Elenco dei chunk leggendo direttamente il docstore FAISS (nessun embedding, nessuna ricerca)
+
+import os
+
+FILTER_KEYS = ('source', 'title', 'type')
+
+
+def matches(metadata, filters):
+    """True se i metadati rispettano tutti i filtri (source accetta anche il solo nome file)"""
+    for key, value in (filters or {}).items():
+        if value in (None, ''):
+            continue
+        actual = metadata.get(key)
+        if key == 'source' and actual is not None and os.path.basename(str(actual)) == value:
+            continue
+        if key == 'title' and actual is not None and str(value).lower() in str(actual).lower():
+            continue
+        if actual != value:
+            return False
+    return True
+
+
+def iter_chunks(store, filters=None, start=0):
+    """Genera (posizione, Document) nell'ordine dell'indice, a partire dalla posizione start"""
+    if store is None:
+        return
+    mapping = store.index_to_docstore_id
+    for position in sorted(mapping):
+        if position < start:
+            continue
+        doc = store.docstore.search(mapping[position])
+        if isinstance(doc, str):
+            # Il docstore risponde con una stringa se l'id non esiste
+            continue
+        if matches(doc.metadata, filters):
+            yield position, doc
+
+
+def count_chunks(store, filters=None):
+    """Numero di chunk; con filtri serve una scansione del docstore"""
+    if store is None:
+        return 0
+    if not any(value not in (None, '') for value in (filters or {}).values()):
+        return len(store.index_to_docstore_id)
+    return sum(1 for _ in iter_chunks(store, filters))
+
+
+def list_chunks(store, limit=100, offset=0, cursor=None, filters=None):
+    """Una pagina di chunk.
+
+    cursor è la posizione da cui riprendere (ritornata come next_cursor dalla pagina precedente);
+    in alternativa offset salta i primi N chunk che rispettano i filtri.
+    """
+    items = []
+    next_cursor = None
+    skipped = 0
+    start = int(cursor) if cursor not in (None, '') else 0
+    for position, doc in iter_chunks(store, filters, start):
+        if cursor in (None, '') and skipped < offset:
+            skipped += 1
+            continue
+        if len(items) == limit:
+            next_cursor = position
+            break
+        items.append({
+            'position': position,
+            'content': doc.page_content,
+            'metadata': doc.metadata,
+        })
+    return {
+        'chunks': items,
+        'next_cursor': next_cursor,
+        'total': count_chunks(store, filters),
+        'total_unfiltered': count_chunks(store),
+    }
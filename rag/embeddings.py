@@ -0,0 +1,163 @@
+# File: embeddings.py
+# Descrizione: Servizio di embedding: modello caricato al primo uso, cache LRU delle query e micro-batch delle query concorrenti
+
+import threading
+import time
+from collections import OrderedDict
+
+from langchain_core.embeddings import Embeddings
+
+from rag.tracing import tracer
+
+EMBEDDING_MODEL = 'sentence-transformers/all-MiniLM-L6-v2'
+# Vettori delle query tenuti in memoria (384 float ciascuno)
+QUERY_CACHE_SIZE = 2048
+# Attesa massima (secondi) per raccogliere altre query prima del forward pass
+BATCH_WINDOW = 0.002
+MAX_QUERY_BATCH = 32
+# Batch del forward pass di sentence-transformers (indicizzazione)
+ENCODE_BATCH_SIZE = 256
+
+
+def query_key(text):
+    # all-MiniLM è uncased: minuscole e spazi compattati danno lo stesso vettore
+    return " ".join(str(text).lower().split())
+
+
+class _QueryBatch:
+    def __init__(self):
+        self.texts = []
+        self.positions = {}
+        self.vectors = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class LazyEmbeddings(Embeddings):
+    """HuggingFaceEmbeddings istanziato solo alla prima richiesta di embedding.
+
+    Le query passano da una cache LRU; quelle che arrivano insieme da thread diversi
+    vengono calcolate in un solo forward pass.
+    """
+
+    def __init__(self, model_name=EMBEDDING_MODEL, cache_size=QUERY_CACHE_SIZE, batch_window=BATCH_WINDOW,
+                 max_batch=MAX_QUERY_BATCH, encode_batch_size=ENCODE_BATCH_SIZE):
+        self.model_name = model_name
+        self.cache_size = cache_size
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.encode_batch_size = encode_batch_size
+        self._model = None
+        self._lock = threading.Lock()
+        self.load_seconds = None
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        # Un solo forward pass alla volta: intanto le nuove query si accumulano nel batch aperto
+        self._model_lock = threading.Lock()
+        self._batch_lock = threading.Lock()
+        self._open_batch = None
+        self._stats = {'hits': 0, 'misses': 0, 'batches': 0, 'batched_queries': 0, 'max_batch': 0,
+                       'documents': 0, 'document_calls': 0}
+
+    @property
+    def loaded(self):
+        return self._model is not None
+
+    def load(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    start = time.time()
+                    from langchain_huggingface import HuggingFaceEmbeddings
+                    self._model = HuggingFaceEmbeddings(model_name=self.model_name,
+                                                        encode_kwargs={'batch_size': self.encode_batch_size})
+                    self.load_seconds = round(time.time() - start, 3)
+                    print(f"[INFO] Modello di embedding caricato in {self.load_seconds} secondi")
+        return self._model
+
+    # ---------------------------
+    # Query
+    # ---------------------------
+    def embed_query(self, text):
+        key = query_key(text)
+        with tracer.span('embed_query'):
+            with self._cache_lock:
+                vector = self._cache.get(key)
+                if vector is not None:
+                    self._cache.move_to_end(key)
+                    self._stats['hits'] += 1
+                    return list(vector)
+                self._stats['misses'] += 1
+            vector = self._embed_batched(key)
+        with self._cache_lock:
+            self._cache[key] = vector
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return list(vector)
+
+    def _embed_batched(self, key):
+        with self._batch_lock:
+            batch = self._open_batch
+            leader = batch is None
+            if leader:
+                batch = self._open_batch = _QueryBatch()
+            if key not in batch.positions:
+                batch.positions[key] = len(batch.texts)
+                batch.texts.append(key)
+            position = batch.positions[key]
+            if len(batch.texts) >= self.max_batch and self._open_batch is batch:
+                # Batch pieno: le prossime query ne aprono un altro
+                self._open_batch = None
+
+        if leader:
+            self._run_batch(batch)
+        else:
+            batch.done.wait()
+        if batch.error is not None:
+            raise batch.error
+        return batch.vectors[position]
+
+    def _run_batch(self, batch):
+        try:
+            model = self.load()
+            if self.batch_window:
+                time.sleep(self.batch_window)
+            with self._model_lock:
+                with self._batch_lock:
+                    if self._open_batch is batch:
+                        self._open_batch = None
+                # Stesso calcolo di embed_query (nessun prompt di query per all-MiniLM)
+                batch.vectors = model.embed_documents(batch.texts)
+            with self._cache_lock:
+                self._stats['batches'] += 1
+                self._stats['batched_queries'] += len(batch.texts)
+                self._stats['max_batch'] = max(self._stats['max_batch'], len(batch.texts))
+        except Exception as e:
+            batch.error = e
+        finally:
+            batch.done.set()
+
+    # ---------------------------
+    # Documenti (indicizzazione)
+    # ---------------------------
+    def embed_documents(self, texts):
+        model = self.load()
+        # Senza _model_lock: le query non aspettano la fine di un batch di indicizzazione
+        with tracer.span('embed_documents'):
+            vectors = model.embed_documents(texts)
+        with self._cache_lock:
+            self._stats['documents'] += len(texts)
+            self._stats['document_calls'] += 1
+        return vectors
+
+    def stats(self):
+        with self._cache_lock:
+            stats = dict(self._stats)
+            stats['cached'] = len(self._cache)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else None
+        stats['avg_batch'] = round(stats['batched_queries'] / stats['batches'], 2) if stats['batches'] else None
+        stats['loaded'] = self.loaded
+        stats['load_seconds'] = self.load_seconds
+        return stats
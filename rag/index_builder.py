@@ -0,0 +1,295 @@
+# File: index_builder.py
+# Descrizione: Tipi di indice FAISS (Flat / IVF / HNSW / PQ), ricostruzione di data/vectors e recall@k
+#
+# Uso da riga di comando (dalla cartella principale del progetto):
+#   python -m rag.index_builder --type hnsw --M 32
+#   python -m rag.index_builder --type ivf --nlist 256 --nprobe 16
+#   python -m rag.index_builder --type pq --nlist 256 --m 16 --nbits 8
+
+import argparse
+import json
+import os
+import time
+
+import faiss
+import numpy as np
+
+CONFIG_FILE = 'index_config.json'
+INDEX_TYPES = ('flat', 'ivf', 'hnsw', 'pq')
+
+DEFAULT_PARAMS = {
+    'flat': {},
+    'ivf': {'nlist': 256, 'nprobe': 16},
+    'hnsw': {'M': 32, 'efConstruction': 80, 'efSearch': 64},
+    'pq': {'nlist': 256, 'nprobe': 16, 'm': 16, 'nbits': 8},
+}
+
+
+# ---------------------------
+# Configurazione
+# ---------------------------
+def read_config(vector_dir):
+    try:
+        with open(os.path.join(vector_dir, CONFIG_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'type': 'flat', 'params': {}}
+
+
+def write_config(vector_dir, config):
+    path = os.path.join(vector_dir, CONFIG_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(config, f, indent=1)
+    os.replace(path + '.tmp', path)
+
+
+def apply_search_params(index, config):
+    """nprobe non viene salvato da faiss.write_index: va reimpostato dopo ogni caricamento"""
+    params = config.get('params', {})
+    if config.get('type') in ('ivf', 'pq') and 'nprobe' in params and is_ivf(index):
+        faiss.extract_index_ivf(index).nprobe = params['nprobe']
+    if config.get('type') == 'hnsw' and 'efSearch' in params and hasattr(index, 'hnsw'):
+        index.hnsw.efSearch = params['efSearch']
+
+
+def is_ivf(index):
+    """True per IVF/PQ; un indice configurato IVF/PQ resta Flat finché i vettori sono pochi"""
+    try:
+        faiss.extract_index_ivf(index)
+        return True
+    except RuntimeError:
+        return False
+
+
+# ---------------------------
+# Costruzione
+# ---------------------------
+# faiss consiglia almeno ~39 punti per centroide: sotto questa soglia IVF/PQ restano Flat
+POINTS_PER_CENTROID = 39
+# recall@k misurato dopo ogni costruzione (CLI e indicizzazione)
+RECALL_K = 10
+# Si riaddestra quando l'indice ha RETRAIN_GROWTH volte i vettori dell'ultimo addestramento
+RETRAIN_GROWTH = 2
+
+
+def min_vectors(index_type, **params):
+    """Vettori necessari per addestrare il tipo di indice (0 se non serve addestramento)"""
+    params = dict(DEFAULT_PARAMS[index_type], **params)
+    if index_type == 'ivf':
+        return POINTS_PER_CENTROID * params['nlist']
+    if index_type == 'pq':
+        # Anche ogni sotto-quantizzatore del PQ ha 2^nbits centroidi da addestrare
+        return POINTS_PER_CENTROID * max(params['nlist'], 2 ** params['nbits'])
+    return 0
+
+
+def make_index(index_type, dimension, **params):
+    """Crea un indice vuoto del tipo richiesto (da addestrare per IVF/PQ)"""
+    params = dict(DEFAULT_PARAMS[index_type], **params)
+    if index_type == 'flat':
+        return faiss.IndexFlatL2(dimension)
+    if index_type == 'hnsw':
+        index = faiss.IndexHNSWFlat(dimension, params['M'])
+        index.hnsw.efConstruction = params['efConstruction']
+        index.hnsw.efSearch = params['efSearch']
+        return index
+
+    quantizer = faiss.IndexFlatL2(dimension)
+    if index_type == 'ivf':
+        index = faiss.IndexIVFFlat(quantizer, dimension, params['nlist'])
+    else:
+        m = params['m']
+        if dimension % m:
+            raise ValueError(f"La dimensione {dimension} non è divisibile per m={m}")
+        index = faiss.IndexIVFPQ(quantizer, dimension, params['nlist'], m, params['nbits'])
+    index.nprobe = min(params['nprobe'], params['nlist'])
+    return index
+
+
+def is_lossy(index):
+    """PQ memorizza codici compressi: reconstruct ne dà solo un'approssimazione"""
+    return isinstance(index, (faiss.IndexIVFPQ, faiss.IndexPQ))
+
+
+def extract_vectors(index):
+    """Vettori memorizzati nell'indice (esatti per Flat/HNSW/IVF, approssimati per PQ)"""
+    if index.ntotal == 0:
+        return np.zeros((0, index.d), dtype='float32')
+    if is_ivf(index):
+        faiss.extract_index_ivf(index).make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def source_vectors(store, embedding=None):
+    """Vettori da cui costruire un nuovo indice, nell'ordine delle posizioni.
+
+    Da un indice PQ si ricalcolano gli embedding dal docstore: ricostruire dai codici compressi
+    accumulerebbe l'errore a ogni ricostruzione.
+    """
+    if not is_lossy(store.index):
+        return extract_vectors(store.index)
+    if embedding is None:
+        raise ValueError("Per ricostruire un indice PQ serve il modello di embedding")
+    from rag import docstore
+    texts = [doc.page_content for _, doc in docstore.iter_chunks(store)]
+    print(f"[INFO] Indice PQ: ricalcolo di {len(texts)} embedding dal docstore")
+    return np.asarray(embedding.embed_documents(texts), dtype='float32')
+
+
+def build_index(vectors, index_type, **params):
+    vectors = np.ascontiguousarray(vectors, dtype='float32')
+    count, dimension = vectors.shape
+    if count < min_vectors(index_type, **params):
+        raise ValueError(f"Servono almeno {min_vectors(index_type, **params)} vettori per un indice "
+                         f"{index_type} (ce ne sono {count})")
+    index = make_index(index_type, dimension, **params)
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    return index
+
+
+def recall_at_k(index, vectors, k=RECALL_K, queries=200, seed=0):
+    """Recall@k dell'indice rispetto alla ricerca esatta (Flat) su un campione di vettori"""
+    vectors = np.ascontiguousarray(vectors, dtype='float32')
+    if len(vectors) == 0:
+        return 1.0
+    k = min(k, len(vectors))
+    rng = np.random.default_rng(seed)
+    sample = vectors[rng.choice(len(vectors), size=min(queries, len(vectors)), replace=False)]
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, truth = exact.search(sample, k)
+    _, found = index.search(sample, k)
+    hits = sum(len(set(t) & set(f)) for t, f in zip(truth, found))
+    return hits / (len(sample) * k)
+
+
+def convert_store(store, config, embedding=None, recall_k=RECALL_K):
+    """Sostituisce l'indice di un vectorstore LangChain mantenendo docstore e id; ritorna il report"""
+    index_type = config['type']
+    vectors = source_vectors(store, embedding)
+    start = time.time()
+    store.index = build_index(vectors, index_type, **config.get('params', {}))
+    build_seconds = time.time() - start
+    apply_search_params(store.index, config)
+    return {
+        'vectors': int(store.index.ntotal),
+        'build_seconds': round(build_seconds, 3),
+        f'recall@{recall_k}': round(recall_at_k(store.index, vectors, k=recall_k), 4),
+        'built_at': time.time(),
+    }
+
+
+def needs_build(store, config):
+    """True se l'indice va (ri)costruito per il tipo configurato"""
+    index_type = config.get('type', 'flat')
+    if store is None or index_type == 'flat':
+        return False
+    count = store.index.ntotal
+    if count < min_vectors(index_type, **config.get('params', {})):
+        # Pochi vettori: si resta Flat (un indice già addestrato resta com'è)
+        return False
+    if isinstance(store.index, faiss.IndexFlat):
+        return True
+    if index_type == 'hnsw':
+        return False
+    # IVF/PQ addestrati su un corpus molto più piccolo: centroidi da ricalcolare
+    trained = (config.get('report') or {}).get('vectors') or 0
+    return count >= RETRAIN_GROWTH * trained
+
+
+def ensure_index_type(store, vector_dir, embedding=None):
+    """Dopo un'indicizzazione: porta l'indice al tipo configurato quando i vettori bastano per addestrarlo,
+    e lo riaddestra quando è cresciuto; recall@k finisce in index_config.json come per la CLI"""
+    config = read_config(vector_dir)
+    if not needs_build(store, config):
+        return store
+    config['report'] = convert_store(store, config, embedding)
+    write_config(vector_dir, config)
+    report = config['report']
+    print(f"[INFO] Indice {config['type']} costruito: {report['vectors']} vettori in "
+          f"{report['build_seconds']:.2f} s, recall@{RECALL_K} = {report[f'recall@{RECALL_K}']:.4f}")
+    return store
+
+
+def delete_ids(store, ids, embedding):
+    """Elimina i chunk dall'indice; HNSW non supporta remove_ids, quindi in quel caso ricostruisce.
+
+    La ricostruzione riusa i vettori già nell'indice (nessun nuovo embedding): ne esce un indice Flat,
+    che ensure_index_type riporta poi al tipo configurato.
+    """
+    try:
+        store.delete(ids)
+        return store
+    except (RuntimeError, ValueError) as e:
+        print(f"[INFO] Eliminazione diretta non supportata ({e}), ricostruzione dell'indice dai vettori salvati")
+    from langchain_community.vectorstores import FAISS
+    removed = set(ids)
+    keep = [(position, doc_id) for position, doc_id in sorted(store.index_to_docstore_id.items())
+            if doc_id not in removed]
+    if not keep:
+        return None
+    vectors = extract_vectors(store.index)
+    docs = [store.docstore.search(doc_id) for _, doc_id in keep]
+    text_embeddings = [(doc.page_content, vectors[position]) for (position, _), doc in zip(keep, docs)]
+    return FAISS.from_embeddings(text_embeddings, embedding, metadatas=[doc.metadata for doc in docs],
+                                 ids=[doc_id for _, doc_id in keep])
+
+
+# ---------------------------
+# Ricostruzione di data/vectors
+# ---------------------------
+def rebuild(vector_dir, index_type, manager=None, recall_k=RECALL_K, embedding=None, **params):
+    """Ricostruisce l'indice salvato con il tipo richiesto e riporta recall@k rispetto a Flat"""
+    from langchain_community.vectorstores import FAISS
+
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Tipo di indice sconosciuto: {index_type} (validi: {', '.join(INDEX_TYPES)})")
+    store = FAISS.load_local(vector_dir, embeddings=embedding, allow_dangerous_deserialization=True)
+    config = {'type': index_type, 'params': dict(DEFAULT_PARAMS[index_type], **params)}
+    needed = min_vectors(index_type, **params)
+    if store.index.ntotal < needed:
+        # Si salva solo la configurazione: l'indicizzazione costruirà l'indice quando i vettori basteranno
+        write_config(vector_dir, config)
+        print(f"[INFO] {store.index.ntotal} vettori: per un indice {index_type} ne servono almeno {needed}, "
+              f"resta Flat fino ad allora")
+        return config
+    config['report'] = convert_store(store, config, embedding, recall_k=recall_k)
+    write_config(vector_dir, config)
+    if manager is not None:
+        manager.swap(store)
+    else:
+        store.save_local(vector_dir)
+    report = config['report']
+    print(f"[INFO] Indice {index_type} ricostruito: {report['vectors']} vettori in {report['build_seconds']:.2f} s, "
+          f"recall@{recall_k} = {report[f'recall@{recall_k}']:.4f}")
+    return config
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ricostruisce l'indice FAISS di data/vectors")
+    parser.add_argument('--dir', default='data/vectors')
+    parser.add_argument('--type', choices=INDEX_TYPES, default='flat')
+    parser.add_argument('--nlist', type=int)
+    parser.add_argument('--nprobe', type=int)
+    parser.add_argument('--M', type=int)
+    parser.add_argument('--efConstruction', type=int)
+    parser.add_argument('--efSearch', type=int)
+    parser.add_argument('--m', type=int)
+    parser.add_argument('--nbits', type=int)
+    parser.add_argument('--recall-k', type=int, default=RECALL_K)
+    args = parser.parse_args()
+
+    params = {key: value for key, value in vars(args).items()
+              if key in DEFAULT_PARAMS.get(args.type, {}) and value is not None}
+    from rag.embeddings import LazyEmbeddings
+    from rag.vectorstore_manager import VectorStoreManager
+    # Il modello si carica solo se serve ricalcolare gli embedding (indice PQ)
+    embedding = LazyEmbeddings()
+    rebuild(args.dir, args.type, manager=VectorStoreManager(args.dir, embedding), recall_k=args.recall_k,
+            embedding=embedding, **params)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,417 @@
+# File: ingest_pipeline.py
+# Descrizione: Pipeline di indicizzazione dei PDF (parsing parallelo, embedding a batch, aggiornamento incrementale)
+
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import ExitStack, nullcontext
+
+from rag import pdf_extract
+
+MANIFEST_FILE = 'manifest.json'
+# Chunk per chiamata di embedding: come ENCODE_BATCH_SIZE di rag/embeddings.py, un forward pass per blocco
+EMBED_BATCH_SIZE = 256
+PARSE_WORKERS = max(1, min(4, (os.cpu_count() or 2) - 1))
+
+
+def iter_page_lines(pages):
+    """Righe del PDF pagina per pagina, senza unire tutto il testo in un'unica stringa"""
+    for page in pages:
+        yield from page.split('\n')
+
+
+def iter_poems(lines):
+    """Estrae le filastrocche da un iteratore di righe: ognuna va dal suo titolo fino al prossimo"""
+    poem_lines = None
+    for line in lines:
+        if line.strip().startswith('Filastrocca '):
+            if poem_lines is not None:
+                poem = _finish_poem(poem_lines)
+                if poem is not None:
+                    yield poem
+            poem_lines = [line]
+        elif poem_lines is not None:
+            poem_lines.append(line)
+    if poem_lines is not None:
+        poem = _finish_poem(poem_lines)
+        if poem is not None:
+            yield poem
+
+
+def _finish_poem(poem_lines):
+    # Costruisce il testo completo della filastrocca
+    poem_text = '\n'.join(poem_lines).strip()
+
+    # Solo se ha contenuto significativo (più del titolo)
+    if len(poem_lines) > 2 and len(poem_text) > 50:
+        # Log per debug
+        print(f"[INFO] Estratta: {poem_lines[0]}")
+        print(f"[INFO] Lunghezza: {len(poem_text)} caratteri")
+        return poem_text
+    return None
+
+
+def extract_poems_from_text(text):
+    """Estrae le filastrocche CORRETTAMENTE"""
+    return list(iter_poems(text.split('\n')))
+
+
+def file_hash(path):
+    """SHA-256 del contenuto del file"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def poem_records(pdf_path, pages):
+    """Documenti (testo + metadati) delle filastrocche, dalle pagine estratte"""
+    records = []
+    for i, poem in enumerate(iter_poems(iter_page_lines(pages))):
+        # Estrae il titolo per i metadati
+        first_line = poem.split('\n')[0]
+        title = first_line.replace('Filastrocca ', '').strip()
+        records.append({
+            'page_content': poem,
+            'metadata': {
+                'source': pdf_path,
+                'poem_index': i,
+                'title': title,
+                'type': 'poem'
+            }
+        })
+    return records
+
+
+class IngestProgress:
+    """Stato dell'ultima indicizzazione, leggibile da /manage mentre è in corso"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = {}
+        self.reset(0)
+
+    def reset(self, files_total):
+        with self._lock:
+            self._state = {
+                'running': files_total > 0,
+                'files_total': files_total,
+                'files_parsed': 0,
+                'files_skipped': 0,
+                'files_duplicate': 0,
+                'chunks_total': 0,
+                'chunks_embedded': 0,
+                'current': None,
+                'started_at': time.time(),
+                'finished_at': None,
+                'errors': [],
+                'backends': {},
+            }
+
+    def update(self, **fields):
+        with self._lock:
+            for key, value in fields.items():
+                if key == 'errors':
+                    self._state['errors'].extend(value)
+                else:
+                    self._state[key] = value
+
+    def increment(self, key, amount=1):
+        with self._lock:
+            self._state[key] += amount
+
+    def snapshot(self):
+        with self._lock:
+            state = dict(self._state)
+            state['errors'] = list(self._state['errors'])
+        return state
+
+
+progress = IngestProgress()
+
+
+def read_manifest(vector_dir):
+    """Manifest {percorso: {'hash', 'ids'}} dei PDF già indicizzati"""
+    try:
+        with open(os.path.join(vector_dir, MANIFEST_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_manifest(vector_dir, manifest):
+    path = os.path.join(vector_dir, MANIFEST_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(path + '.tmp', path)
+
+
+def remove_manifest(vector_dir):
+    path = os.path.join(vector_dir, MANIFEST_FILE)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def parse_all(pdf_paths, workers=PARSE_WORKERS, job=None, hashes=None, backend=None,
+              text_cache_dir=pdf_extract.TEXT_CACHE_DIR):
+    """Testo e filastrocche dei PDF; ritorna {percorso: risultato}.
+
+    I PDF già estratti (stesso hash) si leggono dalla cache del testo; gli altri si dividono in blocchi
+    di pagine estratti in parallelo in un pool di processi.
+    """
+    hashes = hashes or {}
+    # Il testo in cache vale solo per lo stesso backend: layout diversi danno filastrocche diverse
+    backend = pdf_extract.choose_backend(backend)
+    cache = pdf_extract.TextCache(text_cache_dir, backend)
+    results = {}
+    to_extract = []
+    for path in pdf_paths:
+        digest = hashes.get(path)
+        if cache.has(digest):
+            start = time.time()
+            try:
+                records = poem_records(path, cache.iter_pages(digest))
+            except (OSError, EOFError, ValueError) as e:
+                # File di cache rovinato: si rilegge il PDF e la cache viene riscritta
+                print(f"[DEBUG] Cache del testo illeggibile per {path}: {e}", file=sys.stderr)
+                to_extract.append(path)
+                continue
+            results[path] = {'pages': None, 'records': records, 'backend': 'cache', 'cached': True,
+                             'parse_seconds': 0.0, 'extract_seconds': time.time() - start}
+            print(f"[INFO] Testo di {path} dalla cache")
+            progress.increment('files_parsed')
+        else:
+            to_extract.append(path)
+    if not to_extract:
+        return results
+
+    plan = []
+    for path in to_extract:
+        try:
+            n_pages = pdf_extract.page_count(path, backend)
+        except Exception as e:
+            progress.update(errors=[f"{os.path.basename(path)}: {e}"])
+            progress.increment('files_parsed')
+            continue
+        print(f"[INFO] Caricamento PDF: {path} ({n_pages} pagine, {backend})")
+        plan.append((path, pdf_extract.page_ranges(n_pages)))
+
+    # Un solo blocco di pagine: avviare i processi costerebbe più dell'estrazione
+    tasks = sum(len(ranges) for _, ranges in plan)
+    if workers > 1 and tasks > 1:
+        executor = ProcessPoolExecutor(max_workers=min(workers, tasks))
+    else:
+        executor = ThreadPoolExecutor(max_workers=1)
+    with executor as pool:
+        futures = {}
+        pending = {}
+        for path, ranges in plan:
+            pending[path] = {'parts': {}, 'ranges': len(ranges), 'seconds': 0.0, 'started': time.time()}
+            for start, stop in ranges:
+                futures[pool.submit(pdf_extract.extract_range, path, backend, start, stop)] = (path, start)
+            if not ranges:
+                _finish_file(path, pending.pop(path), backend, cache, hashes, results)
+
+        for future in as_completed(futures):
+            if job is not None and job.cancelled():
+                for other in futures:
+                    other.cancel()
+                job.check_cancelled()
+            path, start = futures[future]
+            state = pending.get(path)
+            if state is None:
+                continue
+            try:
+                pages, seconds = future.result()
+            except Exception as e:
+                progress.update(errors=[f"{os.path.basename(path)}: {e}"])
+                progress.increment('files_parsed')
+                del pending[path]
+                continue
+            state['parts'][start] = pages
+            state['seconds'] += seconds
+            if len(state['parts']) == state['ranges']:
+                _finish_file(path, pending.pop(path), backend, cache, hashes, results)
+    return results
+
+
+def _finish_file(path, state, backend, cache, hashes, results):
+    """Tutti i blocchi di pagine di un PDF sono pronti: cache del testo e filastrocche"""
+    pages = [page for start in sorted(state['parts']) for page in state['parts'][start]]
+    wall = time.time() - state['started']
+    pdf_extract.record_extraction(backend, len(pages), state['seconds'], wall)
+    rate = len(pages) / state['seconds'] if state['seconds'] else 0.0
+    print(f"[INFO] Trovate {len(pages)} pagine in {path} ({backend}, {wall:.2f} s, {rate:.0f} pagine/s per worker)")
+    progress.update(current=os.path.basename(path))
+    try:
+        cache.put(hashes.get(path), pages)
+    except OSError as e:
+        print(f"[DEBUG] Cache del testo non scritta per {path}: {e}", file=sys.stderr)
+    start = time.time()
+    results[path] = {'pages': len(pages), 'records': poem_records(path, pages), 'backend': backend,
+                     'cached': False, 'parse_seconds': state['seconds'], 'extract_seconds': time.time() - start}
+    progress.increment('files_parsed')
+
+
+def embed_in_batches(store, documents, ids, embedding, batch_size=EMBED_BATCH_SIZE, job=None):
+    """Aggiunge i documenti all'indice a blocchi di batch_size (crea l'indice se manca)"""
+    from langchain_community.vectorstores import FAISS
+    for start in range(0, len(documents), batch_size):
+        if job is not None:
+            job.check_cancelled()
+        batch = documents[start:start + batch_size]
+        batch_ids = ids[start:start + batch_size]
+        if store is None:
+            store = FAISS.from_documents(batch, embedding, ids=batch_ids)
+        else:
+            store.add_documents(batch, ids=batch_ids)
+        progress.increment('chunks_embedded', len(batch))
+    return store
+
+
+def run_ingestion(pdf_paths, manager, embedding, batch_size=EMBED_BATCH_SIZE, workers=PARSE_WORKERS, job=None,
+                  keyword_index=None, poem_catalog=None, text_cache_dir=pdf_extract.TEXT_CACHE_DIR,
+                  index_locks=()):
+    """Indicizza i PDF: salta quelli invariati, sostituisce i vettori di quelli modificati.
+
+    Se job è dato (vedi rag/jobs.py) registra i tempi per fase e ne rispetta la cancellazione.
+    index_locks sono i lock con cui i lettori sincronizzano keyword_index e poem_catalog con la generazione:
+    restano presi dallo swap fino all'aggiornamento dei due indici.
+    """
+    progress.reset(len(pdf_paths))
+    try:
+        return _ingest(pdf_paths, manager, embedding, batch_size, workers, job, keyword_index, poem_catalog,
+                       text_cache_dir, index_locks)
+    finally:
+        progress.update(running=False, current=None, finished_at=time.time())
+
+
+def _ingest(pdf_paths, manager, embedding, batch_size, workers, job, keyword_index, poem_catalog, text_cache_dir,
+            index_locks):
+    # langchain e faiss si importano solo quando si indicizza davvero (avvio del server più rapido)
+    from langchain_core.documents import Document
+    from rag import index_builder
+
+    def phase(name):
+        return job.phase(name) if job is not None else nullcontext()
+
+    manifest = read_manifest(manager.vector_dir)
+
+    # 1) Hash del contenuto: i file già indicizzati e invariati non vengono riletti, e un PDF con lo stesso
+    #    contenuto di uno già indicizzato (anche con un altro nome) diventa un alias senza nuovi vettori
+    hashes = {path: file_hash(path) for path in pdf_paths}
+    # Chi possiede i vettori di ogni contenuto, esclusi i PDF che in questo giro cambiano contenuto
+    owners = {entry['hash']: path for path, entry in manifest.items()
+              if entry.get('ids') and hashes.get(path, entry['hash']) == entry['hash']}
+    to_parse = []
+    aliases = {}
+    for path in pdf_paths:
+        entry = manifest.get(path)
+        if entry and entry.get('hash') == hashes[path]:
+            print(f"[INFO] PDF invariato, salto: {path}")
+            progress.increment('files_skipped')
+        elif owners.get(hashes[path], path) != path:
+            aliases[path] = owners[hashes[path]]
+        else:
+            to_parse.append(path)
+            owners[hashes[path]] = path
+
+    # 2) Parsing parallelo
+    parsed = parse_all(to_parse, workers, job, hashes=hashes, text_cache_dir=text_cache_dir)
+    progress.update(backends=pdf_extract.extraction_stats())
+    if job is not None:
+        # Tempi misurati nei worker: lettura del PDF ed estrazione delle filastrocche
+        job.add_timing('parse', sum(r['parse_seconds'] for r in parsed.values()))
+        job.add_timing('extract', sum(r['extract_seconds'] for r in parsed.values()))
+
+    all_documents = []
+    all_ids = []
+    stale_ids = []
+    new_entries = {}
+    for path in to_parse:
+        if path not in parsed:
+            continue
+        docs = []
+        for record in parsed[path]['records']:
+            metadata = dict(record['metadata'], content_hash=hashes[path])
+            docs.append(Document(page_content=record['page_content'], metadata=metadata))
+            print(f"[INFO] Memorizzata filastrocca: {metadata['title']}")
+        ids = [str(uuid.uuid4()) for _ in docs]
+        all_documents.extend(docs)
+        all_ids.extend(ids)
+        # Un PDF modificato sostituisce i suoi vecchi vettori invece di duplicarli
+        if path in manifest:
+            stale_ids.extend(_release_ids(manifest, path, new_entries, skip=set(to_parse) | set(aliases)))
+        new_entries[path] = {'hash': hashes[path], 'ids': ids}
+
+    for path, owner in aliases.items():
+        if owner not in new_entries and not manifest.get(owner, {}).get('ids'):
+            # Il PDF originale non è stato indicizzato (errore di lettura): l'alias verrà riprovato
+            continue
+        print(f"[INFO] PDF con lo stesso contenuto di {os.path.basename(owner)}, nessun nuovo embedding: {path}")
+        progress.increment('files_duplicate')
+        if path in manifest:
+            stale_ids.extend(_release_ids(manifest, path, new_entries, skip=set(to_parse) | set(aliases)))
+        new_entries[path] = {'hash': hashes[path], 'ids': [], 'duplicate_of': owner}
+
+    print(f"[INFO] Creati {len(all_documents)} documenti (filastrocche)")
+    progress.update(chunks_total=len(all_documents), current='embedding')
+
+    # 3) Embedding a batch su una copia dell'indice, poi swap atomico
+    if all_documents or stale_ids:
+        store = manager.load_from_disk()
+        with phase('embed'):
+            if store is not None and stale_ids:
+                store = index_builder.delete_ids(store, stale_ids, embedding)
+            store = embed_in_batches(store, all_documents, all_ids, embedding, batch_size, job)
+            # Un indice nuovo nasce Flat: lo si porta al tipo configurato (IVF/HNSW/PQ) quando i vettori
+            # bastano per addestrarlo, e lo si riaddestra quando il corpus è cresciuto
+            store = index_builder.ensure_index_type(store, manager.vector_dir, embedding)
+        if job is not None:
+            job.check_cancelled()
+        with phase('index_write'), ExitStack() as locks:
+            # Chi legge la nuova generazione aspetta gli indici aggiornati invece di ricostruirli dal docstore
+            for lock in index_locks:
+                locks.enter_context(lock)
+            generation = manager.swap(store)
+            manifest.update(new_entries)
+            write_manifest(manager.vector_dir, manifest)
+            # Aggiornamento incrementale dell'indice keyword (solo i chunk toccati)
+            if keyword_index is not None:
+                keyword_index.remove(stale_ids)
+                keyword_index.add_documents(all_ids, all_documents)
+                keyword_index.save(generation)
+            # Catalogo dei titoli per le richieste di una filastrocca per nome
+            if poem_catalog is not None:
+                poem_catalog.remove(stale_ids)
+                poem_catalog.add_documents(all_ids, all_documents)
+                poem_catalog.save(generation)
+            # Testo in cache solo per i PDF ancora indicizzati
+            pdf_extract.TextCache(text_cache_dir).prune({entry['hash'] for entry in manifest.values()})
+    elif new_entries:
+        # Solo alias: nessun vettore da aggiornare
+        manifest.update(new_entries)
+        write_manifest(manager.vector_dir, manifest)
+
+    return len(all_documents), all_documents
+
+
+def _release_ids(manifest, path, new_entries, skip):
+    """Vettori di un PDF modificato da eliminare. Se un alias ha ancora il vecchio contenuto, i vettori
+    passano a lui (i metadati 'source' restano quelli del file originale)."""
+    old = manifest[path]
+    heirs = [other for other, entry in manifest.items()
+             if entry.get('duplicate_of') == path and entry.get('hash') == old.get('hash')
+             and other not in skip and other not in new_entries]
+    if not heirs or not old.get('ids'):
+        return old.get('ids', [])
+    new_entries[heirs[0]] = {'hash': old['hash'], 'ids': old['ids']}
+    for other in heirs[1:]:
+        new_entries[other] = dict(manifest[other], duplicate_of=heirs[0])
+    return []
@@ -0,0 +1,147 @@
+# File: jobs.py
+# Descrizione: Coda di job in background (indicizzazione PDF) con stato, tempi per fase e cancellazione
+
+import itertools
+import queue
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from contextlib import contextmanager
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+
+class JobCancelled(Exception):
+    """Sollevata dentro il job quando è stata richiesta la cancellazione"""
+
+
+class Job:
+    def __init__(self, job_id, kind, fn, args, description=''):
+        self.id = job_id
+        self.kind = kind
+        self.fn = fn
+        self.args = args
+        self.description = description
+        self.status = QUEUED
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.timings = OrderedDict()
+        self.result = None
+        self.error = None
+        self._cancel = threading.Event()
+
+    @contextmanager
+    def phase(self, name):
+        """Misura la durata di una fase (parse, extract, embed, index_write...)"""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_timing(name, time.time() - start)
+
+    def add_timing(self, name, seconds):
+        self.timings[name] = round(self.timings.get(name, 0.0) + seconds, 4)
+
+    def cancel(self):
+        self._cancel.set()
+
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def check_cancelled(self):
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'description': self.description,
+            'status': self.status,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'timings': dict(self.timings),
+            'result': self.result,
+            'error': self.error,
+        }
+
+
+class JobQueue:
+    """Coda FIFO servita da thread worker; mantiene lo storico degli ultimi max_history job"""
+
+    def __init__(self, workers=1, max_history=50):
+        self._queue = queue.Queue()
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.max_history = max_history
+        self._workers = []
+        for i in range(workers):
+            worker = threading.Thread(target=self._run, name=f'job-worker-{i}', daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, kind, fn, *args, description=''):
+        """fn(job, *args) viene eseguita in un worker; ritorna il Job"""
+        with self._lock:
+            job = Job(str(next(self._ids)), kind, fn, args, description)
+            self._jobs[job.id] = job
+            self._trim()
+        self._queue.put(job)
+        print(f"[INFO] Job {job.id} ({kind}) in coda: {description}")
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self):
+        with self._lock:
+            return [job.to_dict() for job in reversed(self._jobs.values())]
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is None:
+            return None
+        job.cancel()
+        if job.status == QUEUED:
+            job.status = CANCELLED
+            job.finished_at = time.time()
+        return job
+
+    def _trim(self):
+        # Rimuove i job terminati più vecchi oltre max_history
+        finished = [jid for jid, job in self._jobs.items() if job.status in (DONE, FAILED, CANCELLED)]
+        while len(self._jobs) > self.max_history and finished:
+            del self._jobs[finished.pop(0)]
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job.cancelled():
+                    continue
+                job.status = RUNNING
+                job.started_at = time.time()
+                try:
+                    job.result = job.fn(job, *job.args)
+                    job.status = DONE
+                except JobCancelled:
+                    job.status = CANCELLED
+                    print(f"[INFO] Job {job.id} cancellato")
+                except Exception as e:
+                    job.status = FAILED
+                    job.error = str(e)
+                    print(f"[ERRORE] Job {job.id} fallito: {e}")
+                    traceback.print_exc()
+                job.finished_at = time.time()
+                job.add_timing('total', job.finished_at - job.started_at)
+            finally:
+                self._queue.task_done()
@@ -0,0 +1,213 @@
+# File: keyword_index.py
+# Descrizione: Indice invertito BM25 su testo e titoli dei chunk (persistito accanto a data/vectors)
+
+import bisect
+import json
+import math
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter
+
+from rag import docstore
+
+INDEX_FILE = 'keyword_index.json'
+
+# Parole troppo comuni nelle richieste per distinguere una filastrocca dall'altra
+STOPWORDS = {
+    'il', 'lo', 'la', 'i', 'gli', 'le', 'un', 'uno', 'una', 'di', 'del', 'della', 'dei', 'delle',
+    'a', 'al', 'alla', 'ai', 'alle', 'da', 'dal', 'dalla', 'in', 'nel', 'nella', 'con', 'su', 'per',
+    'tra', 'fra', 'e', 'ed', 'o', 'che', 'chi', 'mi', 'ti', 'ci', 'si', 'me', 'te', 'quella', 'quello',
+    'filastrocca', 'filastrocche', 'recita', 'recitami', 'dimmi', 'racconta', 'raccontami',
+}
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+TITLE_BOOST = 3.0
+
+
+def fold(text):
+    """Minuscole e senza accenti"""
+    text = unicodedata.normalize('NFKD', str(text or '').lower())
+    return ''.join(c for c in text if not unicodedata.combining(c))
+
+
+def tokenize(text, stopwords=True):
+    tokens = re.findall(r'\w+', fold(text))
+    if stopwords:
+        tokens = [t for t in tokens if t not in STOPWORDS]
+    return tokens
+
+
+def doc_key(metadata):
+    """Chiave stabile di un chunk indipendente dall'id nel docstore"""
+    return f"{metadata.get('source', '')}#{metadata.get('poem_index', '')}"
+
+
+class KeywordIndex:
+    """Indice invertito con due campi (testo, titolo) e punteggio BM25"""
+
+    def __init__(self, vector_dir):
+        self.path = os.path.join(vector_dir, INDEX_FILE)
+        self._lock = threading.RLock()
+        self.generation = None
+        self._reset()
+
+    def _reset(self):
+        self.docs = {}          # id -> {'len', 'key'}
+        self.postings = {}      # termine -> {id: tf} (testo)
+        self.title_postings = {}  # termine -> {id: tf} (titolo)
+        self.key_to_id = {}
+        self.total_len = 0
+        self._vocab = None
+
+    # ---------------------------
+    # Aggiornamento
+    # ---------------------------
+    def add(self, doc_id, text, title='', key=None):
+        with self._lock:
+            if doc_id in self.docs:
+                self.remove([doc_id])
+            # Si indicizzano tutte le parole; le stopword vengono scartate solo nelle query BM25
+            tokens = tokenize(text, stopwords=False)
+            self.docs[doc_id] = {'len': len(tokens), 'key': key}
+            self.total_len += len(tokens)
+            for term, tf in Counter(tokens).items():
+                self.postings.setdefault(term, {})[doc_id] = tf
+            for term, tf in Counter(tokenize(title, stopwords=False)).items():
+                self.title_postings.setdefault(term, {})[doc_id] = tf
+            if key is not None:
+                self.key_to_id[key] = doc_id
+            self._vocab = None
+
+    def add_documents(self, ids, documents):
+        for doc_id, doc in zip(ids, documents):
+            self.add(doc_id, doc.page_content, doc.metadata.get('title', ''), doc_key(doc.metadata))
+
+    def remove(self, ids):
+        with self._lock:
+            ids = set(ids) & set(self.docs)
+            if not ids:
+                return
+            for postings in (self.postings, self.title_postings):
+                for term in list(postings):
+                    entry = postings[term]
+                    for doc_id in ids & entry.keys():
+                        del entry[doc_id]
+                    if not entry:
+                        del postings[term]
+            for doc_id in ids:
+                info = self.docs.pop(doc_id)
+                self.total_len -= info['len']
+                if info.get('key') is not None and self.key_to_id.get(info['key']) == doc_id:
+                    del self.key_to_id[info['key']]
+            self._vocab = None
+
+    def rebuild(self, store, generation=None):
+        """Ricostruisce l'indice leggendo tutto il docstore FAISS"""
+        with self._lock:
+            self._reset()
+            if store is not None:
+                for position, doc in docstore.iter_chunks(store):
+                    doc_id = store.index_to_docstore_id[position]
+                    self.add(doc_id, doc.page_content, doc.metadata.get('title', ''), doc_key(doc.metadata))
+            self.generation = generation
+        print(f"[INFO] Indice keyword ricostruito: {len(self.docs)} chunk")
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+            self.generation = None
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    # ---------------------------
+    # Persistenza
+    # ---------------------------
+    def save(self, generation):
+        with self._lock:
+            self.generation = generation
+            data = {
+                'generation': generation,
+                'docs': self.docs,
+                'postings': self.postings,
+                'title_postings': self.title_postings,
+            }
+            with open(self.path + '.tmp', 'w') as f:
+                json.dump(data, f)
+            os.replace(self.path + '.tmp', self.path)
+
+    def load(self):
+        """Carica l'indice da disco; ritorna False se manca o è illeggibile"""
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        with self._lock:
+            self._reset()
+            self.docs = data['docs']
+            self.postings = data['postings']
+            self.title_postings = data['title_postings']
+            self.total_len = sum(d['len'] for d in self.docs.values())
+            self.key_to_id = {d['key']: i for i, d in self.docs.items() if d.get('key') is not None}
+            self.generation = data.get('generation')
+        return True
+
+    # ---------------------------
+    # Ricerca
+    # ---------------------------
+    def _bm25(self, postings, term, scores, weight, avg_len, restrict=None):
+        entry = postings.get(term)
+        if not entry:
+            return
+        n = len(self.docs)
+        idf = math.log(1 + (n - len(entry) + 0.5) / (len(entry) + 0.5))
+        for doc_id, tf in entry.items():
+            if restrict is not None and doc_id not in restrict:
+                continue
+            if postings is self.postings:
+                norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * self.docs[doc_id]['len'] / avg_len)
+            else:
+                # I titoli sono brevi e simili in lunghezza: niente normalizzazione
+                norm = tf + BM25_K1
+            scores[doc_id] = scores.get(doc_id, 0.0) + weight * idf * tf * (BM25_K1 + 1) / norm
+
+    def search(self, query, k=10, title_boost=TITLE_BOOST, restrict=None):
+        """Ritorna [(id, punteggio)] ordinati per BM25 (testo + titolo pesato)"""
+        with self._lock:
+            if not self.docs:
+                return []
+            avg_len = max(1.0, self.total_len / len(self.docs))
+            scores = {}
+            for term in set(tokenize(query)):
+                self._bm25(self.postings, term, scores, 1.0, avg_len, restrict)
+                if title_boost:
+                    self._bm25(self.title_postings, term, scores, title_boost, avg_len, restrict)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return ranked[:k] if k else ranked
+
+    def _prefix_matches(self, prefix):
+        if self._vocab is None:
+            self._vocab = sorted(self.postings)
+        start = bisect.bisect_left(self._vocab, prefix)
+        terms = []
+        for term in self._vocab[start:]:
+            if not term.startswith(prefix):
+                break
+            terms.append(term)
+        return terms
+
+    def match_all(self, query):
+        """Id dei chunk che contengono tutte le parole della query (anche come prefisso)"""
+        with self._lock:
+            result = None
+            for token in tokenize(query, stopwords=False):
+                ids = set()
+                for term in self._prefix_matches(token):
+                    ids.update(self.postings[term])
+                result = ids if result is None else result & ids
+                if not result:
+                    return set()
+            return result or set()
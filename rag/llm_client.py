@@ -0,0 +1,288 @@
+# File: llm_client.py
+# Descrizione: Client Ollama condiviso (connessioni riusate, keep_alive per modello, preload e metriche)
+
+import os
+import sys
+import threading
+import time
+
+from rag.scheduler import LLMScheduler, WEB, ROBOT, API
+from rag.tracing import tracer
+
+# PYOLLAMA_OLLAMA_HOST permette di puntare a un altro server (es. il finto Ollama di bench/)
+OLLAMA_HOST = os.environ.get('PYOLLAMA_OLLAMA_HOST', 'http://localhost:11434')
+DEFAULT_MODEL = 'gemma3:4b'
+
+# Quanto a lungo Ollama tiene il modello in memoria dopo l'ultima richiesta
+DEFAULT_KEEP_ALIVE = '10m'
+KEEP_ALIVE = {
+    'gemma3:4b': '60m',
+}
+
+
+# Su CPU due generazioni in parallelo sullo stesso modello si rallentano a vicenda:
+# una alla volta per modello, al massimo MAX_QUEUE richieste in attesa
+MODEL_CONCURRENCY = {}
+DEFAULT_CONCURRENCY = 1
+MAX_QUEUE = 16
+# Attesa massima in coda (secondi) per priorità
+QUEUE_DEADLINE = {ROBOT: 60, API: 60, WEB: 30}
+
+
+def _seconds(ns):
+    return round((ns or 0) / 1e9, 4)
+
+
+class ModelMetrics:
+    """Tempi per modello: caricamento, primo token, valutazione del prompt e generazione"""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.last = {}
+        self.totals = {'load': 0.0, 'ttft': 0.0, 'prompt_eval': 0.0, 'eval': 0.0, 'total': 0.0}
+        self.ttft_count = 0
+
+    def record(self, response, ttft=None, wall=None):
+        """response è la risposta finale di Ollama (contiene le durate in nanosecondi)"""
+        sample = {
+            'load': _seconds(response.get('load_duration')),
+            'prompt_eval': _seconds(response.get('prompt_eval_duration')),
+            'eval': _seconds(response.get('eval_duration')),
+            'total': _seconds(response.get('total_duration')),
+            'prompt_tokens': response.get('prompt_eval_count'),
+            'eval_tokens': response.get('eval_count'),
+        }
+        if ttft is not None:
+            sample['ttft'] = round(ttft, 4)
+            self.totals['ttft'] += ttft
+            self.ttft_count += 1
+        if wall is not None:
+            sample['wall'] = round(wall, 4)
+        for key in ('load', 'prompt_eval', 'eval', 'total'):
+            self.totals[key] += sample[key]
+        self.requests += 1
+        self.last = sample
+        return sample
+
+    def to_dict(self):
+        n = max(1, self.requests)
+        averages = {key: round(value / n, 4) for key, value in self.totals.items() if key != 'ttft'}
+        averages['ttft'] = round(self.totals['ttft'] / self.ttft_count, 4) if self.ttft_count else None
+        return {'requests': self.requests, 'errors': self.errors, 'average': averages, 'last': self.last}
+
+
+class LLMClient:
+    """Un solo Client HTTP (pool di connessioni keep-alive) condiviso da tutte le richieste e i modelli"""
+
+    def __init__(self, host=OLLAMA_HOST, keep_alive=None, default_keep_alive=DEFAULT_KEEP_ALIVE, timeout=None,
+                 scheduler=None):
+        self.host = host
+        self.scheduler = scheduler or LLMScheduler(DEFAULT_CONCURRENCY, MODEL_CONCURRENCY, MAX_QUEUE, QUEUE_DEADLINE)
+        self.keep_alive = dict(KEEP_ALIVE, **(keep_alive or {}))
+        self.default_keep_alive = default_keep_alive
+        self.timeout = timeout
+        # Client creati al primo uso: il pacchetto ollama non si importa all'avvio, il client asyncio
+        # nasce dentro l'event loop del server ASGI
+        self._client = None
+        self._async_client = None
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    from ollama import Client
+                    self._client = Client(host=self.host, timeout=self.timeout)
+        return self._client
+
+    def keep_alive_for(self, model_name):
+        return self.keep_alive.get(model_name, self.default_keep_alive)
+
+    def _metrics_for(self, model_name):
+        with self._lock:
+            if model_name not in self._metrics:
+                self._metrics[model_name] = ModelMetrics()
+            return self._metrics[model_name]
+
+    def _record(self, model_name, metrics, response, ttft=None, wall=None):
+        """Metriche del modello + istogrammi per /metrics (le durate di Ollama sono in nanosecondi)"""
+        sample = metrics.record(response, ttft=ttft, wall=wall)
+        tracer.observe('llm_ttft', sample.get('ttft'), model=model_name)
+        tracer.observe('llm_total', sample.get('wall'), model=model_name)
+        tracer.observe('llm_load', sample['load'], model=model_name)
+        tracer.observe('llm_prompt_eval', sample['prompt_eval'], model=model_name)
+        tracer.count('llm_prompt_tokens', sample['prompt_tokens'] or 0, model=model_name)
+        tracer.count('llm_eval_tokens', sample['eval_tokens'] or 0, model=model_name)
+        tracer.verbose(f"Tempi {model_name}", sample)
+
+    # ---------------------------
+    # Chat (app-ollama: messaggi system + user)
+    # ---------------------------
+    def chat(self, model_name, messages, options=None, priority=WEB, deadline=None):
+        metrics = self._metrics_for(model_name)
+        with self.scheduler.slot(model_name, priority, deadline):
+            start = time.time()
+            try:
+                response = self.client.chat(model=model_name, messages=messages, options=options,
+                                             keep_alive=self.keep_alive_for(model_name))
+            except Exception:
+                metrics.errors += 1
+                tracer.count('llm_errors', model=model_name)
+                raise
+        self._record(model_name, metrics, response, wall=time.time() - start)
+        return response
+
+    def chat_stream(self, model_name, messages, options=None, priority=WEB, deadline=None):
+        """Produce i token della risposta man mano che arrivano"""
+        with self.scheduler.slot(model_name, priority, deadline):
+            stream = self.client.chat(model=model_name, messages=messages, options=options, stream=True,
+                                       keep_alive=self.keep_alive_for(model_name))
+            for token in self._consume(model_name, stream, lambda chunk: chunk['message']['content']):
+                yield token
+
+    # ---------------------------
+    # Generate (RAG: prompt già costruito)
+    # ---------------------------
+    def generate(self, model_name, prompt, options=None, priority=WEB, deadline=None):
+        metrics = self._metrics_for(model_name)
+        with self.scheduler.slot(model_name, priority, deadline):
+            start = time.time()
+            try:
+                response = self.client.generate(model=model_name, prompt=prompt, options=options,
+                                                 keep_alive=self.keep_alive_for(model_name))
+            except Exception:
+                metrics.errors += 1
+                tracer.count('llm_errors', model=model_name)
+                raise
+        self._record(model_name, metrics, response, wall=time.time() - start)
+        return response['response']
+
+    def generate_stream(self, model_name, prompt, options=None, priority=WEB, deadline=None):
+        with self.scheduler.slot(model_name, priority, deadline):
+            stream = self.client.generate(model=model_name, prompt=prompt, options=options, stream=True,
+                                           keep_alive=self.keep_alive_for(model_name))
+            for token in self._consume(model_name, stream, lambda chunk: chunk['response']):
+                yield token
+
+    def _consume(self, model_name, stream, get_token):
+        metrics = self._metrics_for(model_name)
+        start = time.time()
+        ttft = None
+        try:
+            for chunk in stream:
+                token = get_token(chunk)
+                if token and ttft is None:
+                    ttft = time.time() - start
+                if token:
+                    yield token
+                if chunk.get('done'):
+                    self._record(model_name, metrics, chunk, ttft=ttft, wall=time.time() - start)
+        except Exception:
+            metrics.errors += 1
+            tracer.count('llm_errors', model=model_name)
+            raise
+
+    # ---------------------------
+    # Versioni asyncio (server ASGI, vedi asgi.py)
+    # ---------------------------
+    @property
+    def async_client(self):
+        if self._async_client is None:
+            from ollama import AsyncClient
+            self._async_client = AsyncClient(host=self.host, timeout=self.timeout)
+        return self._async_client
+
+    async def achat(self, model_name, messages, options=None, priority=WEB, deadline=None):
+        metrics = self._metrics_for(model_name)
+        async with self.scheduler.slot_async(model_name, priority, deadline):
+            start = time.time()
+            try:
+                response = await self.async_client.chat(model=model_name, messages=messages, options=options,
+                                                        keep_alive=self.keep_alive_for(model_name))
+            except Exception:
+                metrics.errors += 1
+                tracer.count('llm_errors', model=model_name)
+                raise
+        self._record(model_name, metrics, response, wall=time.time() - start)
+        return response
+
+    async def achat_stream(self, model_name, messages, options=None, priority=WEB, deadline=None):
+        async with self.scheduler.slot_async(model_name, priority, deadline):
+            stream = await self.async_client.chat(model=model_name, messages=messages, options=options,
+                                                  stream=True, keep_alive=self.keep_alive_for(model_name))
+            async for token in self._aconsume(model_name, stream, lambda chunk: chunk['message']['content']):
+                yield token
+
+    async def agenerate(self, model_name, prompt, options=None, priority=WEB, deadline=None):
+        metrics = self._metrics_for(model_name)
+        async with self.scheduler.slot_async(model_name, priority, deadline):
+            start = time.time()
+            try:
+                response = await self.async_client.generate(model=model_name, prompt=prompt, options=options,
+                                                            keep_alive=self.keep_alive_for(model_name))
+            except Exception:
+                metrics.errors += 1
+                tracer.count('llm_errors', model=model_name)
+                raise
+        self._record(model_name, metrics, response, wall=time.time() - start)
+        return response['response']
+
+    async def agenerate_stream(self, model_name, prompt, options=None, priority=WEB, deadline=None):
+        async with self.scheduler.slot_async(model_name, priority, deadline):
+            stream = await self.async_client.generate(model=model_name, prompt=prompt, options=options,
+                                                      stream=True, keep_alive=self.keep_alive_for(model_name))
+            async for token in self._aconsume(model_name, stream, lambda chunk: chunk['response']):
+                yield token
+
+    async def _aconsume(self, model_name, stream, get_token):
+        metrics = self._metrics_for(model_name)
+        start = time.time()
+        ttft = None
+        try:
+            async for chunk in stream:
+                token = get_token(chunk)
+                if token and ttft is None:
+                    ttft = time.time() - start
+                if token:
+                    yield token
+                if chunk.get('done'):
+                    self._record(model_name, metrics, chunk, ttft=ttft, wall=time.time() - start)
+        except Exception:
+            metrics.errors += 1
+            tracer.count('llm_errors', model=model_name)
+            raise
+
+    # ---------------------------
+    # Preload
+    # ---------------------------
+    def preload(self, model_name=DEFAULT_MODEL):
+        """Carica il modello in memoria senza generare nulla (prompt vuoto)"""
+        start = time.time()
+        try:
+            response = self.client.generate(model=model_name, prompt='',
+                                             keep_alive=self.keep_alive_for(model_name))
+            self._metrics_for(model_name).last['preload'] = round(time.time() - start, 3)
+            print(f"[INFO] Modello {model_name} precaricato in {time.time() - start:.2f} secondi "
+                  f"(load {_seconds(response.get('load_duration'))} s)")
+        except Exception as e:
+            print(f"[DEBUG] Preload di {model_name} fallito: {e}", file=sys.stderr)
+
+    def preload_async(self, model_name=DEFAULT_MODEL):
+        threading.Thread(target=self.preload, args=(model_name,), name='llm-preload', daemon=True).start()
+
+    def stats(self):
+        with self._lock:
+            metrics = dict(self._metrics)
+        return {
+            'host': self.host,
+            'keep_alive': dict(self.keep_alive, default=self.default_keep_alive),
+            'models': {name: m.to_dict() for name, m in metrics.items()},
+            'scheduler': self.scheduler.stats(),
+        }
+
+
+# Istanza condivisa da app.py, app-ollama.py e rag_chain.py
+llm_client = LLMClient()
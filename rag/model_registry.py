@@ -0,0 +1,122 @@
+# File: model_registry.py
+# Descrizione: Elenco dei modelli Ollama (installati e già caricati in memoria) con cache e aggiornamento in background
+
+import sys
+import threading
+import time
+
+import requests
+
+from rag.llm_client import OLLAMA_HOST
+
+
+class ModelRegistry:
+    """Interroga /api/tags e /api/ps di Ollama; le pagine leggono solo la cache e non aspettano mai"""
+
+    def __init__(self, host=OLLAMA_HOST, ttl=30, timeout=2.0, fallback=None):
+        self.host = host.rstrip('/')
+        self.ttl = ttl
+        self.timeout = timeout
+        self.fallback = list(fallback or [])
+        self._session = requests.Session()
+        self._installed = []
+        self._loaded = {}
+        self._updated_at = 0.0
+        self._error = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    # ---------------------------
+    # Aggiornamento
+    # ---------------------------
+    def refresh(self):
+        """Legge i modelli installati e quelli caricati; in caso di errore tiene la cache precedente"""
+        try:
+            tags = self._session.get(f"{self.host}/api/tags", timeout=self.timeout)
+            tags.raise_for_status()
+            installed = [m['name'] for m in tags.json().get('models', [])]
+            ps = self._session.get(f"{self.host}/api/ps", timeout=self.timeout)
+            ps.raise_for_status()
+            loaded = {m['name']: m.get('expires_at') for m in ps.json().get('models', [])}
+            with self._lock:
+                self._installed = installed
+                self._loaded = loaded
+                self._updated_at = time.time()
+                self._error = None
+        except Exception as e:
+            with self._lock:
+                self._error = str(e)
+            print(f"[DEBUG] Errore durante il recupero modelli: {e}", file=sys.stderr)
+        finally:
+            self._refreshing = False
+
+    def _refresh_async(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self.refresh, name='model-registry-refresh', daemon=True).start()
+
+    def start(self, interval=None):
+        """Aggiornamento periodico in background (ogni ttl secondi se interval non è dato)"""
+        if self._thread is not None:
+            return
+        interval = interval or self.ttl
+
+        def loop():
+            while not self._stop.is_set():
+                self.refresh()
+                self._stop.wait(interval)
+
+        self._thread = threading.Thread(target=loop, name='model-registry', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _ensure_fresh(self):
+        # Se la cache è scaduta si aggiorna in background: la richiesta usa i dati che ha
+        if time.time() - self._updated_at > self.ttl:
+            self._refresh_async()
+
+    # ---------------------------
+    # Lettura
+    # ---------------------------
+    def installed(self):
+        self._ensure_fresh()
+        with self._lock:
+            return list(self._installed) or list(self.fallback)
+
+    def loaded(self):
+        """Modelli attualmente in memoria in Ollama"""
+        self._ensure_fresh()
+        with self._lock:
+            return list(self._loaded)
+
+    def models(self):
+        """Modelli installati, con quelli già caldi (caricati) per primi"""
+        installed = self.installed()
+        loaded = set(self.loaded())
+        return [m for m in installed if m in loaded] + [m for m in installed if m not in loaded]
+
+    def preferred(self, default=None):
+        """Il modello da proporre nella UI: uno già caricato, altrimenti default"""
+        loaded = self.loaded()
+        if loaded:
+            return loaded[0]
+        installed = self.installed()
+        if default in installed or not installed:
+            return default
+        return installed[0]
+
+    def status(self):
+        with self._lock:
+            return {
+                'installed': list(self._installed),
+                'loaded': dict(self._loaded),
+                'updated_at': self._updated_at,
+                'age_seconds': round(time.time() - self._updated_at, 1) if self._updated_at else None,
+                'error': self._error,
+            }
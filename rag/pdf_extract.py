@@ -0,0 +1,169 @@
+# File: pdf_extract.py
+# Descrizione: Estrazione del testo dai PDF con backend intercambiabili (pypdfium2, PyMuPDF, pypdf),
+#              a blocchi di pagine, con cache del testo estratto per hash del file
+
+import gzip
+import importlib.util
+import json
+import os
+import threading
+import time
+
+# Ordine di preferenza: pypdf (Python puro, lo stesso di PyPDFLoader) resta il default perché la divisione
+# in filastrocche dipende dal suo layout del testo; pypdfium2 e PyMuPDF (in C) si scelgono con PYOLLAMA_PDF_BACKEND
+BACKEND_ORDER = ('pypdf', 'pdfium', 'pymupdf')
+BACKEND_MODULES = {'pdfium': 'pypdfium2', 'pymupdf': 'fitz', 'pypdf': 'pypdf'}
+# Si può forzare un backend, es. PYOLLAMA_PDF_BACKEND=pypdf
+PDF_BACKEND = os.environ.get('PYOLLAMA_PDF_BACKEND') or None
+# Pagine per task nel pool di processi: abbastanza per ammortizzare l'apertura del file in ogni worker
+PAGES_PER_TASK = 16
+TEXT_CACHE_DIR = 'data/text_cache'
+# Da incrementare quando cambia il modo di estrarre il testo: invalida la cache
+EXTRACTOR_VERSION = 1
+
+
+def available_backends():
+    return [name for name in BACKEND_ORDER if importlib.util.find_spec(BACKEND_MODULES[name]) is not None]
+
+
+def choose_backend(name=None):
+    """Il backend richiesto se installato, altrimenti il primo disponibile in BACKEND_ORDER"""
+    available = available_backends()
+    name = name or PDF_BACKEND
+    if name:
+        if name in available:
+            return name
+        print(f"[INFO] Backend PDF '{name}' non disponibile, uso {available[0] if available else 'nessuno'}")
+    if not available:
+        raise RuntimeError("Nessun backend PDF installato (pypdfium2, pymupdf o pypdf)")
+    return available[0]
+
+
+# ---------------------------
+# Backend
+# ---------------------------
+def _normalize(text):
+    return (text or "").replace('\r\n', '\n').replace('\r', '\n')
+
+
+def page_count(path, backend):
+    if backend == 'pdfium':
+        import pypdfium2 as pdfium
+        pdf = pdfium.PdfDocument(path)
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+    if backend == 'pymupdf':
+        import fitz
+        with fitz.open(path) as doc:
+            return doc.page_count
+    from pypdf import PdfReader
+    return len(PdfReader(path).pages)
+
+
+def extract_range(path, backend, start, stop):
+    """Eseguita nei processi worker: testo delle pagine [start, stop); ritorna (pagine, secondi)"""
+    began = time.time()
+    pages = []
+    if backend == 'pdfium':
+        import pypdfium2 as pdfium
+        pdf = pdfium.PdfDocument(path)
+        try:
+            for i in range(start, stop):
+                page = pdf[i]
+                textpage = page.get_textpage()
+                pages.append(_normalize(textpage.get_text_range()))
+                textpage.close()
+                page.close()
+        finally:
+            pdf.close()
+    elif backend == 'pymupdf':
+        import fitz
+        with fitz.open(path) as doc:
+            for i in range(start, stop):
+                pages.append(_normalize(doc.load_page(i).get_text()))
+    else:
+        from pypdf import PdfReader
+        reader = PdfReader(path)
+        for i in range(start, stop):
+            pages.append(_normalize(reader.pages[i].extract_text()))
+    return pages, time.time() - began
+
+
+def page_ranges(n_pages, pages_per_task=PAGES_PER_TASK):
+    return [(start, min(n_pages, start + pages_per_task)) for start in range(0, n_pages, pages_per_task)]
+
+
+# ---------------------------
+# Cache del testo estratto
+# ---------------------------
+class TextCache:
+    """Pagine estratte per hash del file, backend e versione dell'estrattore (JSONL compresso, una pagina
+    per riga): reindicizzare o cambiare lo splitter non rilegge i PDF invariati"""
+
+    def __init__(self, cache_dir=TEXT_CACHE_DIR, backend=None):
+        self.cache_dir = cache_dir
+        self.backend = backend
+
+    def _path(self, digest):
+        return os.path.join(self.cache_dir, f"{digest}.{self.backend}.v{EXTRACTOR_VERSION}.jsonl.gz")
+
+    def has(self, digest):
+        return bool(digest) and os.path.exists(self._path(digest))
+
+    def iter_pages(self, digest):
+        with gzip.open(self._path(digest), 'rt', encoding='utf-8') as f:
+            for line in f:
+                yield json.loads(line)
+
+    def put(self, digest, pages):
+        if not digest:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(digest)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with gzip.open(tmp, 'wt', encoding='utf-8', compresslevel=1) as f:
+            for page in pages:
+                f.write(json.dumps(page, ensure_ascii=False) + "\n")
+        os.replace(tmp, path)
+
+    def prune(self, keep):
+        """Cancella il testo dei file che non sono più indicizzati (keep = hash dei file)"""
+        if not os.path.isdir(self.cache_dir):
+            return 0
+        removed = 0
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.jsonl.gz') and name.split('.', 1)[0] not in keep:
+                os.remove(os.path.join(self.cache_dir, name))
+                removed += 1
+        return removed
+
+
+# ---------------------------
+# Statistiche per backend
+# ---------------------------
+_stats_lock = threading.Lock()
+_stats = {}
+
+
+def record_extraction(backend, pages, seconds, wall):
+    """seconds = tempo di CPU sommato sui worker, wall = tempo reale del file"""
+    with _stats_lock:
+        entry = _stats.setdefault(backend, {'files': 0, 'pages': 0, 'seconds': 0.0, 'wall': 0.0})
+        entry['files'] += 1
+        entry['pages'] += pages
+        entry['seconds'] += seconds
+        entry['wall'] += wall
+
+
+def extraction_stats():
+    """Pagine al secondo per backend: per worker e complessive (con il parallelismo)"""
+    with _stats_lock:
+        stats = {name: dict(entry) for name, entry in _stats.items()}
+    for entry in stats.values():
+        entry['pages_per_second'] = round(entry['pages'] / entry['seconds'], 1) if entry['seconds'] else None
+        entry['pages_per_second_wall'] = round(entry['pages'] / entry['wall'], 1) if entry['wall'] else None
+        entry['seconds'] = round(entry['seconds'], 3)
+        entry['wall'] = round(entry['wall'], 3)
+    return stats
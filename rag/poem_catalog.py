@@ -0,0 +1,184 @@
+# File: poem_catalog.py
+# Descrizione: Catalogo dei titoli delle filastrocche (chiavi normalizzate + trigrammi) persistito accanto a data/vectors:
+#              le richieste di una filastrocca per nome si risolvono senza embedding né ricerca FAISS
+
+import json
+import os
+import threading
+from collections import Counter
+
+from rag import docstore
+from rag.keyword_index import tokenize
+
+CATALOG_FILE = 'poem_catalog.json'
+
+# Parole delle richieste che non fanno parte dei titoli (oltre alle stopword di keyword_index)
+REQUEST_WORDS = {
+    'per', 'favore', 'puoi', 'potresti', 'vorrei', 'voglio', 'sentire', 'ascoltare', 'canta', 'cantami',
+    'leggi', 'leggimi', 'recitare', 'raccontare', 'dire', 'ancora', 'poesia', 'storia', 'quella', 'titolo',
+    'intitolata', 'chiamata', 'ciao', 'marrtino', 'grazie', 'adesso', 'ora', 'sai', 'conosci',
+}
+
+# Suffissi flessivi e diminutivi: "gattino", "gatti", "gatto" -> "gatt"
+SUFFIXES = ('issimi', 'issime', 'issimo', 'issima', 'ini', 'ine', 'ino', 'ina', 'etti', 'ette', 'etto',
+            'etta', 'i', 'e', 'o', 'a')
+MIN_STEM = 3
+
+# Punteggio minimo del match fuzzy (media fra Dice e copertura dei trigrammi del titolo)
+FUZZY_THRESHOLD = 0.6
+
+
+def stem(token):
+    """Stemming leggero per l'italiano: toglie un solo suffisso, mai sotto MIN_STEM lettere"""
+    if token.isdigit():
+        return token
+    for suffix in SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= MIN_STEM:
+            return token[:-len(suffix)]
+    return token
+
+
+def title_key(text):
+    """Chiave del titolo: minuscole, senza accenti né stopword, parole ridotte alla radice e in ordine"""
+    tokens = {stem(t) for t in tokenize(text) if t not in REQUEST_WORDS}
+    return " ".join(sorted(tokens))
+
+
+def trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class PoemCatalog:
+    """Titolo -> id nel docstore: dizionario delle chiavi esatte e indice dei trigrammi per i titoli storpiati"""
+
+    def __init__(self, vector_dir):
+        self.path = os.path.join(vector_dir, CATALOG_FILE)
+        self._lock = threading.RLock()
+        self.generation = None
+        self._reset()
+
+    def _reset(self):
+        self.entries = {}       # id -> {'title', 'key'}
+        self.by_key = {}        # chiave -> [id]
+        self.postings = {}      # trigramma -> {id}
+
+    # ---------------------------
+    # Aggiornamento
+    # ---------------------------
+    def add(self, doc_id, title):
+        key = title_key(title)
+        if not key:
+            return
+        with self._lock:
+            if doc_id in self.entries:
+                self.remove([doc_id])
+            self.entries[doc_id] = {'title': title, 'key': key}
+            self.by_key.setdefault(key, []).append(doc_id)
+            for gram in trigrams(key):
+                self.postings.setdefault(gram, set()).add(doc_id)
+
+    def add_documents(self, ids, documents):
+        for doc_id, doc in zip(ids, documents):
+            if doc.metadata.get('type', 'poem') == 'poem':
+                self.add(doc_id, doc.metadata.get('title', ''))
+
+    def remove(self, ids):
+        with self._lock:
+            for doc_id in set(ids) & set(self.entries):
+                key = self.entries.pop(doc_id)['key']
+                same = self.by_key.get(key, [])
+                if doc_id in same:
+                    same.remove(doc_id)
+                if not same:
+                    self.by_key.pop(key, None)
+                for gram in trigrams(key):
+                    entry = self.postings.get(gram)
+                    if entry is not None:
+                        entry.discard(doc_id)
+                        if not entry:
+                            del self.postings[gram]
+
+    def rebuild(self, store, generation=None):
+        """Ricostruisce il catalogo leggendo i titoli dal docstore FAISS"""
+        with self._lock:
+            self._reset()
+            if store is not None:
+                for position, doc in docstore.iter_chunks(store, {'type': 'poem'}):
+                    self.add(store.index_to_docstore_id[position], doc.metadata.get('title', ''))
+            self.generation = generation
+        print(f"[INFO] Catalogo filastrocche ricostruito: {len(self.entries)} titoli")
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+            self.generation = None
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    # ---------------------------
+    # Persistenza
+    # ---------------------------
+    def save(self, generation):
+        with self._lock:
+            self.generation = generation
+            data = {
+                'generation': generation,
+                'entries': self.entries,
+                'postings': {gram: sorted(ids) for gram, ids in self.postings.items()},
+            }
+            with open(self.path + '.tmp', 'w') as f:
+                json.dump(data, f)
+            os.replace(self.path + '.tmp', self.path)
+
+    def load(self):
+        """Carica il catalogo da disco; ritorna False se manca o è illeggibile"""
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        with self._lock:
+            self._reset()
+            self.entries = data['entries']
+            self.postings = {gram: set(ids) for gram, ids in data['postings'].items()}
+            for doc_id, entry in self.entries.items():
+                self.by_key.setdefault(entry['key'], []).append(doc_id)
+            self.generation = data.get('generation')
+        return True
+
+    # ---------------------------
+    # Ricerca
+    # ---------------------------
+    def lookup(self, question, threshold=FUZZY_THRESHOLD):
+        """Ritorna (id, titolo, punteggio, 'exact'|'fuzzy') oppure None se nessun titolo corrisponde"""
+        key = title_key(question)
+        if not key:
+            return None
+        with self._lock:
+            ids = self.by_key.get(key)
+            if ids:
+                return ids[0], self.entries[ids[0]]['title'], 1.0, 'exact'
+
+            # Titolo storpiato o con parole in più: trigrammi in comune
+            grams = trigrams(key)
+            common = Counter()
+            for gram in grams:
+                common.update(self.postings.get(gram, ()))
+            best = None
+            for doc_id, shared in common.items():
+                title_grams = len(trigrams(self.entries[doc_id]['key']))
+                dice = 2 * shared / (len(grams) + title_grams)
+                coverage = shared / title_grams
+                score = (dice + coverage) / 2
+                if best is None or score > best[1]:
+                    best = (doc_id, score)
+        if best is None or best[1] < threshold:
+            return None
+        doc_id, score = best
+        return doc_id, self.entries[doc_id]['title'], round(score, 3), 'fuzzy'
+
+    def stats(self):
+        with self._lock:
+            return {'titles': len(self.entries), 'keys': len(self.by_key), 'trigrams': len(self.postings),
+                    'generation': self.generation}
@@ -1,228 +1,457 @@
 # File: rag_chain.py
 # VERSIONE CORRETTA - ESTRAZIONE FILASTROCCHE PERFETTA
 
-from langchain_community.document_loaders import PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain_community.llms import Ollama
-from langchain.chains import RetrievalQA
-from langchain_core.documents import Document
+# Nessun import pesante qui (torch, faiss, loader PDF): vengono caricati al primo uso
+# o dal thread di riscaldamento, così l'avvio del server resta sotto il secondo
+from rag.embeddings import LazyEmbeddings
+from rag.llm_client import llm_client
+from rag.scheduler import SchedulerRejected, WEB
+from rag.warmup import WarmUp
+from rag.vectorstore_manager import VectorStoreManager
+from rag.answer_cache import AnswerCache, normalize_query
+from rag.singleflight import SingleFlight
+from rag import ingest_pipeline
+from rag import docstore
+from rag import chunk_export
+from rag.keyword_index import KeywordIndex, doc_key
+from rag.poem_catalog import PoemCatalog
+from rag.retriever import HybridRetriever
+from rag.tracing import tracer
+from rag.context_manager import fit_chunks, estimate_tokens, RAG_CONTEXT_TOKENS
 
+import asyncio
 import os
-import shutil
-import re
+import threading
 
 PDF_DIR = 'data/pdfs'
 VECTOR_DIR = 'data/vectors'
+# Testo estratto dai PDF per hash del file: reindicizzare non rilegge i PDF invariati
+TEXT_CACHE_DIR = 'data/text_cache'
 os.makedirs(VECTOR_DIR, exist_ok=True)
 
-embedding = HuggingFaceEmbeddings(model_name='sentence-transformers/all-MiniLM-L6-v2')
+embedding = LazyEmbeddings('sentence-transformers/all-MiniLM-L6-v2')
+
+# Un solo indice FAISS in memoria, condiviso da tutte le richieste.
+# Il tipo di indice (Flat/IVF/HNSW/PQ) si sceglie con: python -m rag.index_builder --type ...
+VECTOR_MMAP = True
+vectorstore_manager = VectorStoreManager(VECTOR_DIR, embedding, mmap=VECTOR_MMAP)
 
 def load_vectorstore():
-    faiss_index = os.path.join(VECTOR_DIR, 'index.faiss')
-    if os.path.exists(faiss_index):
-        print("[INFO] Caricamento vectorstore FAISS esistente...")
-        return FAISS.load_local(VECTOR_DIR, embeddings=embedding, allow_dangerous_deserialization=True)
-    else:
-        print("[INFO] Nessun vectorstore FAISS trovato.")
-        return None
+    return vectorstore_manager.get()
 
-vectorstore = load_vectorstore()
-last_used_model = None
+# Cache delle risposte: si svuota da sola quando cambia la generazione dell'indice
+ANSWER_CACHE_THRESHOLD = 0.92
+ANSWER_CACHE_SIZE = 256
+ANSWER_CACHE_TTL = 3600
+answer_cache = AnswerCache(embed_fn=embedding.embed_query,
+                           threshold=ANSWER_CACHE_THRESHOLD,
+                           max_size=ANSWER_CACHE_SIZE,
+                           ttl=ANSWER_CACHE_TTL,
+                           version_fn=vectorstore_manager.read_generation)
 
-def extract_poems_from_text(text):
-    """Estrae le filastrocche CORRETTAMENTE"""
-    poems = []
-    
-    # Metodo più robusto: trova tutti i titoli prima
-    lines = text.split('\n')
-    poem_starts = []
-    
-    for i, line in enumerate(lines):
-        if line.strip().startswith('Filastrocca '):
-            poem_starts.append(i)
-    
-    # Estrae ogni filastrocca dal suo inizio fino al prossimo titolo
-    for i, start_idx in enumerate(poem_starts):
-        # Trova dove finisce questa filastrocca
-        if i < len(poem_starts) - 1:
-            end_idx = poem_starts[i + 1]
-        else:
-            end_idx = len(lines)
-        
-        # Costruisce il testo completo della filastrocca
-        poem_lines = lines[start_idx:end_idx]
-        poem_text = '\n'.join(poem_lines).strip()
-        
-        # Rimuove righe vuote alla fine
-        while poem_text.endswith('\n'):
-            poem_text = poem_text[:-1]
-        
-        # Solo se ha contenuto significativo (più del titolo)
-        if len(poem_lines) > 2 and len(poem_text) > 50:
-            poems.append(poem_text)
-            
-            # Log per debug
-            title_line = poem_lines[0] if poem_lines else "Senza titolo"
-            print(f"[INFO] Estratta: {title_line}")
-            print(f"[INFO] Lunghezza: {len(poem_text)} caratteri")
-    
-    return poems
+# Indice invertito BM25 (testo + titoli), allineato alla generazione del vectorstore
+keyword_index = KeywordIndex(VECTOR_DIR)
+keyword_index_lock = threading.Lock()
 
-def ingest_pdfs(pdf_paths):
-    global vectorstore
-    all_documents = []
-    
-    for pdf_path in pdf_paths:
-        print(f"[INFO] Caricamento PDF: {pdf_path}")
-        loader = PyPDFLoader(pdf_path)
-        documents = loader.load()
-        print(f"[INFO] Trovate {len(documents)} pagine in {pdf_path}")
-        
-        # Unisce tutto il contenuto del PDF
-        full_text = "\n".join([doc.page_content for doc in documents])
-        
-        # Estrae le filastrocche come documenti separati
-        poems = extract_poems_from_text(full_text)
-        
-        # Crea un documento per ogni filastrocca
-        for i, poem in enumerate(poems):
-            # Estrae il titolo per i metadati
-            first_line = poem.split('\n')[0]
-            title = first_line.replace('Filastrocca ', '').strip()
-            
-            doc = Document(
-                page_content=poem,
-                metadata={
-                    'source': pdf_path,
-                    'poem_index': i,
-                    'title': title,
-                    'type': 'poem'
-                }
-            )
-            all_documents.append(doc)
-            print(f"[INFO] Memorizzata filastrocca: {title}")
-    
-    print(f"[INFO] Creati {len(all_documents)} documenti (filastrocche)")
-    
-    if vectorstore is None:
-        vectorstore = FAISS.from_documents(all_documents, embedding)
-    else:
-        vectorstore.add_documents(all_documents)
+# Catalogo dei titoli delle filastrocche, allineato anch'esso alla generazione del vectorstore
+poem_catalog = PoemCatalog(VECTOR_DIR)
+poem_catalog_lock = threading.Lock()
+
+def _synced(index, lock):
+    generation = vectorstore_manager.read_generation()
+    if index.generation == generation:
+        return index
+    with lock:
+        if index.generation != generation:
+            if not (index.load() and index.generation == generation):
+                # Indice assente o non allineato (es. vectorstore precedente): si ricostruisce dal docstore
+                index.rebuild(load_vectorstore(), generation)
+                index.save(generation)
+    return index
+
+def get_keyword_index():
+    return _synced(keyword_index, keyword_index_lock)
+
+def get_poem_catalog():
+    return _synced(poem_catalog, poem_catalog_lock)
 
-    vectorstore.save_local(VECTOR_DIR)
-    return len(all_documents), all_documents
+# Riscaldamento in background: modello di embedding, indice FAISS, indice keyword e catalogo delle filastrocche
+warmup = WarmUp([
+    ('embedding', lambda: embedding.embed_query("ciao")),
+    ('vectorstore', load_vectorstore),
+    ('keyword_index', lambda: get_keyword_index()),
+    ('poem_catalog', lambda: get_poem_catalog()),
+])
+
+def start_warmup(delay=0.0):
+    warmup.start(delay)
+
+def get_warmup_status():
+    return warmup.status()
+
+# Recupero ibrido FAISS + BM25: k per tipo di domanda e soglia opzionale sul punteggio RRF
+RETRIEVAL_K = {'poem': 5, 'generic': 2}
+RETRIEVAL_SCORE_CUTOFF = None
+retriever = HybridRetriever(load_vectorstore, get_keyword_index,
+                            k_by_type=RETRIEVAL_K, score_cutoff=RETRIEVAL_SCORE_CUTOFF)
+
+def retrieve(question, query_type='generic', k=None, score_cutoff=None):
+    """Documenti con punteggi e tempi (vedi rag/retriever.py)"""
+    return retriever.retrieve(question, query_type, k=k, score_cutoff=score_cutoff)
+
+def is_poem_request(question):
+    return any(word in question.lower() for word in ['filastrocca', 'recita', 'dimmi', 'racconta'])
+
+# Indicizzazione: parsing in processi separati, embedding a batch di INGEST_BATCH_SIZE
+INGEST_BATCH_SIZE = ingest_pipeline.EMBED_BATCH_SIZE
+INGEST_WORKERS = ingest_pipeline.PARSE_WORKERS
+
+def ingest_pdfs(pdf_paths, job=None):
+    return ingest_pipeline.run_ingestion(pdf_paths, vectorstore_manager, embedding,
+                                         batch_size=INGEST_BATCH_SIZE, workers=INGEST_WORKERS, job=job,
+                                         keyword_index=get_keyword_index(), poem_catalog=get_poem_catalog(),
+                                         text_cache_dir=TEXT_CACHE_DIR,
+                                         index_locks=(keyword_index_lock, poem_catalog_lock))
+
+def get_ingest_progress():
+    return ingest_pipeline.progress.snapshot()
+
+def catalog_answer(question, info=None):
+    """Filastrocca chiesta per nome, dal catalogo dei titoli (nessun embedding, nessuna ricerca FAISS).
+
+    Ritorna il testo oppure None: in quel caso si passa al recupero vettoriale.
+    """
+    if not question or not is_poem_request(question):
+        return None
+    with tracer.span('poem_catalog'):
+        found = get_poem_catalog().lookup(question)
+        if found is None:
+            return None
+        doc_id, title, score, method = found
+        vectorstore = load_vectorstore()
+        doc = vectorstore.docstore.search(doc_id) if vectorstore is not None else None
+    if doc is None or isinstance(doc, str):
+        return None
+    tracer.count('poem_catalog_hits', method=method)
+    tracer.verbose("Filastrocca dal catalogo", {'title': title, 'method': method, 'score': score})
+    if info is not None:
+        info['retrieval'] = {'type': 'poem', 'match': title, 'catalog': method, 'score': score}
+    return doc.page_content
 
 def find_best_poem_match(question, docs):
-    """Trova la filastrocca migliore usando ricerca fuzzy"""
-    question_lower = question.lower()
-    question_words = set(question_lower.split())
-    
-    best_match = None
-    best_score = 0
-    
+    """Trova la filastrocca migliore con l'indice BM25 (titolo pesato) fra i candidati"""
+    index = get_keyword_index()
+    candidates = {}
     for doc in docs:
-        content_lower = doc.page_content.lower()
-        title_lower = doc.metadata.get('title', '').lower()
-        
-        # Combina titolo e prime righe per la ricerca
-        search_text = title_lower + " " + content_lower[:200]
-        search_words = set(search_text.split())
-        
-        # Calcola punteggio di somiglianza
-        common_words = question_words.intersection(search_words)
-        score = len(common_words)
-        
-        # Bonus per parole chiave specifiche nel titolo
-        title_words = set(title_lower.split())
-        title_matches = question_words.intersection(title_words)
-        score += len(title_matches) * 2  # Peso doppio per match nel titolo
-        
-        # Bonus per parole parziali (substring matching)
-        for q_word in question_words:
-            if len(q_word) > 3:  # Solo per parole significative
-                if q_word in title_lower:
-                    score += 3
-                elif q_word in content_lower:
-                    score += 1
-        
-        # Verifica match parziali inversi (parole del titolo contenute nella domanda)
-        for t_word in title_words:
-            if len(t_word) > 3:
-                for q_word in question_words:
-                    if t_word in q_word or q_word in t_word:
-                        score += 2
-        
-        if score > best_score:
-            best_score = score
-            best_match = doc
-        
-        # Debug info
-        print(f"[DEBUG] Filastrocca: {title_lower[:30]}... Score: {score}")
-    
-    return best_match
+        doc_id = index.key_to_id.get(doc_key(doc.metadata))
+        if doc_id is not None:
+            candidates[doc_id] = doc
 
-def ask_question(question, model_name='mistral', system_message=None):
-    global vectorstore, last_used_model
+    ranked = index.search(question, k=1, restrict=set(candidates)) if candidates else []
+    if ranked:
+        return candidates[ranked[0][0]]
 
-    if vectorstore is None or model_name != last_used_model:
+    # Nessun candidato vettoriale corrisponde: cerca il titolo su tutto il corpus
+    ranked = index.search(question, k=1)
+    if ranked:
         vectorstore = load_vectorstore()
-        last_used_model = model_name
-        if vectorstore is None:
-            return "[ERRORE] Nessun documento indicizzato. Caricare un PDF."
+        doc = vectorstore.docstore.search(ranked[0][0]) if vectorstore is not None else None
+        if doc is not None and not isinstance(doc, str):
+            return doc
+    return None
+
+def retrieval_info(result, query_type, match=None):
+    """Riassunto compatto del recupero per il log"""
+    summary = {
+        'type': query_type,
+        'chunks': [hit['doc'].metadata.get('title') or hit['doc'].metadata.get('source') for hit in result.hits],
+        'seconds': round(result.timings.get('total', 0), 4),
+    }
+    if match is not None:
+        summary['match'] = match.metadata.get('title')
+    return summary
+
+def prepare_answer(question, info=None):
+    """Recupero dei documenti: ritorna (risposta_diretta, None) oppure (None, prompt per il LLM).
+
+    Se info è un dizionario, ci scrive i dati del recupero (per il log delle conversazioni).
+    """
+    # L'indice non dipende dal modello LLM: si ricarica solo se cambia su disco
+    vectorstore = load_vectorstore()
+    if vectorstore is None:
+        return "[ERRORE] Nessun documento indicizzato. Caricare un PDF.", None
 
-    llm = Ollama(model=model_name, temperature=0.1)
     q = ("" if question is None else str(question)).strip()
 
     if not q:
-        return ""
+        return "", None
     
     
     # Controlla se è una richiesta di filastrocca
-    is_poem_request = any(word in question.lower() for word in ['filastrocca', 'recita', 'dimmi', 'racconta'])
-    
-    if is_poem_request:
-        # Per le filastrocche, prendi tutti i documenti disponibili
-        docs = vectorstore.similarity_search(question, k=10)
+    if is_poem_request(question):
+        # Il catalogo dei titoli (catalog_answer) non l'ha trovata: candidati dal recupero ibrido (vettori + parole chiave)
+        result = retrieve(question, 'poem')
+        docs = result.docs
         
         # Usa la ricerca fuzzy per trovare la migliore corrispondenza
-        best_match = find_best_poem_match(question, docs)
+        with tracer.span('poem_match'):
+            best_match = find_best_poem_match(question, docs)
+        if info is not None:
+            info['retrieval'] = retrieval_info(result, 'poem', best_match)
         
         if best_match:
-            print(f"[INFO] Selezionata filastrocca: {best_match.metadata.get('title', 'Senza titolo')}")
-            return best_match.page_content
+            tracer.verbose("Filastrocca selezionata", best_match.metadata.get('title', 'Senza titolo'))
+            return best_match.page_content, None
         else:
-            return "Non ho trovato una filastrocca corrispondente alla tua richiesta."
+            return "Non ho trovato una filastrocca corrispondente alla tua richiesta.", None
     
     else:
-        # Per domande generiche
-        docs = vectorstore.similarity_search(question, k=3)
-        context = "\n\n".join([doc.page_content for doc in docs])
-        
-        prompt = f"""Basandoti solo su queste informazioni:
+        # Per domande generiche: meno chunk ma meglio ordinati = prompt più corto
+        result = retrieve(question, 'generic')
+        tracer.verbose("Recupero", {'chunks': len(result.hits), 'timings': result.timings})
+        docs = result.docs
+        if info is not None:
+            info['retrieval'] = retrieval_info(result, 'generic')
+        with tracer.span('prompt_build'):
+            # Chunk senza duplicati e tagliati al budget di token (l'istruzione fissa resta in testa al prompt)
+            context = "\n\n".join(fit_chunks(docs, RAG_CONTEXT_TOKENS))
+
+            prompt = f"""Basandoti solo su queste informazioni:
 
 {context}
 
 Rispondi alla domanda: {question}
 
 Se la risposta non è presente, di' "Non trovo questa informazione"."""
+        prompt_tokens = estimate_tokens(prompt)
+        tracer.count('context_prompt_tokens', prompt_tokens)
+        if info is not None:
+            info['retrieval']['prompt_tokens'] = prompt_tokens
+        tracer.verbose('Prompt RAG', prompt)
+        return None, prompt
 
-        try:
-            response = llm.invoke(prompt)
-            return response
-        except Exception as e:
-            return f"Errore: {str(e)}"
+# Opzioni di generazione per le risposte RAG (client Ollama condiviso, vedi rag/llm_client.py)
+LLM_OPTIONS = {'temperature': 0.1}
 
-def get_indexed_chunks():
-    if vectorstore is None:
+def is_cacheable(answer):
+    """Gli errori e le risposte vuote non vanno in cache"""
+    return bool(answer) and not answer.startswith(("[ERRORE]", "Errore:", "Non ho trovato"))
+
+# Domande identiche in contemporanea (stessa domanda normalizzata, modello e corpus): una sola generazione
+inflight = SingleFlight()
+
+def inflight_key(question, model_name, mode):
+    return (normalize_query(question), model_name, vectorstore_manager.read_generation(), mode)
+
+def ask_question(question, model_name='mistral', system_message=None, priority=WEB, info=None):
+    """info (opzionale): dizionario in cui annotare cache e recupero, per il log"""
+    key = inflight_key(question, model_name, 'full')
+    return inflight.do(key, lambda: _ask_question(question, model_name, priority, info), info)
+
+def ask_question_stream(question, model_name='mistral', system_message=None, priority=WEB, info=None):
+    """Come ask_question, ma produce i token man mano che Ollama li genera"""
+    key = inflight_key(question, model_name, 'stream')
+    return inflight.stream(key, lambda: _ask_question_stream(question, model_name, priority, info), info)
+
+def get_inflight_stats():
+    return inflight.stats()
+
+def _mark_cached(info):
+    if info is not None:
+        info['cached'] = True
+
+def _ask_question(question, model_name, priority, info=None):
+    # Filastrocca chiesta per nome: prima della cache, che per le domande nuove calcola l'embedding
+    poem = catalog_answer(question, info)
+    if poem is not None:
+        return poem
+
+    cached = answer_cache.get(question, namespace=model_name)
+    if cached is not None:
+        _mark_cached(info)
+        return cached
+
+    answer, prompt = prepare_answer(question, info)
+    if prompt is None:
+        if is_cacheable(answer):
+            answer_cache.put(question, answer, namespace=model_name)
+        return answer
+
+    try:
+        response = llm_client.generate(model_name, prompt, options=LLM_OPTIONS, priority=priority)
+        answer_cache.put(question, response, namespace=model_name)
+        return response
+    except SchedulerRejected:
+        # Coda piena o attesa scaduta: la route risponde 429/503
+        raise
+    except Exception as e:
+        return f"Errore: {str(e)}"
+
+def _ask_question_stream(question, model_name, priority, info=None):
+    poem = catalog_answer(question, info)
+    if poem is not None:
+        yield poem
+        return
+
+    cached = answer_cache.get(question, namespace=model_name)
+    if cached is not None:
+        _mark_cached(info)
+        yield cached
+        return
+
+    answer, prompt = prepare_answer(question, info)
+    if prompt is None:
+        # Filastrocche e messaggi di errore sono già completi
+        if answer:
+            if is_cacheable(answer):
+                answer_cache.put(question, answer, namespace=model_name)
+            yield answer
+        return
+
+    parts = []
+    try:
+        for token in llm_client.generate_stream(model_name, prompt, options=LLM_OPTIONS, priority=priority):
+            parts.append(token)
+            yield token
+    except SchedulerRejected as e:
+        # Lo streaming è già iniziato: il rifiuto arriva come testo
+        yield f"({e})"
+        return
+    except Exception as e:
+        yield f"Errore: {str(e)}"
+        return
+    answer_cache.put(question, "".join(parts), namespace=model_name)
+
+# ---------------------------
+# Versioni asyncio (asgi.py): la parte CPU (embedding, FAISS, cache) gira in un thread,
+# l'attesa del LLM non occupa nessun thread
+# ---------------------------
+async def ask_question_async(question, model_name='mistral', system_message=None, priority=WEB, info=None):
+    key = inflight_key(question, model_name, 'full')
+    return await inflight.do_async(key, lambda: _ask_question_async(question, model_name, priority, info), info)
+
+def ask_question_stream_async(question, model_name='mistral', system_message=None, priority=WEB, info=None):
+    key = inflight_key(question, model_name, 'stream')
+    return inflight.stream_async(key, lambda: _ask_question_stream_async(question, model_name, priority, info),
+                                 info)
+
+async def _ask_question_async(question, model_name, priority, info=None):
+    poem = await asyncio.to_thread(catalog_answer, question, info)
+    if poem is not None:
+        return poem
+
+    cached = await asyncio.to_thread(answer_cache.get, question, namespace=model_name)
+    if cached is not None:
+        _mark_cached(info)
+        return cached
+
+    answer, prompt = await asyncio.to_thread(prepare_answer, question, info)
+    if prompt is None:
+        if is_cacheable(answer):
+            await asyncio.to_thread(answer_cache.put, question, answer, namespace=model_name)
+        return answer
+
+    try:
+        response = await llm_client.agenerate(model_name, prompt, options=LLM_OPTIONS, priority=priority)
+        await asyncio.to_thread(answer_cache.put, question, response, namespace=model_name)
+        return response
+    except SchedulerRejected:
+        raise
+    except Exception as e:
+        return f"Errore: {str(e)}"
+
+async def _ask_question_stream_async(question, model_name, priority, info=None):
+    poem = await asyncio.to_thread(catalog_answer, question, info)
+    if poem is not None:
+        yield poem
+        return
+
+    cached = await asyncio.to_thread(answer_cache.get, question, namespace=model_name)
+    if cached is not None:
+        _mark_cached(info)
+        yield cached
+        return
+
+    answer, prompt = await asyncio.to_thread(prepare_answer, question, info)
+    if prompt is None:
+        if answer:
+            if is_cacheable(answer):
+                await asyncio.to_thread(answer_cache.put, question, answer, namespace=model_name)
+            yield answer
+        return
+
+    parts = []
+    try:
+        async for token in llm_client.agenerate_stream(model_name, prompt, options=LLM_OPTIONS, priority=priority):
+            parts.append(token)
+            yield token
+    except SchedulerRejected as e:
+        yield f"({e})"
+        return
+    except Exception as e:
+        yield f"Errore: {str(e)}"
+        return
+    await asyncio.to_thread(answer_cache.put, question, "".join(parts), namespace=model_name)
+
+def get_indexed_chunks(filters=None):
+    """Tutti i chunk indicizzati, letti dal docstore senza embedding né ricerca"""
+    vectorstore = load_vectorstore()
+    return [doc.page_content for _, doc in docstore.iter_chunks(vectorstore, filters)]
+
+# Esportazioni: testo e JSONL in streaming dal docstore, PDF in cache per generazione dell'indice
+EXPORT_DIR = 'data/exports'
+pdf_export = chunk_export.PdfExport(EXPORT_DIR)
+
+def export_indexed_chunks(kind='text', filters=None):
+    """(etag, generatore) dei chunk in formato 'text' o 'jsonl', senza caricarli tutti in memoria"""
+    generation = vectorstore_manager.read_generation()
+    vectorstore = load_vectorstore()
+    iterate = chunk_export.iter_jsonl if kind == 'jsonl' else chunk_export.iter_text
+    return chunk_export.export_etag(generation, kind, filters), iterate(vectorstore, filters)
+
+def get_chunks_pdf():
+    """(etag, percorso) del PDF dei chunk, generato una sola volta per generazione dell'indice"""
+    generation = vectorstore_manager.read_generation()
+    path = pdf_export.get(load_vectorstore(), generation)
+    return chunk_export.export_etag(generation, 'pdf'), path
+
+def search_indexed_chunks(query):
+    """Chunk che contengono tutte le parole della query, ordinati per BM25"""
+    vectorstore = load_vectorstore()
+    if vectorstore is None or not query.strip():
         return []
-    docs = vectorstore.similarity_search("", k=100)
-    return [doc.page_content for doc in docs]
+    index = get_keyword_index()
+    ids = index.match_all(query)
+    ranked = [doc_id for doc_id, _ in index.search(query, k=None, restrict=ids)]
+    seen = set(ranked)
+    ordered = ranked + [doc_id for doc_id in ids if doc_id not in seen]
+    results = []
+    for doc_id in ordered:
+        doc = vectorstore.docstore.search(doc_id)
+        if not isinstance(doc, str):
+            results.append(doc.page_content)
+    return results
+
+def list_indexed_chunks(limit=100, offset=0, cursor=None, filters=None):
+    """Pagina di chunk con metadati (vedi rag/docstore.py)"""
+    return docstore.list_chunks(load_vectorstore(), limit=limit, offset=offset,
+                                cursor=cursor, filters=filters)
 
 def clear_vectorstore():
-    global vectorstore
-    if os.path.exists(VECTOR_DIR):
-        shutil.rmtree(VECTOR_DIR)
-    os.makedirs(VECTOR_DIR, exist_ok=True)
-    vectorstore = None
\ No newline at end of file
+    with keyword_index_lock, poem_catalog_lock:
+        vectorstore_manager.clear()
+        ingest_pipeline.remove_manifest(VECTOR_DIR)
+        keyword_index.clear()
+        poem_catalog.clear()
+
+def get_embedding_stats():
+    return embedding.stats()
+
+def get_poem_catalog_stats():
+    return get_poem_catalog().stats()
+
+def get_answer_cache_stats():
+    return answer_cache.stats()
+
+def get_vectorstore_stats():
+    return vectorstore_manager.stats()
@@ -0,0 +1,112 @@
+# File: retriever.py
+# Descrizione: Recupero ibrido (vettori FAISS + BM25) con fusione Reciprocal Rank Fusion
+
+import time
+
+from rag.keyword_index import doc_key
+from rag.tracing import tracer
+
+# Quanti chunk passare al LLM per tipo di domanda
+DEFAULT_K = {'poem': 5, 'generic': 2}
+
+
+class RetrievalResult:
+    """Documenti recuperati con punteggi e tempi (in secondi) di ogni fase"""
+
+    def __init__(self, hits, timings):
+        self.hits = hits
+        self.timings = timings
+
+    @property
+    def docs(self):
+        return [hit['doc'] for hit in self.hits]
+
+    def to_dict(self):
+        return {
+            'hits': [{
+                'title': hit['doc'].metadata.get('title'),
+                'source': hit['doc'].metadata.get('source'),
+                'score': round(hit['score'], 6),
+                'dense_rank': hit['dense_rank'],
+                'dense_distance': hit['dense_distance'],
+                'lexical_rank': hit['lexical_rank'],
+                'lexical_score': hit['lexical_score'],
+                'content': hit['doc'].page_content[:200],
+            } for hit in self.hits],
+            'timings': self.timings,
+        }
+
+
+class HybridRetriever:
+    """Fonde la classifica densa (FAISS) e quella lessicale (BM25) con RRF"""
+
+    def __init__(self, get_store, get_keyword_index, k_by_type=None, fetch_k=20, rrf_k=60,
+                 dense_weight=1.0, lexical_weight=1.0, score_cutoff=None):
+        self.get_store = get_store
+        self.get_keyword_index = get_keyword_index
+        self.k_by_type = dict(DEFAULT_K, **(k_by_type or {}))
+        self.fetch_k = fetch_k
+        self.rrf_k = rrf_k
+        self.dense_weight = dense_weight
+        self.lexical_weight = lexical_weight
+        self.score_cutoff = score_cutoff
+
+    def retrieve(self, query, query_type='generic', k=None, score_cutoff=None):
+        k = k or self.k_by_type.get(query_type, self.k_by_type['generic'])
+        score_cutoff = self.score_cutoff if score_cutoff is None else score_cutoff
+        timings = {}
+        store = self.get_store()
+        if store is None:
+            return RetrievalResult([], timings)
+        fetch_k = max(self.fetch_k, k)
+
+        # 1) Classifica densa: distanza L2 da FAISS (più bassa = più simile)
+        start = time.time()
+        vector = store.embedding_function.embed_query(query)
+        timings['embed'] = round(time.time() - start, 6)
+        start = time.time()
+        with tracer.span('faiss_search'):
+            dense = store.similarity_search_with_score_by_vector(vector, k=fetch_k)
+        timings['dense'] = round(time.time() - start, 6)
+
+        # 2) Classifica lessicale BM25
+        start = time.time()
+        index = self.get_keyword_index()
+        with tracer.span('bm25_search'):
+            lexical = index.search(query, k=fetch_k)
+        timings['lexical'] = round(time.time() - start, 6)
+
+        # 3) Fusione per chiave del chunk (sorgente + posizione)
+        start = time.time()
+        hits = {}
+        for rank, (doc, distance) in enumerate(dense, 1):
+            hit = self._hit(hits, doc_key(doc.metadata), doc)
+            hit['dense_rank'] = rank
+            hit['dense_distance'] = float(distance)
+            hit['score'] += self.dense_weight / (self.rrf_k + rank)
+        for rank, (doc_id, score) in enumerate(lexical, 1):
+            key = index.docs[doc_id].get('key')
+            hit = hits.get(key)
+            if hit is None:
+                doc = store.docstore.search(doc_id)
+                if isinstance(doc, str):
+                    continue
+                hit = self._hit(hits, key, doc)
+            hit['lexical_rank'] = rank
+            hit['lexical_score'] = round(score, 6)
+            hit['score'] += self.lexical_weight / (self.rrf_k + rank)
+
+        ranked = sorted(hits.values(), key=lambda h: h['score'], reverse=True)
+        if score_cutoff is not None:
+            ranked = [hit for hit in ranked if hit['score'] >= score_cutoff]
+        timings['fusion'] = round(time.time() - start, 6)
+        tracer.observe('rerank', timings['fusion'])
+        timings['total'] = round(sum(timings.values()), 6)
+        return RetrievalResult(ranked[:k], timings)
+
+    @staticmethod
+    def _hit(hits, key, doc):
+        if key not in hits:
+            hits[key] = {'doc': doc, 'score': 0.0, 'dense_rank': None, 'dense_distance': None,
+                         'lexical_rank': None, 'lexical_score': None}
+        return hits[key]
@@ -0,0 +1,169 @@
+# File: ros_bridge.py
+# Descrizione: Invio non bloccante delle frasi al nodo ROS2 (sessione persistente, coda limitata, retry con backoff)
+
+import queue
+import sys
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from rag.scheduler import Samples
+from rag.streaming import iter_sentences
+from rag.tracing import tracer
+
+# (connessione, lettura) in secondi: un nodo ROS lento non deve mai bloccare il worker a lungo
+ROS_TIMEOUT = (1.0, 3.0)
+ROS_MAX_QUEUE = 64
+ROS_RETRIES = 3
+ROS_BACKOFF = 0.5
+ROS_MAX_BACKOFF = 4.0
+# Frasi già in coda inviate insieme in una sola richiesta, fino a questa lunghezza
+ROS_BATCH_CHARS = 400
+# Messo in coda da stop() per svegliare il worker fermo su get()
+_STOP = (None, None)
+
+
+class RosBridge:
+    """send() mette le frasi in coda e ritorna subito; un thread le consegna al nodo ROS nell'ordine"""
+
+    def __init__(self, url, timeout=ROS_TIMEOUT, max_queue=ROS_MAX_QUEUE, retries=ROS_RETRIES,
+                 backoff=ROS_BACKOFF, max_backoff=ROS_MAX_BACKOFF, batch_chars=ROS_BATCH_CHARS):
+        self.url = url
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.batch_chars = batch_chars
+        self._session = requests.Session()
+        self._session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._pending = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._latency = Samples()
+        self._counters = {'queued': 0, 'sent': 0, 'requests': 0, 'retries': 0, 'failed': 0, 'dropped': 0}
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='ros-bridge', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        try:
+            self._queue.put_nowait(_STOP)
+        except queue.Full:
+            # Coda piena: il worker non è bloccato su get() e vede _stop alla fine del gruppo corrente
+            pass
+
+    # ---------------------------
+    # Accodamento
+    # ---------------------------
+    def send(self, text):
+        """Divide il testo in frasi e le accoda; se la coda è piena si scarta la frase più vecchia"""
+        self.start()
+        for sentence in iter_sentences([text or ""]):
+            self._put(sentence)
+
+    def _put(self, sentence):
+        item = (sentence, time.time())
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                break
+            except queue.Full:
+                try:
+                    dropped, _ = self._queue.get_nowait()
+                except queue.Empty:
+                    continue
+                if dropped is None:
+                    # Era il segnale di stop: il worker si sta fermando, la frase non verrà consegnata
+                    continue
+                self._count('dropped')
+                tracer.count('ros_dropped')
+                print(f"[DEBUG] Coda ROS piena, frase scartata: {dropped}", file=sys.stderr)
+        self._count('queued')
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._counters[name] += n
+
+    # ---------------------------
+    # Consegna
+    # ---------------------------
+    def _next_batch(self):
+        """Prima frase in attesa (bloccante) più quelle già in coda, fino a batch_chars caratteri.
+
+        Ritorna None se arriva il segnale di stop.
+        """
+        first = self._pending or self._queue.get()
+        self._pending = None
+        if first is _STOP:
+            return None
+        batch = [first]
+        size = len(first[0])
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                break
+            if size + len(item[0]) + 1 > self.batch_chars:
+                # Non ci sta: apre il prossimo gruppo
+                self._pending = item
+                break
+            batch.append(item)
+            size += len(item[0]) + 1
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._next_batch()
+            if batch is None:
+                break
+            text = " ".join(sentence for sentence, _ in batch)
+            if self._deliver(text):
+                now = time.time()
+                with self._lock:
+                    for _, enqueued_at in batch:
+                        self._latency.add(now - enqueued_at)
+                    self._counters['sent'] += len(batch)
+                for _, enqueued_at in batch:
+                    tracer.observe('ros_delivery', now - enqueued_at)
+                tracer.verbose("✅ Inviato al nodo ROS", text)
+            else:
+                self._count('failed', len(batch))
+                tracer.count('ros_failed', len(batch))
+                print(f"[DEBUG] ❌ Invio al nodo ROS fallito dopo {self.retries + 1} tentativi: {text}",
+                      file=sys.stderr)
+
+    def _deliver(self, text):
+        for attempt in range(self.retries + 1):
+            try:
+                self._count('requests')
+                with tracer.span('ros_send'):
+                    response = self._session.get(self.url, params={"text": text}, timeout=self.timeout)
+                response.raise_for_status()
+                return True
+            except Exception as e:
+                print(f"[DEBUG] Errore nell'invio al nodo ROS (tentativo {attempt + 1}): {e}", file=sys.stderr)
+                if attempt == self.retries or self._stop.is_set():
+                    return False
+                self._count('retries')
+                self._stop.wait(min(self.backoff * 2 ** attempt, self.max_backoff))
+        return False
+
+    def stats(self):
+        with self._lock:
+            return {
+                'url': self.url,
+                'queue_depth': self._queue.qsize() + (1 if self._pending else 0),
+                'counters': dict(self._counters),
+                'delivery_seconds': self._latency.summary(),
+            }
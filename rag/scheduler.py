@@ -0,0 +1,231 @@
+# File: scheduler.py
+# Descrizione: Scheduler delle richieste al LLM (concorrenza per modello, priorità, scadenze, coda limitata)
+
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+
+# Priorità: numero più basso = servito prima
+ROBOT = 0   # /bot: il robot sta aspettando di parlare
+API = 1     # /json
+WEB = 2     # /get, /ask dalla UI web
+
+PRIORITY_NAMES = {ROBOT: 'robot', API: 'api', WEB: 'web'}
+
+
+class SchedulerRejected(Exception):
+    """Richiesta rifiutata dallo scheduler; status_code è il codice HTTP da restituire"""
+    status_code = 503
+
+
+class QueueFull(SchedulerRejected):
+    status_code = 429
+
+
+class DeadlineExpired(SchedulerRejected):
+    status_code = 503
+
+
+class Ticket:
+    def __init__(self, model, priority, seq, deadline_at):
+        self.model = model
+        self.priority = priority
+        self.seq = seq
+        self.deadline_at = deadline_at
+        self.enqueued_at = time.time()
+        self.started_at = None
+        self.granted = False
+        # Per le richieste asyncio: future risolta quando lo slot viene assegnato
+        self.future = None
+        self.loop = None
+
+    def grant(self):
+        self.granted = True
+        if self.future is not None:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(True)
+
+
+class Samples:
+    """Ultimi N campioni di una durata, per media e percentili"""
+
+    def __init__(self, size=500):
+        self.values = deque(maxlen=size)
+        self.count = 0
+
+    def add(self, value):
+        self.values.append(value)
+        self.count += 1
+
+    def summary(self):
+        if not self.values:
+            return {'count': self.count}
+        ordered = sorted(self.values)
+
+        def pct(p):
+            return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))], 4)
+
+        return {'count': self.count, 'avg': round(sum(ordered) / len(ordered), 4),
+                'p50': pct(0.5), 'p95': pct(0.95), 'max': round(ordered[-1], 4)}
+
+
+class LLMScheduler:
+    def __init__(self, default_concurrency=1, concurrency=None, max_queue=16, default_deadline=None):
+        self.default_concurrency = default_concurrency
+        self.concurrency = dict(concurrency or {})
+        self.max_queue = max_queue
+        # Scadenza di default (secondi di attesa massima in coda) per priorità
+        self.default_deadline = dict(default_deadline or {})
+        self._cond = threading.Condition()
+        self._waiting = {}    # modello -> heap di Ticket
+        self._running = {}    # modello -> richieste in corso
+        self._seq = itertools.count()
+        self._wait = Samples()
+        self._service = Samples()
+        self._counters = {'accepted': 0, 'rejected_full': 0, 'expired': 0, 'completed': 0}
+
+    def limit(self, model):
+        return self.concurrency.get(model, self.default_concurrency)
+
+    def queue_depth(self):
+        return sum(len(heap) for heap in self._waiting.values())
+
+    def _dispatch(self, model):
+        heap = self._waiting.get(model, [])
+        while heap and self._running.get(model, 0) < self.limit(model):
+            ticket = heapq.heappop(heap)
+            ticket.grant()
+            self._running[model] = self._running.get(model, 0) + 1
+
+    def check_capacity(self):
+        """Rifiuto rapido prima di iniziare una risposta in streaming"""
+        with self._cond:
+            if self.queue_depth() >= self.max_queue:
+                self._counters['rejected_full'] += 1
+                raise QueueFull("Troppe richieste in coda, riprova tra poco")
+
+    def acquire(self, model, priority=WEB, deadline=None):
+        """Attende uno slot per il modello; solleva QueueFull o DeadlineExpired"""
+        if deadline is None:
+            deadline = self.default_deadline.get(priority)
+        with self._cond:
+            ticket = Ticket(model, priority, next(self._seq),
+                            time.time() + deadline if deadline is not None else None)
+            heap = self._waiting.setdefault(model, [])
+            if not heap and self._running.get(model, 0) < self.limit(model):
+                ticket.granted = True
+                self._running[model] = self._running.get(model, 0) + 1
+            else:
+                if self.queue_depth() >= self.max_queue:
+                    self._counters['rejected_full'] += 1
+                    raise QueueFull("Troppe richieste in coda, riprova tra poco")
+                heapq.heappush(heap, ticket)
+                while not ticket.granted:
+                    timeout = None
+                    if ticket.deadline_at is not None:
+                        timeout = ticket.deadline_at - time.time()
+                        if timeout <= 0:
+                            heap.remove(ticket)
+                            heapq.heapify(heap)
+                            self._counters['expired'] += 1
+                            raise DeadlineExpired("Tempo di attesa scaduto, riprova tra poco")
+                    self._cond.wait(timeout)
+            ticket.started_at = time.time()
+            self._wait.add(ticket.started_at - ticket.enqueued_at)
+            self._counters['accepted'] += 1
+        return ticket
+
+    async def acquire_async(self, model, priority=WEB, deadline=None):
+        """Come acquire, ma attende lo slot senza bloccare l'event loop"""
+        if deadline is None:
+            deadline = self.default_deadline.get(priority)
+        with self._cond:
+            ticket = Ticket(model, priority, next(self._seq),
+                            time.time() + deadline if deadline is not None else None)
+            heap = self._waiting.setdefault(model, [])
+            if not heap and self._running.get(model, 0) < self.limit(model):
+                ticket.granted = True
+                self._running[model] = self._running.get(model, 0) + 1
+            else:
+                if self.queue_depth() >= self.max_queue:
+                    self._counters['rejected_full'] += 1
+                    raise QueueFull("Troppe richieste in coda, riprova tra poco")
+                ticket.loop = asyncio.get_running_loop()
+                ticket.future = ticket.loop.create_future()
+                heapq.heappush(heap, ticket)
+
+        if not ticket.granted:
+            try:
+                await asyncio.wait_for(asyncio.shield(ticket.future), deadline)
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                with self._cond:
+                    if not ticket.granted:
+                        heap.remove(ticket)
+                        heapq.heapify(heap)
+                        if isinstance(e, asyncio.TimeoutError):
+                            self._counters['expired'] += 1
+                        granted = False
+                    else:
+                        granted = True
+                if not granted:
+                    if isinstance(e, asyncio.CancelledError):
+                        raise
+                    raise DeadlineExpired("Tempo di attesa scaduto, riprova tra poco")
+                if isinstance(e, asyncio.CancelledError):
+                    # Lo slot è stato assegnato mentre il client se ne andava: va restituito
+                    ticket.started_at = time.time()
+                    self.release(ticket)
+                    raise
+
+        with self._cond:
+            ticket.started_at = time.time()
+            self._wait.add(ticket.started_at - ticket.enqueued_at)
+            self._counters['accepted'] += 1
+        return ticket
+
+    @asynccontextmanager
+    async def slot_async(self, model, priority=WEB, deadline=None):
+        ticket = await self.acquire_async(model, priority, deadline)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def release(self, ticket):
+        with self._cond:
+            self._running[ticket.model] -= 1
+            self._service.add(time.time() - ticket.started_at)
+            self._counters['completed'] += 1
+            self._dispatch(ticket.model)
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, model, priority=WEB, deadline=None):
+        ticket = self.acquire(model, priority, deadline)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'queue_depth': self.queue_depth(),
+                'max_queue': self.max_queue,
+                'waiting': {m: len(h) for m, h in self._waiting.items() if h},
+                'running': {m: n for m, n in self._running.items() if n},
+                'counters': dict(self._counters),
+                'wait_seconds': self._wait.summary(),
+                'service_seconds': self._service.summary(),
+            }
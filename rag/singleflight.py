@@ -0,0 +1,211 @@
+# File: singleflight.py
+# Descrizione: Deduplicazione delle richieste identiche in corso (una sola generazione, risultato condiviso)
+
+import asyncio
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.done = False
+        self.result = None
+        self.error = None
+        self.tokens = []
+        self.waiters = 0
+        self.info = None
+
+
+class _AsyncCall:
+    def __init__(self):
+        self.tokens = []
+        self.done = False
+        self.error = None
+        self.changed = asyncio.Event()
+        self.task = None
+        self.info = None
+
+
+def _share(info, leader_info):
+    """Chi si è unito a una chiamata in corso riceve i dati del leader (recupero, cache) per il log"""
+    if info is not None:
+        info.update(leader_info or {})
+        info['coalesced'] = True
+
+
+class SingleFlight:
+    """Le richieste con la stessa chiave, arrivate mentre la prima è in corso, ne aspettano il risultato.
+
+    info (opzionale) è il dizionario che la funzione del leader riempie durante il lavoro: a chi si unisce
+    viene copiato, con coalesced=True.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._stats = {'leaders': 0, 'coalesced': 0}
+
+    def _join(self, key, info=None):
+        """Ritorna (call, leader): leader è True se tocca a chi chiama eseguire il lavoro"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self._stats['coalesced'] += 1
+                return call, False
+            call = _Call()
+            call.info = info
+            self._calls[key] = call
+            self._stats['leaders'] += 1
+            return call, True
+
+    def _finish(self, key, call, result=None, error=None):
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+        with call.cond:
+            call.result = result
+            call.error = error
+            call.done = True
+            call.cond.notify_all()
+
+    def do(self, key, fn, info=None):
+        """Esegue fn() una sola volta per le chiamate concorrenti con la stessa chiave"""
+        call, leader = self._join(key, info)
+        if leader:
+            try:
+                result = fn()
+            except Exception as e:
+                self._finish(key, call, error=e)
+                raise
+            self._finish(key, call, result=result)
+            return result
+
+        with call.cond:
+            while not call.done:
+                call.cond.wait()
+        if call.error is not None:
+            raise call.error
+        _share(info, call.info)
+        return call.result
+
+    def stream(self, key, gen_fn, info=None):
+        """Come do(), ma per generatori di token: chi arriva dopo riceve anche i token già prodotti.
+
+        La generazione gira in un thread a parte, così se il primo client si disconnette
+        gli altri ricevono comunque la risposta completa.
+        """
+        call, leader = self._join(key, info)
+        if leader:
+            def produce():
+                try:
+                    for token in gen_fn():
+                        with call.cond:
+                            call.tokens.append(token)
+                            call.cond.notify_all()
+                except Exception as e:
+                    self._finish(key, call, error=e)
+                    return
+                self._finish(key, call)
+
+            threading.Thread(target=produce, name='singleflight-stream', daemon=True).start()
+
+        position = 0
+        while True:
+            with call.cond:
+                while position >= len(call.tokens) and not call.done:
+                    call.cond.wait()
+                pending = call.tokens[position:]
+                finished = call.done
+            for token in pending:
+                yield token
+            position += len(pending)
+            if finished and position >= len(call.tokens):
+                break
+        if call.error is not None:
+            raise call.error
+        if not leader:
+            _share(info, call.info)
+
+    # ---------------------------
+    # Versioni asyncio (server ASGI)
+    # ---------------------------
+    async def do_async(self, key, coro_fn, info=None):
+        """Come do(), per coroutine: chi arriva dopo attende lo stesso task"""
+        with self._lock:
+            entry = self._calls.get(('async', key))
+            leader = entry is None
+            if leader:
+                entry = (asyncio.ensure_future(coro_fn()), info)
+                self._calls[('async', key)] = entry
+                self._stats['leaders'] += 1
+
+                def forget(_task, entry=entry):
+                    with self._lock:
+                        if self._calls.get(('async', key)) is entry:
+                            del self._calls[('async', key)]
+
+                entry[0].add_done_callback(forget)
+            else:
+                self._stats['coalesced'] += 1
+        task, leader_info = entry
+        # shield: se un client si disconnette, la generazione continua per gli altri
+        result = await asyncio.shield(task)
+        if not leader:
+            _share(info, leader_info)
+        return result
+
+    async def stream_async(self, key, agen_fn, info=None):
+        """Come stream(), per generatori asincroni"""
+        with self._lock:
+            call = self._calls.get(('async-stream', key))
+            leader = call is None
+            if leader:
+                call = _AsyncCall()
+                call.info = info
+                self._calls[('async-stream', key)] = call
+                self._stats['leaders'] += 1
+            else:
+                self._stats['coalesced'] += 1
+
+        if leader:
+            async def produce():
+                try:
+                    async for token in agen_fn():
+                        call.tokens.append(token)
+                        call.changed.set()
+                except Exception as e:
+                    call.error = e
+                finally:
+                    with self._lock:
+                        if self._calls.get(('async-stream', key)) is call:
+                            del self._calls[('async-stream', key)]
+                    call.done = True
+                    call.changed.set()
+
+            call.task = asyncio.ensure_future(produce())
+
+        position = 0
+        while True:
+            if position < len(call.tokens):
+                pending = call.tokens[position:]
+                position += len(pending)
+                for token in pending:
+                    yield token
+                continue
+            if call.done:
+                break
+            call.changed.clear()
+            if position < len(call.tokens) or call.done:
+                continue
+            await call.changed.wait()
+        if call.error is not None:
+            raise call.error
+        if not leader:
+            _share(info, call.info)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['in_flight'] = len(self._calls)
+        return stats
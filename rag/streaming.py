@@ -0,0 +1,79 @@
+# File: streaming.py
+# Descrizione: Utilità per lo streaming dei token (chunked HTTP / Server-Sent Events)
+
+import json
+import re
+
+from flask import Response, stream_with_context
+
+# Fine frase: punto, punto esclamativo/interrogativo, puntini o a capo
+SENTENCE_END = re.compile(r'([.!?…]+["»)]?\s+|\n+)')
+
+
+def iter_sentences(tokens):
+    """Raggruppa i token in frasi complete (per inviarle una alla volta al TTS)"""
+    buffer = ""
+    for token in tokens:
+        buffer += token
+        while True:
+            match = SENTENCE_END.search(buffer)
+            if not match:
+                break
+            sentence = buffer[:match.end()].strip()
+            buffer = buffer[match.end():]
+            if sentence:
+                yield sentence
+    if buffer.strip():
+        yield buffer.strip()
+
+
+async def aiter_sentences(tokens):
+    """Come iter_sentences, per un generatore asincrono di token"""
+    buffer = ""
+    async for token in tokens:
+        buffer += token
+        while True:
+            match = SENTENCE_END.search(buffer)
+            if not match:
+                break
+            sentence = buffer[:match.end()].strip()
+            buffer = buffer[match.end():]
+            if sentence:
+                yield sentence
+    if buffer.strip():
+        yield buffer.strip()
+
+
+def sse_event(data, event=None):
+    """Formatta un evento Server-Sent Events"""
+    payload = ""
+    if event:
+        payload += f"event: {event}\n"
+    payload += f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+    return payload
+
+
+def stream_response(tokens, mode='text'):
+    """Risposta Flask in streaming: 'sse' per Server-Sent Events, altrimenti testo chunked"""
+    if mode == 'sse':
+        def generate():
+            for token in tokens:
+                yield sse_event({"token": token})
+            yield sse_event({"done": True}, event="end")
+        mimetype = 'text/event-stream'
+    else:
+        def generate():
+            for token in tokens:
+                yield token
+        mimetype = 'text/plain; charset=utf-8'
+
+    # X-Accel-Buffering evita che un eventuale proxy nginx trattenga i chunk
+    return Response(stream_with_context(generate()), mimetype=mimetype,
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def stream_mode(value):
+    """Interpreta il parametro 'stream' della richiesta: None, 'text' o 'sse'"""
+    if not value or value in ('0', 'false', 'no'):
+        return None
+    return 'sse' if value == 'sse' else 'text'
@@ -0,0 +1,226 @@
+# File: tracing.py
+# Descrizione: Tempi per fase (span) di ogni richiesta, istogrammi e contatori per /metrics, log verboso a campione
+
+import contextvars
+import functools
+import inspect
+import json
+import os
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Limiti superiori (secondi) dei bucket degli istogrammi di latenza
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Frazione di richieste per cui si stampano i payload completi (messaggi, risposte grezze): 0 = mai, 1 = sempre
+VERBOSE_SAMPLE_RATE = float(os.environ.get('PYOLLAMA_TRACE_SAMPLE', '0'))
+# Lunghezza massima di un payload stampato
+VERBOSE_MAX_CHARS = 2000
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Stima dal bucket: il limite superiore del bucket che contiene il quantile"""
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts[:-1]):
+            seen += n
+            if seen >= target:
+                return self.buckets[i]
+        return float('inf')
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 4),
+            'avg': round(self.sum / self.count, 4) if self.count else None,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+        }
+
+
+class Trace:
+    """Fasi di una singola richiesta (secondi per nome dello span)"""
+
+    def __init__(self, route, sampled):
+        self.route = route
+        self.sampled = sampled
+        self.started_at = time.time()
+        self.spans = {}
+
+    def add(self, name, seconds):
+        self.spans[name] = round(self.spans.get(name, 0.0) + seconds, 6)
+
+
+_current = contextvars.ContextVar('trace', default=None)
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+class Tracer:
+    def __init__(self, sample_rate=VERBOSE_SAMPLE_RATE, buckets=LATENCY_BUCKETS):
+        self.sample_rate = sample_rate
+        self.buckets = buckets
+        self._histograms = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    # ---------------------------
+    # Registrazione
+    # ---------------------------
+    def observe(self, name, seconds, **labels):
+        """Aggiunge una durata all'istogramma (e alla richiesta in corso, se c'è)"""
+        if seconds is None:
+            return
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.observe(seconds)
+        trace = _current.get()
+        if trace is not None:
+            trace.add(name, seconds)
+
+    def count(self, name, n=1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + n
+
+    @contextmanager
+    def span(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    @contextmanager
+    def request(self, route):
+        """Traccia di una richiesta: gli span registrati nel frattempo (stesso thread/task) finiscono qui"""
+        trace = Trace(route, self.sample_rate > 0 and random.random() < self.sample_rate)
+        token = _current.set(trace)
+        status = 'ok'
+        try:
+            yield trace
+        except Exception:
+            status = 'error'
+            raise
+        finally:
+            _current.reset(token)
+            total = time.time() - trace.started_at
+            self.observe('request', total, route=route)
+            self.count('requests', route=route, status=status)
+            if trace.sampled:
+                print(f"[DEBUG] Traccia {route} ({total:.3f} s): {trace.spans}", file=sys.stderr)
+
+    def traced(self, route):
+        """Decoratore per le view (Flask o asincrone): una traccia per richiesta.
+
+        Per le risposte in streaming misura solo la preparazione; la generazione è negli span llm_*.
+        """
+        def decorator(fn):
+            if inspect.iscoroutinefunction(fn):
+                @functools.wraps(fn)
+                async def async_wrapper(*args, **kwargs):
+                    with self.request(route):
+                        return await fn(*args, **kwargs)
+                return async_wrapper
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.request(route):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def verbose(self, label, payload):
+        """Stampa un payload completo solo per le richieste campionate"""
+        trace = _current.get()
+        sampled = trace.sampled if trace is not None else (
+            self.sample_rate > 0 and random.random() < self.sample_rate)
+        if not sampled:
+            return
+        text = payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False, default=str)
+        if len(text) > VERBOSE_MAX_CHARS:
+            text = text[:VERBOSE_MAX_CHARS] + f"... ({len(text)} caratteri)"
+        print(f"[DEBUG] {label}: {text}", file=sys.stderr)
+
+    # ---------------------------
+    # Esportazione
+    # ---------------------------
+    def to_dict(self):
+        with self._lock:
+            histograms = {k: h.to_dict() for k, h in self._histograms.items()}
+            counters = dict(self._counters)
+
+        def name(key):
+            metric, labels = key
+            return metric + ''.join(f"[{k}={v}]" for k, v in labels)
+
+        return {
+            'spans': {name(k): v for k, v in sorted(histograms.items())},
+            'counters': {name(k): v for k, v in sorted(counters.items())},
+            'sample_rate': self.sample_rate,
+        }
+
+    def prometheus(self, prefix='pyollama'):
+        """Formato testo di Prometheus"""
+        def fmt(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ''
+            return '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}'
+
+        with self._lock:
+            histograms = sorted((k, list(h.counts), h.count, h.sum) for k, h in self._histograms.items())
+            counters = sorted(self._counters.items())
+
+        lines = []
+        declared = set()
+        for (metric, labels), counts, count, total in histograms:
+            full = f"{prefix}_{metric}_seconds"
+            if full not in declared:
+                lines.append(f"# TYPE {full} histogram")
+                declared.add(full)
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                lines.append(f"{full}_bucket{fmt(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{full}_bucket{fmt(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{full}_sum{fmt(labels)} {round(total, 6)}")
+            lines.append(f"{full}_count{fmt(labels)} {count}")
+        for (metric, labels), value in counters:
+            full = f"{prefix}_{metric}_total"
+            if full not in declared:
+                lines.append(f"# TYPE {full} counter")
+                declared.add(full)
+            lines.append(f"{full}{fmt(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+# Istanza condivisa da tutti i moduli
+tracer = Tracer()
@@ -0,0 +1,201 @@
+# File: vectorstore_manager.py
+# Descrizione: Gestione in-process dell'indice FAISS (caricamento unico, reload su modifica, swap atomico)
+
+import os
+import pickle
+import sys
+import threading
+import time
+
+GENERATION_FILE = 'generation'
+
+
+def rss_bytes():
+    """Memoria residente del processo: VmRSS da /proc, altrimenti il picco ru_maxrss"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss è in byte su macOS, in kB su Linux
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class VectorStoreManager:
+    """Mantiene un solo vectorstore FAISS caricato e lo ricarica solo se cambia su disco"""
+
+    def __init__(self, vector_dir, embedding, mmap=False):
+        self.vector_dir = vector_dir
+        self.embedding = embedding
+        # Con mmap faiss mappa in memoria solo le liste invertite di IVF/PQ: Flat e HNSW (e i quantizzatori)
+        # vengono comunque letti tutti in RAM
+        self.mmap = mmap
+        self._mmapped = False
+        self._store = None
+        self._signature = None
+        self._lock = threading.Lock()
+        self._stats = {
+            'loads': 0,
+            'swaps': 0,
+            'last_load_seconds': 0.0,
+            'last_load_at': None,
+            'rss_before_load': None,
+            'rss_after_load': None,
+        }
+        os.makedirs(self.vector_dir, exist_ok=True)
+
+    # ---------------------------
+    # Stato su disco
+    # ---------------------------
+    def _path(self, name):
+        return os.path.join(self.vector_dir, name)
+
+    def read_generation(self):
+        try:
+            with open(self._path(GENERATION_FILE)) as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def _write_generation(self, generation):
+        tmp = self._path(GENERATION_FILE + '.tmp')
+        with open(tmp, 'w') as f:
+            f.write(str(generation))
+        os.replace(tmp, self._path(GENERATION_FILE))
+
+    def _disk_signature(self):
+        """Generazione + mtime dei file dell'indice: cambia se l'indice viene riscritto"""
+        mtimes = []
+        for name in ('index.faiss', 'index.pkl'):
+            try:
+                mtimes.append(os.stat(self._path(name)).st_mtime_ns)
+            except OSError:
+                mtimes.append(None)
+        return (self.read_generation(), *mtimes)
+
+    def exists_on_disk(self):
+        return os.path.exists(self._path('index.faiss'))
+
+    def load_from_disk(self, mmap=False):
+        """Carica una copia nuova dell'indice (senza toccare quella condivisa).
+
+        Con mmap=True l'indice è in sola lettura: va usato solo per le ricerche.
+        """
+        if not self.exists_on_disk():
+            return None
+        # faiss e langchain vengono importati solo quando serve davvero (avvio più rapido)
+        import faiss
+        from langchain_community.vectorstores import FAISS
+        from rag import index_builder
+        store = None
+        mmapped = False
+        if mmap:
+            try:
+                flags = faiss.IO_FLAG_MMAP | getattr(faiss, 'IO_FLAG_READ_ONLY', 0)
+                index = faiss.read_index(self._path('index.faiss'), flags)
+                with open(self._path('index.pkl'), 'rb') as f:
+                    docstore, index_to_docstore_id = pickle.load(f)
+                store = FAISS(self.embedding, index, docstore, index_to_docstore_id)
+                mmapped = index_builder.is_ivf(index)
+            except RuntimeError as e:
+                # Non tutti i tipi di indice supportano la mappatura in memoria
+                print(f"[INFO] mmap non disponibile per questo indice ({e}), caricamento normale")
+        if store is None:
+            store = FAISS.load_local(self.vector_dir, embeddings=self.embedding,
+                                     allow_dangerous_deserialization=True)
+        index_builder.apply_search_params(store.index, index_builder.read_config(self.vector_dir))
+        if mmap:
+            self._mmapped = mmapped
+        return store
+
+    # ---------------------------
+    # Accesso
+    # ---------------------------
+    def get(self):
+        """Ritorna il vectorstore corrente, ricaricandolo solo se i file su disco sono cambiati"""
+        signature = self._disk_signature()
+        if signature == self._signature:
+            return self._store
+
+        with self._lock:
+            signature = self._disk_signature()
+            if signature != self._signature:
+                start = time.time()
+                rss_before = rss_bytes()
+                if self.exists_on_disk():
+                    print("[INFO] Caricamento vectorstore FAISS esistente...")
+                    store = self.load_from_disk(mmap=self.mmap)
+                else:
+                    print("[INFO] Nessun vectorstore FAISS trovato.")
+                    store = None
+                elapsed = time.time() - start
+                # Swap atomico: i lettori vedono o il vecchio o il nuovo indice
+                self._store = store
+                self._signature = signature
+                self._stats['loads'] += 1
+                self._stats['last_load_seconds'] = round(elapsed, 4)
+                self._stats['last_load_at'] = time.time()
+                self._stats['rss_before_load'] = rss_before
+                self._stats['rss_after_load'] = rss_bytes()
+                print(f"[INFO] Vectorstore caricato in {elapsed:.2f} secondi")
+            return self._store
+
+    def swap(self, store):
+        """Salva il nuovo indice, incrementa la generazione e lo rende visibile a tutti"""
+        with self._lock:
+            generation = self.read_generation() + 1
+            if store is not None:
+                store.save_local(self.vector_dir)
+            self._write_generation(generation)
+            self._store = store
+            self._signature = self._disk_signature()
+            self._stats['swaps'] += 1
+            return generation
+
+    def clear(self):
+        with self._lock:
+            # index_config.json resta: il tipo di indice scelto vale anche per il prossimo corpus
+            for name in ('index.faiss', 'index.pkl'):
+                if os.path.exists(self._path(name)):
+                    os.remove(self._path(name))
+            self._write_generation(self.read_generation() + 1)
+            self._store = None
+            self._signature = self._disk_signature()
+            self._stats['swaps'] += 1
+
+    # ---------------------------
+    # Metriche
+    # ---------------------------
+    def stats(self):
+        store = self._store
+        stats = dict(self._stats)
+        stats['generation'] = self.read_generation()
+        stats['loaded'] = store is not None
+        file_bytes = 0
+        for name in ('index.faiss', 'index.pkl'):
+            if os.path.exists(self._path(name)):
+                file_bytes += os.path.getsize(self._path(name))
+        stats['disk_bytes'] = file_bytes
+        stats['rss_bytes'] = rss_bytes()
+        if store is not None:
+            index = store.index
+            stats['vectors'] = index.ntotal
+            stats['dimension'] = index.d
+            # Solo una stima (vettori float32 non compressi); la memoria misurata è rss_* qui sotto
+            stats['vector_bytes_estimate'] = index.ntotal * index.d * 4
+            # IVF/PQ restano Flat finché i vettori non bastano per addestrarli
+            stats['index_class'] = type(index).__name__
+            stats['docstore_entries'] = len(getattr(store.docstore, '_dict', {}))
+        from rag import index_builder
+        config = index_builder.read_config(self.vector_dir)
+        stats['index_type'] = config.get('type', 'flat')
+        stats['index_params'] = config.get('params', {})
+        stats['index_report'] = config.get('report')
+        stats['mmap'] = self.mmap
+        # mmap richiesto ma efficace solo per IVF/PQ: con Flat/HNSW i vettori sono tutti in RAM
+        stats['mmap_effective'] = self._mmapped
+        return stats
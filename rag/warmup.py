@@ -0,0 +1,61 @@
+# File: warmup.py
+# Descrizione: Riscaldamento in background (modello di embedding, indice) e stato per /health e /ready
+
+import threading
+import time
+import traceback
+
+COLD = 'cold'
+WARMING = 'warming'
+READY = 'ready'
+FAILED = 'failed'
+
+
+class WarmUp:
+    """Esegue una sola volta una sequenza di passi in un thread e ne registra i tempi"""
+
+    def __init__(self, steps):
+        # steps: lista di (nome, funzione senza argomenti)
+        self.steps = steps
+        self.state = COLD
+        self.timings = {}
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self, delay=0.0):
+        """Avvia il riscaldamento in background (una volta sola)"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, args=(delay,), name='warmup', daemon=True)
+            self._thread.start()
+
+    def _run(self, delay):
+        if delay:
+            time.sleep(delay)
+        self.state = WARMING
+        self.started_at = time.time()
+        try:
+            for name, fn in self.steps:
+                start = time.time()
+                fn()
+                self.timings[name] = round(time.time() - start, 3)
+            self.state = READY
+        except Exception as e:
+            self.state = FAILED
+            self.error = str(e)
+            traceback.print_exc()
+        self.finished_at = time.time()
+        print(f"[INFO] Riscaldamento {self.state}: {self.timings}")
+
+    def status(self):
+        return {
+            'state': self.state,
+            'timings': dict(self.timings),
+            'error': self.error,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }